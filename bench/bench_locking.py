@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the overhead of the readers/writer protocol: number of redis
+round-trips and latency per (uncontended) @reader/@writer call.
+
+The previous, step-by-step implementation of the protocol (setnx/expire
+locks mutex1, mutex2, mutex3 plus watch/get/multi/del releases) is
+reproduced below as a reference, such that both implementations can be
+compared against the same redis server.
+
+Usage:
+    python bench/bench_locking.py [-n ITERATIONS] [--host HOST] [--port PORT]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from functools import wraps
+
+import redis
+
+
+class CountingConnection(redis.Connection):
+    """
+    Redis connection that counts round-trips, i.e., commands (or pipelines)
+    sent to the server.
+    """
+    roundtrips = 0
+
+    def send_packed_command(self, *args, **kwargs):
+        CountingConnection.roundtrips += 1
+        return redis.Connection.send_packed_command(self, *args, **kwargs)
+
+
+def legacy_acquire(conn, lockname, identifier, acq_timeout=15, timeout=20):
+    end = time.time() + acq_timeout
+    while end > time.time():
+        if conn.setnx(lockname, identifier):
+            conn.expire(lockname, timeout)
+            return identifier
+        elif not conn.ttl(lockname):
+            conn.expire(lockname, timeout)
+        time.sleep(.001)
+    return False
+
+
+def legacy_release(conn, lockname, identifier):
+    pipe = conn.pipeline(True)
+    pipe.watch(lockname)
+    if pipe.get(lockname) == identifier:
+        pipe.multi()
+        pipe.delete(lockname)
+        pipe.execute()
+        return True
+    pipe.unwatch()
+    return False
+
+
+class legacy_lock(object):
+
+    def __init__(self, conn, lockname):
+        self.conn = conn
+        self.lockname = lockname
+        self.identifier = 'pid{0}_{1}'.format(os.getpid(), uuid.uuid4())
+
+    def __enter__(self):
+        legacy_acquire(self.conn, self.lockname, self.identifier)
+
+    def __exit__(self, *args):
+        legacy_release(self.conn, self.lockname, self.identifier)
+
+
+def legacy_reader(f):
+    """ @reader as implemented up to version 0.3.3 """
+    @wraps(f)
+    def func_wrapper(self, *args, **kwargs):
+        conn = self.conn
+        w = 'w__{}'.format(self.file)
+        readcount = 'readcount__{}'.format(self.file)
+        with legacy_lock(conn, 'mutex3__{}'.format(self.file)):
+            with legacy_lock(conn, 'r__{}'.format(self.file)):
+                with legacy_lock(conn, 'mutex1__{}'.format(self.file)):
+                    if conn.incr(readcount) == 1:
+                        legacy_acquire(conn, w, 'id_reader')
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            with legacy_lock(conn, 'mutex1__{}'.format(self.file)):
+                if conn.decr(readcount) == 0:
+                    legacy_release(conn, w, 'id_reader')
+    return func_wrapper
+
+
+def legacy_writer(f):
+    """ @writer as implemented up to version 0.3.3 """
+    @wraps(f)
+    def func_wrapper(self, *args, **kwargs):
+        conn = self.conn
+        r = 'r__{}'.format(self.file)
+        writecount = 'writecount__{}'.format(self.file)
+        with legacy_lock(conn, 'mutex2__{}'.format(self.file)):
+            if conn.incr(writecount) == 1:
+                legacy_acquire(conn, r, 'id_writer')
+        try:
+            with legacy_lock(conn, 'w__{}'.format(self.file)):
+                return f(self, *args, **kwargs)
+        finally:
+            with legacy_lock(conn, 'mutex2__{}'.format(self.file)):
+                if conn.decr(writecount) == 0:
+                    legacy_release(conn, r, 'id_writer')
+    return func_wrapper
+
+
+def make_resource(reader, writer):
+    class Resource(object):
+        def __init__(self, name, conn):
+            self.file = name
+            self.conn = conn
+
+        @reader
+        def read(self):
+            pass
+
+        @writer
+        def write(self):
+            pass
+    return Resource
+
+
+def measure(func, iterations):
+    """
+    Returns (round-trips per call, mean latency per call in microseconds)
+    """
+    func()  # warm up (e.g., loads lua scripts)
+    CountingConnection.roundtrips = 0
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    elapsed = time.time() - start
+    return (CountingConnection.roundtrips / float(iterations),
+            elapsed / iterations * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=1000)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    pool = redis.ConnectionPool(host=args.host, port=args.port, db=0,
+                                decode_responses=True,
+                                connection_class=CountingConnection)
+    conn = redis.StrictRedis(connection_pool=pool)
+    locking.redis_conn = conn
+
+    resname = 'bench_locking_{0}'.format(uuid.uuid4())
+    implementations = [
+        ('before (0.3.3)', make_resource(legacy_reader, legacy_writer)),
+        ('lua scripts', make_resource(locking.reader, locking.writer)),
+    ]
+    print("{0:<16}{1:>10}{2:>14}{3:>16}".format(
+        'protocol', 'operation', 'round-trips', 'latency [us]'))
+    for name, cls in implementations:
+        resource = cls(resname, conn)
+        for op in ('read', 'write'):
+            roundtrips, latency = measure(getattr(resource, op),
+                                          args.iterations)
+            print("{0:<16}{1:>10}{2:>14.1f}{3:>16.1f}".format(
+                name, op, roundtrips, latency))
+
+    for key in conn.keys('*{0}'.format(resname)):
+        conn.delete(key)
+
+
+if __name__ == '__main__':
+    # add parent directory to python path such that we can import modules
+    HERE = os.path.dirname(os.path.realpath(__file__))
+    PROJ_PATH = os.path.abspath(os.path.join(HERE, '../'))
+    sys.path.insert(0, PROJ_PATH)
+
+    from h5pyswmr import locking
+
+    main()
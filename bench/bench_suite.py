@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite: per-call overhead of h5pySWMR compared to raw h5py,
+read/write throughput and latencies under contention (1 to N processes).
+Results are printed and written to a JSON file, such that regressions can
+be tracked.
+
+Benchmarks:
+
+* overhead: small attribute reads, metadata calls (shape, group keys) and
+  large hyperslab reads/writes, per call, compared to h5py with the file
+  kept open and h5py opening the file for every call. Note that metadata
+  and attributes of h5pySWMR are cached until the file is modified.
+* throughput: sequential block-wise read and write of a dataset (MB/s).
+* contention: READERS reader processes (for every value of --processes)
+  and --writers writer processes access the same file for --duration
+  seconds. Reports operations per second and latency percentiles of
+  readers and writers. With --fairness, the contention benchmark is run
+  for every given fairness policy (cf. locking.FairRedisBackend; 'none'
+  is the default protocol with writer preference), such that the tail
+  latencies of the policies can be compared.
+
+By default, a redis server is started on a free port (redis-server must be
+on the PATH). Use --redis URL to use a running server instead, or
+--backend fcntl to use fcntlbackend.FcntlBackend (no redis required).
+
+Usage:
+    python bench/bench_suite.py [-o results.json] [--redis URL]
+        [--backend {redis,fcntl}] [--processes 1,2,4,8] [--writers 1]
+        [--duration 3] [--fairness none,fifo,phase_fair] [--quick]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+
+# ===============================================================
+# --- harness
+# ===============================================================
+
+class RedisServer(object):
+    """
+    Context manager running a throw-away redis server (without persistence)
+    on a free port.
+    """
+
+    def __init__(self, executable='redis-server'):
+        self.executable = shutil.which(executable)
+        if self.executable is None:
+            raise RuntimeError("{0} not found, use --redis URL or --backend "
+                               "fcntl".format(executable))
+        self.process = None
+        self.tmpdir = None
+        self.url = None
+
+    def __enter__(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.tmpdir = tempfile.mkdtemp(prefix='h5pyswmr-bench-redis')
+        self.process = subprocess.Popen(
+            [self.executable, '--port', str(port), '--bind', '127.0.0.1',
+             '--save', '', '--appendonly', 'no', '--dir', self.tmpdir],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.url = 'redis://127.0.0.1:{0}/0'.format(port)
+        end = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.1).close()
+                break
+            except OSError:
+                if time.time() > end or self.process.poll() is not None:
+                    self.__exit__()
+                    raise RuntimeError("could not start redis server")
+                time.sleep(0.05)
+        return self
+
+    def __exit__(self, *args):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def setup_backend(backend, url, fairness='none'):
+    """
+    Configures h5pySWMR (in the current process) to use the redis server at
+    ``url`` (with fairness policy ``fairness``) or the fcntl backend.
+    """
+    from h5pyswmr import locking
+    if backend == 'fcntl':
+        from h5pyswmr.fcntlbackend import FcntlBackend
+        locking.lock_backend = FcntlBackend()
+    else:
+        locking.configure(url=url)
+        if fairness == 'none':
+            locking.lock_backend = locking.RedisBackend()
+        else:
+            locking.lock_backend = locking.FairRedisBackend(fairness)
+
+
+def percentiles(values):
+    """
+    Returns summary statistics (in milliseconds) of latencies in seconds.
+    """
+    if not values:
+        return None
+    values = np.asarray(values) * 1e3
+    return {'count': len(values), 'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
+
+
+def measure(func, iterations):
+    """
+    Calls ``func`` ``iterations`` times (after a warm-up call) and returns
+    latency statistics.
+    """
+    func()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def create_file(filename, rows, cols, chunk_rows):
+    with h5py.File(filename, 'w') as f:
+        dset = f.create_dataset('large', shape=(rows, cols), dtype='f8',
+                                chunks=(chunk_rows, cols))
+        dset[...] = np.random.random((rows, cols))
+        dset.attrs['units'] = 'm/s'
+        grp = f.create_group('group')
+        for i in range(10):
+            grp.create_dataset('dataset{0}'.format(i), data=np.arange(10))
+        f.create_dataset('small', shape=(100000, 16), dtype='f8',
+                         maxshape=(None, 16), chunks=(1024, 16))
+
+
+# ===============================================================
+# --- benchmarks
+# ===============================================================
+
+def bench_overhead(filename, args):
+    """
+    Per-call latency of h5py (file kept open / opened per call) and
+    h5pySWMR.
+    """
+    from h5pyswmr import File, handles
+
+    n = args.iterations
+    rows = args.slab_rows
+    data = np.random.random((rows, args.cols))
+
+    def ops(open_read, open_write):
+        def attr():
+            with open_read() as f:
+                return f['large'].attrs['units']
+
+        def shape():
+            with open_read() as f:
+                return f['large'].shape
+
+        def keys():
+            with open_read() as f:
+                return list(f['group'].keys())
+
+        def read():
+            with open_read() as f:
+                return f['large'][0:rows]
+
+        def write():
+            with open_write() as f:
+                f['large'][0:rows] = data
+
+        return [('attr_read', attr, n), ('shape', shape, n),
+                ('group_keys', keys, n), ('hyperslab_read', read, n // 10),
+                ('hyperslab_write', write, n // 10)]
+
+    results = []
+
+    # h5py, file kept open
+    f = h5py.File(filename, 'r+', **_h5py_kwargs())
+    kept_open = _Reuse(f)
+    for op, func, iterations in ops(kept_open, kept_open):
+        results.append({'op': op, 'impl': 'h5py',
+                        'latency_ms': measure(func, max(1, iterations))})
+    f.close()
+
+    # h5py, file opened for every call
+    for op, func, iterations in ops(
+            lambda: h5py.File(filename, 'r', **_h5py_kwargs()),
+            lambda: h5py.File(filename, 'r+', **_h5py_kwargs())):
+        results.append({'op': op, 'impl': 'h5py_reopen',
+                        'latency_ms': measure(func, max(1, iterations))})
+
+    # h5pySWMR (every call acquires its own lock)
+    f = File(filename, 'r')
+    swmr = _Reuse(f)
+    for op, func, iterations in ops(swmr, swmr):
+        results.append({'op': op, 'impl': 'h5pyswmr',
+                        'latency_ms': measure(func, max(1, iterations))})
+    handles.clear()
+
+    baseline = dict((r['op'], r['latency_ms']['mean']) for r in results
+                    if r['impl'] == 'h5py')
+    for r in results:
+        r['overhead'] = r['latency_ms']['mean'] / baseline[r['op']]
+    return results
+
+
+class _Reuse(object):
+    """
+    Context manager factory returning an already opened file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self):
+        return self
+
+    def __enter__(self):
+        return self.f
+
+    def __exit__(self, *args):
+        pass
+
+
+def _h5py_kwargs():
+    from h5pyswmr import handles
+    return {'locking': False} if handles._LOCKING_KWARG else {}
+
+
+def bench_throughput(filename, args):
+    """
+    Sequential block-wise read and write of the large dataset (MB/s).
+    """
+    from h5pyswmr import File, handles
+
+    rows = args.slab_rows
+    results = []
+    with h5py.File(filename, 'r', **_h5py_kwargs()) as f:
+        dset = f['large']
+        nbytes = dset.size * dset.dtype.itemsize
+        total_rows = dset.shape[0]
+        block = np.random.random((rows, dset.shape[1]))
+
+    def h5py_read():
+        with h5py.File(filename, 'r', **_h5py_kwargs()) as f:
+            dset = f['large']
+            for start in range(0, total_rows, rows):
+                dset[start:start + rows]
+
+    def h5py_write():
+        with h5py.File(filename, 'r+', **_h5py_kwargs()) as f:
+            dset = f['large']
+            for start in range(0, total_rows, rows):
+                dset[start:start + rows] = block[:min(rows,
+                                                      total_rows - start)]
+
+    def swmr_read():
+        for _ in File(filename, 'r')['large'].iter_blocks(rows):
+            pass
+
+    def swmr_write():
+        dset = File(filename, 'r')['large']
+        for start in range(0, total_rows, rows):
+            dset[start:start + rows] = block[:min(rows, total_rows - start)]
+
+    for impl, op, func in [('h5py', 'read', h5py_read),
+                           ('h5py', 'write', h5py_write),
+                           ('h5pyswmr', 'read', swmr_read),
+                           ('h5pyswmr', 'write', swmr_write)]:
+        handles.clear()
+        stats = measure(func, args.repeat)
+        results.append({'op': op, 'impl': impl, 'latency_ms': stats,
+                        'mb_per_s': nbytes / 2**20 / (stats['mean'] / 1e3)})
+    handles.clear()
+    return results
+
+
+def _contention_worker(filename, backend, url, fairness, role, think,
+                       start_at, until, queue):
+    setup_backend(backend, url, fairness)
+    from h5pyswmr import File
+    dset = File(filename, 'r')['small']
+    rows = 16
+    data = np.random.random((rows, dset.shape[1]))
+    nrows = dset.shape[0]
+    rng = np.random.RandomState(os.getpid())
+    latencies = []
+    errors = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < until:
+        start = rng.randint(0, nrows - rows)
+        t0 = time.perf_counter()
+        try:
+            if role == 'reader':
+                dset[start:start + rows]
+            else:
+                dset[start:start + rows] = data
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        if think:
+            time.sleep(think)
+    queue.put((role, latencies, errors))
+
+
+def bench_contention(filename, args, url, fairness='none'):
+    """
+    Readers and writers accessing the same dataset concurrently.
+    """
+    results = []
+    for readers in args.processes:
+        queue = multiprocessing.Queue()
+        start_at = time.time() + 0.5 + 0.05 * (readers + args.writers)
+        until = start_at + args.duration
+        roles = ['reader'] * readers + ['writer'] * args.writers
+        jobs = [multiprocessing.Process(
+                    target=_contention_worker,
+                    args=(filename, args.backend, url, fairness, role,
+                          args.writer_think if role == 'writer' else 0,
+                          start_at, until, queue))
+                for role in roles]
+        for p in jobs:
+            p.start()
+        collected = {'reader': ([], 0), 'writer': ([], 0)}
+        for _ in jobs:
+            role, latencies, errors = queue.get()
+            lat, err = collected[role]
+            collected[role] = (lat + latencies, err + errors)
+        for p in jobs:
+            p.join()
+        entry = {'readers': readers, 'writers': args.writers,
+                 'fairness': fairness}
+        for role in ('reader', 'writer'):
+            latencies, errors = collected[role]
+            entry[role + 's_stats'] = {
+                'ops_per_s': len(latencies) / args.duration,
+                'errors': errors,
+                'latency_ms': percentiles(latencies)}
+        results.append(entry)
+    return results
+
+
+# ===============================================================
+# --- main
+# ===============================================================
+
+def run(args, url):
+    setup_backend(args.backend, url)
+    from h5pyswmr import handles
+    tmpdir = tempfile.mkdtemp(prefix='h5pyswmr-bench')
+    try:
+        filename = os.path.join(tmpdir, 'bench.h5')
+        create_file(filename, args.rows, args.cols, args.chunk_rows)
+        results = {
+            'meta': {
+                'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'h5py': h5py.version.version,
+                'hdf5': h5py.version.hdf5_version,
+                'host': platform.node(),
+                'backend': args.backend,
+                'args': vars(args),
+            },
+        }
+        if 'overhead' in args.benchmarks:
+            results['overhead'] = bench_overhead(filename, args)
+            _print_table('overhead (latency per call, ms)',
+                         results['overhead'])
+        if 'throughput' in args.benchmarks:
+            results['throughput'] = bench_throughput(filename, args)
+            _print_table('throughput (whole dataset)', results['throughput'],
+                         extra='mb_per_s')
+        if 'contention' in args.benchmarks:
+            results['contention'] = []
+            for fairness in args.fairness:
+                handles.clear()
+                results['contention'].extend(
+                    bench_contention(filename, args, url, fairness))
+            _print_contention(results['contention'])
+        return results
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _print_table(title, rows, extra='overhead'):
+    print('\n' + title)
+    print('{0:<18}{1:<14}{2:>10}{3:>10}{4:>10}{5:>12}'.format(
+        'operation', 'impl', 'mean', 'p50', 'p99', extra))
+    for r in rows:
+        stats = r['latency_ms']
+        print('{0:<18}{1:<14}{2:>10.3f}{3:>10.3f}{4:>10.3f}{5:>12.2f}'.format(
+            r['op'], r['impl'], stats['mean'], stats['p50'], stats['p99'],
+            r[extra]))
+
+
+def _print_contention(rows):
+    print('\ncontention (latency in ms)')
+    print('{0:<12}{1:>8}{2:>8}  {3:<8}{4:>10}{5:>9}{6:>9}{7:>9}{8:>9}{9:>7}'
+          .format('fairness', 'readers', 'writers', 'role', 'ops/s', 'p50',
+                  'p90', 'p99', 'max', 'errors'))
+    for r in rows:
+        for role in ('reader', 'writer'):
+            stats = r[role + 's_stats']
+            lat = stats['latency_ms']
+            if lat is None:
+                continue
+            print('{0:<12}{1:>8}{2:>8}  {3:<8}{4:>10.1f}{5:>9.2f}{6:>9.2f}'
+                  '{7:>9.2f}{8:>9.2f}{9:>7}'.format(
+                      r['fairness'], r['readers'], r['writers'], role,
+                      stats['ops_per_s'], lat['p50'], lat['p90'], lat['p99'],
+                      lat['max'], stats['errors']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default='bench_results.json',
+                        help='JSON output file')
+    parser.add_argument('--redis', metavar='URL',
+                        help='use a running redis server')
+    parser.add_argument('--backend', choices=('redis', 'fcntl'),
+                        default='redis')
+    parser.add_argument('--benchmarks', default='overhead,throughput,'
+                        'contention', help='comma separated list')
+    parser.add_argument('-n', '--iterations', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repetitions of throughput benchmarks')
+    parser.add_argument('--rows', type=int, default=8192)
+    parser.add_argument('--cols', type=int, default=1024)
+    parser.add_argument('--chunk-rows', type=int, default=64)
+    parser.add_argument('--slab-rows', type=int, default=512,
+                        help='rows per hyperslab read/write')
+    parser.add_argument('--processes', default='1,2,4,8',
+                        help='numbers of reader processes')
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--writer-think', type=float, default=0.005,
+                        help='pause of writers between writes (seconds)')
+    parser.add_argument('--duration', type=float, default=3.)
+    parser.add_argument('--fairness', default='none',
+                        help='comma separated list of fairness policies of '
+                        'the contention benchmark (none, fifo, phase_fair; '
+                        'redis backend only)')
+    parser.add_argument('--quick', action='store_true',
+                        help='small sizes, for smoke tests')
+    args = parser.parse_args()
+    args.benchmarks = args.benchmarks.split(',')
+    args.processes = [int(n) for n in args.processes.split(',')]
+    args.fairness = args.fairness.split(',')
+    for fairness in args.fairness:
+        if fairness not in ('none', 'fifo', 'phase_fair'):
+            parser.error("invalid fairness policy {0!r}".format(fairness))
+    if args.backend == 'fcntl' and args.fairness != ['none']:
+        parser.error("--fairness requires the redis backend")
+    if args.quick:
+        args.iterations = 50
+        args.repeat = 2
+        args.rows = 1024
+        args.cols = 256
+        args.slab_rows = 128
+        args.processes = [1, 2]
+        args.duration = 0.5
+
+    if args.backend == 'fcntl' or args.redis is not None:
+        results = run(args, args.redis)
+    else:
+        with RedisServer() as server:
+            results = run(args, server.url)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nresults written to {0}'.format(args.output))
+
+
+if __name__ == '__main__':
+    # add parent directory to python path such that we can import modules
+    HERE = os.path.dirname(os.path.realpath(__file__))
+    PROJ_PATH = os.path.abspath(os.path.join(HERE, '../'))
+    sys.path.insert(0, PROJ_PATH)
+
+    main()
@@ -10,7 +10,11 @@ from __future__ import absolute_import
 __version__ = "0.3.3"
 
 try:
-    from h5pyswmr.h5pyswmr import File, Node, Dataset, Group
+    from h5pyswmr.h5pyswmr import (File, Node, Dataset, Group,
+                                   FileModifiedError)
+    from h5pyswmr.writebuffer import WriteBuffer
+    from h5pyswmr.appender import Appender
+    from h5pyswmr.locking import configure
     from h5pyswmr.test import test_api, test_locks, test_parallel
 except ImportError:
     # imports fail during setup.py
@@ -0,0 +1,650 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio API: AsyncFile, AsyncGroup, AsyncDataset and AsyncAttributeManager
+wrap File, Group, Dataset and AttributeManager. Their operations are
+coroutines, which never block the event loop.
+
+Example:
+    from h5pyswmr import aio
+
+    async def handler(request):
+        async with aio.AsyncFile('data.h5', 'r') as f:
+            dst = await f.get('/timeseries')
+            data = await dst.read(np.s_[0:100])
+            units = await dst.attrs.get('units')
+
+Locks of the redis backend are acquired using redis.asyncio, i.e., waiting
+tasks are suspended until a lock is released (cf. locking.wait_for()). They
+are renewed by the lease keeper like all other locks of the process. HDF5
+I/O is performed by a bounded thread pool (MAX_WORKERS threads), whose
+threads adopt the locks of the calling task (cf.
+locking.adopted_session()).
+
+Other lock backends (e.g., fcntlbackend.FcntlBackend) acquire their locks
+in the thread pool. Files in SWMR mode are accessed using the synchronous
+API in the thread pool, read/write sessions are not supported for them.
+
+Requires Python >= 3.7 and redis-py >= 4.2 (redis.asyncio).
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import redis.asyncio
+
+from . import exithandler, instrumentation, locking
+from .locking import LockException, add_lease, remove_lease
+from .h5pyswmr import File, Group, Dataset
+
+
+# maximum number of threads performing HDF5 I/O
+MAX_WORKERS = 8
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# locks held by the current task: file name => (mode, generation)
+_held = contextvars.ContextVar('h5pyswmr_held', default={})
+
+# redis.asyncio clients are bound to an event loop:
+# loop => (locking.redis_conn, client, scripts)
+_clients = weakref.WeakKeyDictionary()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                # threads do not survive forking
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS,
+                    thread_name_prefix='h5pyswmr-aio')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+async def _in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def _in_executor_shielded(func, *args, cleanup=None):
+    """
+    Like _in_executor(), but if the current task is cancelled, waits until
+    ``func`` has returned (threads cannot be interrupted) before raising
+    CancelledError. In that case, ``cleanup`` (if not None) is called in the
+    thread pool with the return value of ``func``, e.g., to release a lock
+    that ``func`` has acquired.
+    """
+    future = asyncio.ensure_future(_in_executor(func, *args))
+    cancelled = False
+    while not future.done():
+        try:
+            await asyncio.wait((future, ))
+        except asyncio.CancelledError:
+            cancelled = True
+    if not cancelled:
+        return future.result()
+    if future.exception() is None and cleanup is not None:
+        await _in_executor_shielded(cleanup, future.result())
+    raise asyncio.CancelledError()
+
+
+def _client():
+    """
+    Returns the redis.asyncio client (connected to the same server as
+    locking.redis_conn) and the lock scripts of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(loop)
+    if entry is None or entry[0] is not locking.redis_conn:
+        client = _async_client(locking.redis_conn)
+        scripts = dict(
+            (name, _timed_script(client.register_script(
+                getattr(locking, name)), name.strip('_').lower()))
+            for name in ('_READER_ENTER', '_READER_EXIT', '_WRITER_ENTER',
+                         '_WRITER_ACQUIRE', '_WRITER_EXIT'))
+        entry = (locking.redis_conn, client, scripts)
+        _clients[loop] = entry
+    return entry[1], entry[2]
+
+
+def _timed_script(script, name):
+    """
+    Coroutine version of instrumentation.timed_script().
+    """
+    async def call(keys=[], args=[]):
+        if not instrumentation.hooks:
+            return await script(keys=keys, args=args)
+        start = time.perf_counter()
+        try:
+            return await script(keys=keys, args=args)
+        finally:
+            filename = instrumentation.split_lockname(keys[0])[0]
+            instrumentation.emit('round_trip', filename, name,
+                                 time.perf_counter() - start)
+
+    return call
+
+
+async def close():
+    """
+    Closes the redis connections of the running event loop. Should be
+    called before the event loop is closed.
+    """
+    entry = _clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].connection_pool.disconnect()
+
+
+def _async_client(conn):
+    pool = conn.connection_pool
+    if issubclass(pool.connection_class, redis.UnixDomainSocketConnection):
+        connection_class = redis.asyncio.UnixDomainSocketConnection
+    elif issubclass(pool.connection_class, redis.SSLConnection):
+        connection_class = redis.asyncio.SSLConnection
+    else:
+        connection_class = redis.asyncio.Connection
+    async_pool = redis.asyncio.ConnectionPool(
+        connection_class=connection_class,
+        max_connections=pool.max_connections, **pool.connection_kwargs)
+    return redis.asyncio.Redis(connection_pool=async_pool)
+
+
+async def _wait_for(client, attempt, locknames, acq_timeout):
+    """
+    Coroutine version of locking.wait_for().
+    """
+    result = await attempt()
+    if result is not None and result is not False:
+        locking._record_wait(locknames[0], 0.)
+        return result
+
+    start = time.time()
+    end = start + acq_timeout
+    retries = 1
+    pubsub = None
+    try:
+        if locking.WAIT_MODE == 'pubsub':
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(*[locking.notify_channel(name)
+                                     for name in locknames])
+        while True:
+            result = await attempt()
+            if result is not None and result is not False:
+                locking._record_wait(locknames[0], time.time() - start,
+                                     retries=retries)
+                return result
+            retries += 1
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            if pubsub is not None:
+                await pubsub.get_message(
+                    timeout=min(remaining, locking.WAIT_POLL_INTERVAL))
+            else:
+                await asyncio.sleep(.001)
+    finally:
+        if pubsub is not None:
+            # aclose() replaces reset() in redis-py >= 5.0.1
+            await getattr(pubsub, 'aclose', pubsub.reset)()
+
+    locking._record_wait(locknames[0], time.time() - start, timed_out=True,
+                         retries=retries)
+    return None
+
+
+async def _acquire_read(filename, acq_timeout):
+    """
+    Coroutine version of locking.RedisBackend.acquire_read().
+    """
+    client, scripts = _client()
+    readers = 'readers__{}'.format(filename)
+    r = 'r__{}'.format(filename)
+    w = 'w__{}'.format(filename)
+    generation = 'generation__{}'.format(filename)
+    writers = 'writers__{}'.format(filename)
+    epoch = 'epoch__{}'.format(filename)
+    client_id = locking._client_id()
+    reaped = [time.time()]
+
+    async def enter():
+        if time.time() - reaped[0] > locking.REAP_INTERVAL:
+            reaped[0] = time.time()
+            await _in_executor(locking.reap_writers, filename)
+        return await scripts['_READER_ENTER'](
+            keys=[r, w, readers, generation, writers, epoch],
+            args=[locking._lock_timeout_ms(), locking.WRITELOCK_ID,
+                  client_id, locking._new_epoch()])
+
+    generation_val = await _wait_for(client, enter, [r, w], acq_timeout)
+    if generation_val is None:
+        raise LockException("could not acquire lock {0} or {1}".format(r, w))
+    leases = [add_lease(locking.redis_conn, w, locking.WRITELOCK_ID),
+              add_lease(locking.redis_conn, readers, client_id)]
+    return (client_id, leases), generation_val
+
+
+async def _release_read(filename, token):
+    client_id, leases = token
+    for lease in leases:
+        remove_lease(lease)
+    _, scripts = _client()
+    w = 'w__{}'.format(filename)
+    if not await scripts['_READER_EXIT'](
+            keys=[w, 'readers__{}'.format(filename)],
+            args=[locking.WRITELOCK_ID, client_id]):
+        print("Warning: {0} was lost or was not "
+              "acquired in the first place".format(w))
+
+
+async def _acquire_write(filename, acq_timeout):
+    """
+    Coroutine version of locking.RedisBackend.acquire_write().
+    """
+    client, scripts = _client()
+    r = 'r__{}'.format(filename)
+    w = 'w__{}'.format(filename)
+    writers = 'writers__{}'.format(filename)
+    keys = [r, w, writers, 'readers__{}'.format(filename)]
+    identifier = locking._client_id()
+    args = [locking._lock_timeout_ms(), locking.READLOCK_ID, identifier,
+            locking.WRITELOCK_ID]
+    reaped = [time.time()]
+
+    async def acquire():
+        if time.time() - reaped[0] > locking.REAP_INTERVAL:
+            reaped[0] = time.time()
+            await _in_executor(locking.reap_readers, filename)
+        return bool(await scripts['_WRITER_ACQUIRE'](keys=keys, args=args))
+
+    leases = []
+    try:
+        w_acquired = await scripts['_WRITER_ENTER'](keys=keys, args=args)
+        leases.append(add_lease(locking.redis_conn, writers, identifier))
+        leases.append(add_lease(locking.redis_conn, r, locking.READLOCK_ID))
+        if w_acquired:
+            locking._record_wait(w, 0.)
+        elif not await _wait_for(client, acquire, [w], acq_timeout):
+            raise LockException("could not acquire lock {0}".format(w))
+        leases.append(add_lease(locking.redis_conn, w, identifier))
+    except BaseException:
+        for lease in leases:
+            remove_lease(lease)
+        if leases:
+            await asyncio.shield(_writer_exit(filename, identifier,
+                                              acquired=False))
+        raise
+    return identifier, leases
+
+
+async def _release_write(filename, token):
+    identifier, leases = token
+    for lease in leases:
+        remove_lease(lease)
+    lost = await _writer_exit(filename, identifier)
+    if lost & 2:
+        print("Warning: {0} was lost or was not "
+              "acquired in the first place".format('r__' + filename))
+    if lost & 1:
+        raise LockException("lock w__{0} was lost".format(filename))
+
+
+async def _writer_exit(filename, identifier, acquired=True):
+    _, scripts = _client()
+    return await scripts['_WRITER_EXIT'](
+        keys=['r__{}'.format(filename), 'w__{}'.format(filename),
+              'writers__{}'.format(filename),
+              'generation__{}'.format(filename),
+              'epoch__{}'.format(filename)],
+        args=[locking.READLOCK_ID, identifier, '1' if acquired else '',
+              locking._new_epoch()])
+
+
+@contextlib.asynccontextmanager
+async def session(filename, mode, acq_timeout=None):
+    """
+    Asynchronous version of locking.session(): the lock is owned by the
+    current task (and by tasks created within the block). Nested sessions
+    do not acquire the lock again.
+
+    Args:
+        filename: file name of the HDF5 file
+        mode: 'r' or 'w'
+        acq_timeout: timeout in seconds (locking.ACQ_TIMEOUT by default)
+    """
+    if mode not in ('r', 'w'):
+        raise ValueError("invalid session mode {0!r}".format(mode))
+    if locking.swmr_enabled(filename):
+        raise NotImplementedError("sessions of files in SWMR mode are not "
+                                  "supported by the asyncio API")
+    held = _held.get()
+    entry = held.get(filename)
+    if entry is not None:
+        if entry[0] != 'w' and mode == 'w':
+            raise LockException("cannot write to {0} while holding a read "
+                                "lock".format(filename))
+        yield
+        return
+
+    if acq_timeout is None:
+        acq_timeout = locking.ACQ_TIMEOUT
+    backend = locking.lock_backend
+    # note that the asyncio protocol is that of RedisBackend (not of its
+    # subclasses)
+    redis_backend = type(backend) is locking.RedisBackend
+    generation = None
+    start = time.perf_counter() if instrumentation.hooks else None
+    if mode == 'r':
+        if redis_backend:
+            token, generation = await _acquire_read(filename, acq_timeout)
+        else:
+            # a lock acquired by a cancelled task must not be lost
+            token, generation = await _in_executor_shielded(
+                backend.acquire_read, filename, acq_timeout,
+                cleanup=lambda result: backend.release_read(filename,
+                                                            result[0]))
+    else:
+        if redis_backend:
+            token = await _acquire_write(filename, acq_timeout)
+        else:
+            token = await _in_executor_shielded(
+                backend.acquire_write, filename, acq_timeout,
+                cleanup=functools.partial(backend.release_write, filename))
+    lock = 'read' if mode == 'r' else 'write'
+    if start is not None:
+        start = locking._report_acquire(filename, lock, start)
+
+    # tokens of redis locks acquired by this module are valid tokens of the
+    # (synchronous) redis backend, i.e., the cleanup registry can release
+    # them at process exit
+    sync_release = functools.partial(
+        backend.release_read if mode == 'r' else backend.release_write,
+        filename, token)
+    key = exithandler.register(sync_release, locking.APPEND_SIGHANDLER)
+    held = dict(held)
+    held[filename] = (mode, generation)
+    reset = _held.set(held)
+    try:
+        yield
+    finally:
+        _held.reset(reset)
+        if start is not None:
+            locking._report_hold(filename, lock, start)
+        if exithandler.unregister(key):
+            # the lock must be released even if the task is cancelled
+            if redis_backend:
+                release = (_release_read if mode == 'r' else _release_write)(
+                    filename, token)
+            else:
+                release = _in_executor(sync_release)
+            await asyncio.shield(release)
+
+
+async def _run(filename, mode, func, *args, **kwargs):
+    """
+    Calls ``func`` in the thread pool while holding a lock (mode 'r' or
+    'w') on file ``filename``.
+    """
+    if locking.swmr_enabled(filename):
+        # func acquires its lock (or SWMR mutex) itself
+        return await _in_executor(func, *args, **kwargs)
+    async with session(filename, mode):
+        mode, generation = _held.get()[filename]
+        # if the task is cancelled, the lock is released only after func
+        # has returned
+        return await _in_executor_shielded(
+            _adopted, filename, mode, generation,
+            functools.partial(func, *args, **kwargs))
+
+
+def _adopted(filename, mode, generation, func):
+    with locking.adopted_session(filename, mode, generation):
+        return func()
+
+
+def _wrap(node):
+    if isinstance(node, Group):
+        return AsyncGroup(node)
+    elif isinstance(node, Dataset):
+        return AsyncDataset(node)
+    raise TypeError('not implemented!')
+
+
+class AsyncNode(object):
+    """
+    Wrapper for Node
+    """
+
+    def __init__(self, node):
+        """
+        Args:
+            node: Node object
+        """
+        self._node = node
+
+    @property
+    def file(self):
+        return self._node.file
+
+    @property
+    def path(self):
+        return self._node.path
+
+    @property
+    def attrs(self):
+        return AsyncAttributeManager(self._node.attrs)
+
+    async def _run(self, mode, func, *args, **kwargs):
+        return await _run(self.file, mode, func, *args, **kwargs)
+
+
+class AsyncGroup(AsyncNode):
+    """
+    Wrapper for Group
+    """
+
+    def __repr__(self):
+        return "<async HDF5 Group (path={0})>".format(self.path)
+
+    async def get(self, key):
+        """
+        Returns the AsyncGroup or AsyncDataset ``key``.
+
+        Raises:
+            KeyError if the object does not exist
+        """
+        return _wrap(await self._run('r', self._node.__getitem__, key))
+
+    async def keys(self):
+        return await self._run('r', self._node.keys)
+
+    async def contains(self, key):
+        return await self._run('r', self._node.__contains__, key)
+
+    async def create_group(self, name):
+        return _wrap(await self._run('w', self._node.create_group, name))
+
+    async def require_group(self, name):
+        return _wrap(await self._run('w', self._node.require_group, name))
+
+    async def create_dataset(self, **kwargs):
+        return _wrap(await self._run('w', self._node.create_dataset,
+                                     **kwargs))
+
+    async def require_dataset(self, **kwargs):
+        return _wrap(await self._run('w', self._node.require_dataset,
+                                     **kwargs))
+
+    async def delete(self, key):
+        await self._run('w', self._node.__delitem__, key)
+
+    async def read_many(self, selections, out=None):
+        """
+        cf. Group.read_many()
+        """
+        return await self._run('r', self._node.read_many, selections,
+                               out=out)
+
+    async def write_many(self, **kwargs):
+        """
+        cf. Group.write_many()
+        """
+        await self._run('w', self._node.write_many, **kwargs)
+
+
+class AsyncFile(AsyncGroup):
+    """
+    Wrapper for File. The file is opened (or created) by open() or when
+    entering an async with block:
+
+        async with AsyncFile('test.h5', 'a') as f:
+            ...
+
+        f = await AsyncFile('test.h5', 'r').open()
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Args:
+            args, kwargs: cf. File
+        """
+        AsyncGroup.__init__(self, None)
+        self._args = args
+        self._kwargs = kwargs
+
+    @property
+    def file(self):
+        return self._args[0]
+
+    @property
+    def path(self):
+        return '/'
+
+    def __repr__(self):
+        return "<async HDF5 File ({0})>".format(self.file)
+
+    async def open(self):
+        """
+        Opens (or creates) the file.
+
+        Returns:
+            self
+        """
+        if len(self._args) > 1:
+            mode = self._args[1]
+        else:
+            mode = self._kwargs.get('mode', 'r')
+        if (self._kwargs.get('backend') == 'swmr'
+                or locking.swmr_enabled(self.file)):
+            self._node = await _in_executor(File, *self._args,
+                                            **self._kwargs)
+        else:
+            self._node = await _run(self.file, 'r' if mode == 'r' else 'w',
+                                    File, *self._args, **self._kwargs)
+        return self
+
+    async def __aenter__(self):
+        if self._node is None:
+            await self.open()
+        return self
+
+    async def __aexit__(self, type, value, tb):
+        pass
+
+    @contextlib.asynccontextmanager
+    async def read_session(self):
+        """
+        Acquires the read lock once for the whole async with block, cf.
+        File.read_session(). Operations of the current task within the block
+        do not acquire the lock again.
+        """
+        async with session(self.file, 'r'):
+            yield self
+
+    @contextlib.asynccontextmanager
+    async def write_session(self):
+        """
+        Acquires the write lock once for the whole async with block, cf.
+        File.write_session().
+        """
+        async with session(self.file, 'w'):
+            yield self
+
+
+class AsyncDataset(AsyncNode):
+    """
+    Wrapper for Dataset
+    """
+
+    def __repr__(self):
+        return "<async HDF5 Dataset (path={0})>".format(self.path)
+
+    async def read(self, selection=Ellipsis, out=None):
+        """
+        cf. Dataset.read()
+        """
+        return await self._run('r', self._node.read, selection, out=out)
+
+    async def read_direct(self, dest, source_sel=None, dest_sel=None):
+        """
+        cf. Dataset.read_direct()
+        """
+        await self._run('r', self._node.read_direct, dest, source_sel,
+                        dest_sel)
+
+    async def write(self, selection, value):
+        """
+        Writes ``value`` to ``selection``, cf. Dataset.__setitem__()
+        """
+        await self._run('w', self._node.__setitem__, selection, value)
+
+    async def resize(self, size, axis=None):
+        await self._run('w', self._node.resize, size, axis)
+
+    async def shape(self):
+        return await self._run('r', getattr, self._node, 'shape')
+
+    async def dtype(self):
+        return await self._run('r', getattr, self._node, 'dtype')
+
+
+class AsyncAttributeManager(object):
+    """
+    Wrapper for AttributeManager
+    """
+
+    def __init__(self, attrs):
+        self._attrs = attrs
+
+    async def _run(self, mode, func, *args):
+        return await _run(self._attrs.file, mode, func, *args)
+
+    async def keys(self):
+        return await self._run('r', self._attrs.keys)
+
+    async def contains(self, key):
+        return await self._run('r', self._attrs.__contains__, key)
+
+    async def get(self, key, defaultvalue=None):
+        return await self._run('r', self._attrs.get, key, defaultvalue)
+
+    async def set(self, key, value):
+        await self._run('w', self._attrs.__setitem__, key, value)
+
+    async def delete(self, key):
+        await self._run('w', self._attrs.__delitem__, key)
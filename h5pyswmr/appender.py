@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side buffer for appending rows to a (resizable) dataset, e.g., one
+row per station and minute to a time series.
+
+Every call of Dataset.append() resizes the dataset and writes the rows under
+a single write lock. An Appender collects rows in memory and appends them in
+batches, i.e., with one write lock (and one open/flush of the file) per
+batch. The buffer is flushed when it holds ``max_rows`` rows or
+``max_bytes`` bytes, or when its oldest row is older than ``max_delay``
+seconds (checked whenever rows are appended, call flush() to flush
+periodically).
+
+Optionally, the dataset grows geometrically (``growth``), such that resizes
+(which may have to extend the chunk index) are rare. Then, the dataset is
+larger than its contents while the Appender is open: the shape of the valid
+part is stored in attribute SHAPE_ATTR, and the dataset is shrunk to that
+shape when the Appender is closed. Readers (Dataset.shape, len(),
+__getitem__(), read_direct(), iter_blocks(), Group.read_many(), ...) only
+see the valid part (cf. valid_shape()), also if the writer has crashed
+before shrinking the dataset.
+"""
+
+from __future__ import absolute_import
+
+import time
+
+import numpy as np
+
+from .locking import swmr_enabled
+
+
+# attribute holding the shape of the valid part of a dataset that has grown
+# geometrically, cf. Dataset.append()
+SHAPE_ATTR = 'h5pyswmr_shape'
+
+
+def valid_shape(dset):
+    """
+    Returns the shape of h5py.Dataset ``dset`` without the rows reserved by
+    geometric growth.
+    """
+    if SHAPE_ATTR not in dset.attrs:
+        return dset.shape
+    return tuple(int(n) for n in dset.attrs[SHAPE_ATTR])
+
+
+class Appender(object):
+    """
+    Buffers rows appended to a dataset, cf. module docstring.
+
+    Example:
+        with dst.appender(max_rows=60, max_delay=600) as app:
+            while running:
+                app.append(measure())
+        # remaining rows have been appended
+    """
+
+    def __init__(self, dataset, axis=0, max_rows=None, max_bytes=None,
+                 max_delay=None, growth=None):
+        """
+        Args:
+            dataset: Dataset object (resizable along ``axis``)
+            axis: axis along which rows are appended
+            max_rows: if not None, the buffer is flushed as soon as it holds
+                ``max_rows`` rows
+            max_bytes: if not None, the buffer is flushed as soon as buffered
+                data exceeds ``max_bytes`` bytes
+            max_delay: if not None, the buffer is flushed when rows are
+                appended and the oldest buffered row is older than
+                ``max_delay`` seconds
+            growth: if not None, the dataset grows by (at least) this factor
+                whenever it is full, cf. Dataset.append(). Not supported in
+                SWMR mode.
+        """
+        if growth is not None:
+            if growth <= 1:
+                raise ValueError("growth must be greater than 1")
+            if swmr_enabled(dataset.file):
+                raise ValueError("growth is not supported in SWMR mode")
+        self.dataset = dataset
+        self.axis = axis
+        # looked up once: Dataset.shape may cost a lock (and a file open)
+        self._ndim = len(dataset.shape)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.growth = growth
+        self._clear()
+
+    def _clear(self):
+        self._rows = []     # list of arrays
+        self._nrows = 0
+        self._nbytes = 0
+        self._since = None  # time at which the oldest row was buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.close()
+        else:
+            self._clear()
+            self._shrink()
+
+    def __len__(self):
+        """
+        Returns the number of buffered rows.
+        """
+        return self._nrows
+
+    @property
+    def nbytes(self):
+        """
+        Size of buffered data in bytes
+        """
+        return self._nbytes
+
+    def append(self, rows):
+        """
+        Buffers ``rows``, which is a single row (one dimension less than the
+        dataset) or an array of rows. Note that ``rows`` is copied.
+        """
+        rows = np.array(rows)
+        if rows.ndim < self._ndim:
+            rows = np.expand_dims(rows, self.axis)
+        if self._since is None:
+            self._since = time.time()
+        self._rows.append(rows)
+        self._nrows += rows.shape[self.axis]
+        self._nbytes += rows.nbytes
+        if ((self.max_rows is not None and self._nrows >= self.max_rows)
+                or (self.max_bytes is not None
+                    and self._nbytes > self.max_bytes)
+                or (self.max_delay is not None
+                    and time.time() - self._since >= self.max_delay)):
+            self.flush()
+
+    def flush(self):
+        """
+        Appends all buffered rows under a single write lock.
+        """
+        if not self._rows:
+            return
+        rows = np.concatenate(self._rows, axis=self.axis)
+        self.dataset.append(rows, axis=self.axis, growth=self.growth)
+        self._clear()
+
+    def close(self):
+        """
+        Flushes the buffer and shrinks the dataset to its contents (if it has
+        grown geometrically).
+        """
+        self.flush()
+        self._shrink()
+
+    def _shrink(self):
+        if self.growth is not None:
+            self.dataset._shrink()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+Node-local cache of decoded (decompressed) chunks in POSIX shared memory,
+shared by all processes of a machine.
+
+Every cached chunk is a shared memory segment whose name is derived from
+(file, dataset, chunk index, write generation). Hence, chunks written
+before the file was last modified are never returned; they are evicted
+eventually. Note that segments outlive all processes (and the redis
+server's keys): generations are qualified by an epoch that changes whenever
+the generation counter starts over (cf. locking.LockBackend.generation()),
+such that old segments never match a new generation.
+
+Eviction is LRU (by modification time of the segment, which is updated on
+every hit), such that segments of this cache take up at most MAX_BYTES
+bytes.
+
+Reads from chunked datasets (Dataset.__getitem__) whose chunks are all
+cached do not acquire a lock, as long as the write generation of the file
+has not changed. Otherwise, missing chunks are read (as a whole) under a
+read lock and added to the cache.
+
+The cache is disabled by default (cf. enable()). It requires Linux
+(/dev/shm) and Python >= 3.8. Only numeric datasets, hyperslab selections
+(integers and slices with step 1) and files not in SWMR mode are supported,
+other reads bypass the cache.
+
+Segment layout: ready flag (1 byte), ndim (1 byte), dtype (30 bytes,
+numpy dtype string), shape (ndim 8-byte integers), padding, data.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import itertools
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import locking
+from .locking import session, current_generation, swmr_enabled
+from .handles import open_file
+from .appender import valid_shape
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+ENABLED = False
+MAX_BYTES = 256 * 2**20
+PREFIX = 'h5pyswmr_chunks_'
+
+# maximum number of datasets whose metadata is kept (per process)
+MAX_DATASETS = 1024
+
+_SHM_DIR = '/dev/shm'
+_HEADER = struct.Struct('<BB30s')
+_ALIGN = 64
+
+# dataset metadata of the latest write generation (token), LRU first:
+# (file, path) => (generation, (shape, dtype, chunks))
+_info = OrderedDict()
+_info_lock = threading.Lock()
+
+
+def enable(max_bytes=None):
+    """
+    Enables the chunk cache (in the current process).
+
+    Args:
+        max_bytes: size limit of the cache (shared by all processes)
+
+    Raises:
+        RuntimeError if shared memory is not supported
+    """
+    global ENABLED, MAX_BYTES
+    if shared_memory is None or not os.path.isdir(_SHM_DIR):
+        raise RuntimeError("chunk cache requires POSIX shared memory "
+                           "(Linux, Python >= 3.8)")
+    if max_bytes is not None:
+        MAX_BYTES = max_bytes
+    ENABLED = True
+
+
+def disable():
+    """
+    Disables the chunk cache (in the current process).
+    """
+    global ENABLED
+    ENABLED = False
+
+
+def clear():
+    """
+    Removes all cached chunks (of all processes).
+    """
+    for entry in _segments():
+        _unlink(entry.name)
+
+
+def read(dset, selection):
+    """
+    Reads ``selection`` of Dataset ``dset`` using the cache.
+
+    Returns:
+        the selected data or None if the read is not supported by the cache
+    """
+    filename = dset.file
+    if swmr_enabled(filename) or locking.session_mode(filename) in ('w', 's'):
+        return None
+    generation = current_generation(filename)
+    if generation is None:
+        generation = locking.lock_backend.generation(filename)
+        info = _lookup_info(filename, dset.path, generation)
+        if info is not None:
+            boxes = _boxes(info, selection)
+            if boxes is None:
+                return None
+            chunks = dict((index, _load(_name(filename, dset.path, index,
+                                              generation)))
+                          for index in boxes[1])
+            if all(chunk is not None for chunk in chunks.values()):
+                return _assemble(info, boxes, chunks)
+
+    with session(filename, 'r'):
+        generation = current_generation(filename)
+        with open_file(filename, 'r') as f:
+            h5dset = f[dset.path]
+            # rows reserved by geometric growth are not read (cf.
+            # Dataset.append())
+            info = (valid_shape(h5dset), h5dset.dtype, h5dset.chunks)
+            _store_info(filename, dset.path, generation, info)
+            boxes = _boxes(info, selection)
+            if boxes is None:
+                return None
+            chunks = {}
+            stored = False
+            for index in boxes[1]:
+                name = _name(filename, dset.path, index, generation)
+                chunk = _load(name)
+                if chunk is None:
+                    chunk = h5dset[_chunk_slices(info, index)]
+                    _store(name, chunk)
+                    stored = True
+                chunks[index] = chunk
+    if stored:
+        _evict()
+    return _assemble(info, boxes, chunks)
+
+
+def _lookup_info(filename, path, generation):
+    with _info_lock:
+        entry = _info.get((filename, path))
+        if entry is None or entry[0] != generation:
+            return None
+        _info.move_to_end((filename, path))
+        return entry[1]
+
+
+def _store_info(filename, path, generation, info):
+    with _info_lock:
+        # replaces the metadata of previous generations
+        _info.pop((filename, path), None)
+        _info[(filename, path)] = (generation, info)
+        while len(_info) > MAX_DATASETS:
+            _info.popitem(last=False)
+
+
+def _boxes(info, selection):
+    """
+    Returns (box, chunk indices) of a selection, where box is a list of
+    (start, stop, drop axis) triples, cf. hyperslab(), or None if the
+    selection (or the dataset) is not supported.
+    """
+    shape, dtype, chunks = info
+    if chunks is None or dtype.kind not in 'biufc' or len(shape) == 0:
+        return None
+    box = hyperslab(selection, shape)
+    if box is None:
+        return None
+    ranges = [range(start // c, (stop - 1) // c + 1) if stop > start
+              else range(0)
+              for (start, stop, _), c in zip(box, chunks)]
+    return box, list(itertools.product(*ranges))
+
+
+def hyperslab(selection, shape):
+    """
+    Converts a selection consisting of integers, slices (with step 1) and
+    Ellipsis into a list of (start, stop, drop axis) triples, one per axis
+    of a dataset of shape ``shape``, where integer indices are dropped axes.
+    Returns None if the selection is not supported.
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection, )
+    if sum(1 for index in selection if index is Ellipsis) > 1:
+        return None
+    for i, index in enumerate(selection):
+        if index is Ellipsis:
+            fill = (slice(None), ) * (len(shape) - len(selection) + 1)
+            selection = selection[:i] + fill + selection[i + 1:]
+            break
+    if len(selection) > len(shape):
+        return None
+    selection = selection + (slice(None), ) * (len(shape) - len(selection))
+
+    box = []
+    for index, size in zip(selection, shape):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                return None
+            box.append((start, max(start, stop), False))
+        elif isinstance(index, (int, np.integer)):
+            index = int(index)
+            if index < 0:
+                index += size
+            if not 0 <= index < size:
+                return None  # let h5py raise the error
+            box.append((index, index + 1, True))
+        else:
+            return None
+    return box
+
+
+def _chunk_slices(info, index):
+    shape, _, chunks = info
+    return tuple(slice(i * c, min((i + 1) * c, size))
+                 for i, c, size in zip(index, chunks, shape))
+
+
+def _assemble(info, boxes, chunks):
+    box, indices = boxes
+    out = np.empty(tuple(stop - start for start, stop, _ in box),
+                   dtype=info[1])
+    for index in indices:
+        chunk_box = _chunk_slices(info, index)
+        src = []
+        dst = []
+        for (start, stop, _), sl in zip(box, chunk_box):
+            lo = max(start, sl.start)
+            hi = min(stop, sl.stop)
+            src.append(slice(lo - sl.start, hi - sl.start))
+            dst.append(slice(lo - start, hi - start))
+        out[tuple(dst)] = chunks[index][tuple(src)]
+    return out[tuple(0 if drop else slice(None) for _, _, drop in box)]
+
+
+def _name(filename, path, index, generation):
+    key = '{0}|{1}|{2}|{3}'.format(os.path.abspath(filename), path,
+                                   ','.join(str(i) for i in index),
+                                   generation)
+    return PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _data_offset(ndim):
+    size = _HEADER.size + 8 * ndim
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _load(name):
+    """
+    Returns a copy of cached chunk ``name`` or None.
+    """
+    try:
+        shm = _open(name)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        ready, ndim, dtype = _HEADER.unpack_from(shm.buf, 0)
+        if not ready:
+            return None  # chunk is being written by another process
+        shape = struct.unpack_from('<{0}q'.format(ndim), shm.buf,
+                                   _HEADER.size)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        chunk = np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                           offset=_data_offset(ndim)).copy()
+    finally:
+        shm.close()
+    try:
+        os.utime(os.path.join(_SHM_DIR, name))  # LRU
+    except OSError:
+        pass
+    return chunk
+
+
+def _store(name, chunk):
+    """
+    Adds a chunk to the cache (unless another process already does so).
+    """
+    chunk = np.ascontiguousarray(chunk)
+    offset = _data_offset(chunk.ndim)
+    if offset + chunk.nbytes > MAX_BYTES:
+        return
+    try:
+        shm = _open(name, create=True, size=max(1, offset + chunk.nbytes))
+    except FileExistsError:
+        return
+    try:
+        struct.pack_into('<{0}q'.format(chunk.ndim), shm.buf, _HEADER.size,
+                         *chunk.shape)
+        np.ndarray(chunk.shape, dtype=chunk.dtype, buffer=shm.buf,
+                   offset=offset)[...] = chunk
+        # set ready flag last
+        _HEADER.pack_into(shm.buf, 0, 1, chunk.ndim,
+                          chunk.dtype.str.encode('ascii'))
+    finally:
+        shm.close()
+
+
+def _evict():
+    """
+    Removes least recently used chunks until the cache does not exceed
+    MAX_BYTES.
+    """
+    entries = []
+    for entry in _segments():
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= MAX_BYTES:
+            break
+        _unlink(name)
+        total -= size
+
+
+def _segments():
+    try:
+        return [entry for entry in os.scandir(_SHM_DIR)
+                if entry.name.startswith(PREFIX)]
+    except OSError:
+        return []
+
+
+def _open(name, create=False, size=0):
+    """
+    Opens a shared memory segment that is not tracked by the resource
+    tracker, i.e., it outlives the current process.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create,
+                                          size=size, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+def _unlink(name):
+    try:
+        os.unlink(os.path.join(_SHM_DIR, name))
+    except OSError:
+        pass
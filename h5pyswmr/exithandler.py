@@ -1,86 +1,195 @@
 # -*- coding: utf-8 -*-
 
 """
-SIGTERM handler. Makes sure that reader/writer synchronization remains in a
-consistent state after process termination. Note that deadlocks or data
-corruption may still occur if processes are killed (SIGKILL / kill -9).
-
-Special thanks to Giampaolo Rodola for this code:
+Process-wide cleanup registry. Makes sure that reader/writer synchronization
+remains in a consistent state after process termination. Note that
+deadlocks or data corruption may still occur if processes are killed
+(SIGKILL / kill -9).
+
+Locks held by the process (of all threads) are registered together with a
+callback releasing them (cf. cleanup()). A SIGTERM handler, which is
+installed once per process (by the main thread), turns SIGTERM into
+SystemExit, such that the main thread releases its locks while unwinding
+(as it does on KeyboardInterrupt). Locks that are still registered at
+interpreter exit, e.g., locks of daemon threads, are released by an atexit
+hook (cf. release_all()). The handler is installed when h5pyswmr is
+imported by the main thread. Otherwise, applications should call install()
+from the main thread at startup (a warning is issued if a thread registers
+a callback while no handler is installed).
+
+Originally inspired by Giampaolo Rodola's handle_exit context manager:
 http://code.activestate.com/recipes/577997-handle-exit-context-manager/
 """
 
+import atexit
 import contextlib
+import itertools
+import multiprocessing.util
+import os
 import signal
-import sys
 import threading
 import warnings
 
 
-def _sigterm_handler(signum, frame):
-    sys.exit(0)
+# registered callbacks: key => callback
+_registry = {}
+_registry_lock = threading.Lock()
+_registry_pid = os.getpid()
+_keys = itertools.count()
 
-_sigterm_handler.__enter_ctx__ = False
+_installed = False
+_warned = False
 
 
-@contextlib.contextmanager
-def handle_exit(callback=None, append=False):
-    """A context manager which properly handles SIGTERM and SIGINT
-    (KeyboardInterrupt) signals, registering a function which is
-    guaranteed to be called after signals are received.
-    Also, it makes sure to execute previously registered signal
-    handlers as well (if any).
-
-    >>> app = App()
-    >>> with handle_exit(app.stop):
-    ...     app.start()
-    ...
-    >>>
-
-    If append == False raise RuntimeError if there's already a handler
-    registered for SIGTERM, otherwise both new and old handlers are
-    executed in this order.
+def _sigterm_handler(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def install(append=True):
     """
-    t = threading.current_thread()
-    if t.name != 'MainThread':
-        warnings.warn("!!! h5pySWMR warning: SIGTERM handling does not (yet) "
-                      "work in a threaded environment. Locks may not be "
-                      "released after process termination.", UserWarning)
-        yield
+    Installs the SIGTERM handler (unless it has been installed already).
+    Signal handlers can only be installed by the main thread, i.e., this is
+    a no-op in other threads (the handler is installed as soon as the main
+    thread registers a callback).
+
+    Args:
+        append: if there is already a handler registered for SIGTERM, it is
+            called before SystemExit is raised. Otherwise, RuntimeError is
+            raised in this case.
+    """
+    global _installed
+    if _installed or threading.current_thread() is not threading.main_thread():
         return
-
-    old_handler = signal.signal(signal.SIGTERM, _sigterm_handler)
-    if old_handler != signal.SIG_DFL and old_handler != _sigterm_handler:
+    old_handler = signal.getsignal(signal.SIGTERM)
+    if old_handler == signal.SIG_IGN:
+        # the process is not supposed to terminate on SIGTERM
+        handler = None
+    elif callable(old_handler) and old_handler is not _sigterm_handler:
         if not append:
             raise RuntimeError("there is already a handler registered for "
                                "SIGTERM: %r" % old_handler)
 
         def handler(signum, frame):
             try:
-                _sigterm_handler(signum, frame)
-            finally:
                 old_handler(signum, frame)
+            finally:
+                _sigterm_handler(signum, frame)
+    else:
+        handler = _sigterm_handler
+    if handler is not None:
         signal.signal(signal.SIGTERM, handler)
+    _installed = True
 
-    if _sigterm_handler.__enter_ctx__:
-        raise RuntimeError("can't use nested contexts")
-    _sigterm_handler.__enter_ctx__ = True
 
+def register(callback, append=True):
+    """
+    Registers ``callback``, which releases a resource (e.g., a lock) of the
+    current process, cf. release_all().
+
+    Args:
+        callback: function without arguments
+        append: cf. install()
+
+    Returns:
+        key, which must be passed on to unregister()
+    """
+    global _registry, _registry_lock, _registry_pid, _warned
+    if not _installed:
+        install(append)
+        if not _installed and not _warned:
+            _warned = True
+            warnings.warn("h5pySWMR: no SIGTERM handler installed, locks "
+                          "of other threads than the main thread are not "
+                          "released on SIGTERM (call exithandler.install() "
+                          "from the main thread)", RuntimeWarning)
+    key = next(_keys)
+    if _registry_pid != os.getpid():
+        # a forked child process does not hold the resources of its parent
+        _registry = {}
+        _registry_lock = threading.Lock()
+        _registry_pid = os.getpid()
+    with _registry_lock:
+        _registry[key] = callback
+    return key
+
+
+def unregister(key):
+    """
+    Removes a callback registered by register().
+
+    Returns:
+        True if the callback was still registered, i.e., the caller must
+        release the resource itself. False if it has been released by
+        release_all() already.
+    """
+    if _registry_pid != os.getpid():
+        return False
+    with _registry_lock:
+        return _registry.pop(key, None) is not None
+
+
+@contextlib.contextmanager
+def cleanup(callback, append=True):
+    """
+    Context manager registering ``callback`` for the with block, which is
+    called at the end of the block (unless release_all() has called it
+    already).
+
+    Example:
+        token = acquire()
+        with cleanup(lambda: release(token)):
+            ...  # critical section
+    """
+    key = register(callback, append)
     try:
         yield
-    except KeyboardInterrupt:
-        pass
-    except SystemExit as err:
-        # code != 0 refers to an application error (e.g. explicit
-        # sys.exit('some error') call).
-        # We don't want that to pass silently.
-        # Nevertheless, the 'finally' clause below will always
-        # be executed.
-        if err.code != 0:
-            raise
     finally:
-        _sigterm_handler.__enter_ctx__ = False
-        if callback is not None:
+        if unregister(key):
+            callback()
+
+
+@atexit.register
+def release_all():
+    """
+    Calls (and unregisters) all callbacks registered by the current process.
+    Called at interpreter exit.
+    """
+    if _registry_pid != os.getpid():
+        return
+    with _registry_lock:
+        callbacks = list(_registry.values())
+        _registry.clear()
+    for callback in callbacks:
+        try:
             callback()
+        except Exception:
+            pass
+
+
+# processes of the multiprocessing module do not call atexit hooks, but
+# run the finalizers registered by multiprocessing.util.Finalize (note that
+# a child process clears the finalizers of its parent)
+class _AfterFork(object):
+    pass
+
+
+def _register_finalizer(_=None):
+    multiprocessing.util.Finalize(None, release_all, exitpriority=100)
+
+
+_after_fork = _AfterFork()
+_register_finalizer()
+multiprocessing.util.register_after_fork(_after_fork, _register_finalizer)
+
+
+def registered():
+    """
+    Returns the number of callbacks registered by the current process.
+    """
+    if _registry_pid != os.getpid():
+        return 0
+    with _registry_lock:
+        return len(_registry)
 
 
 if __name__ == '__main__':
@@ -89,99 +198,67 @@ if __name__ == '__main__':
     # ===============================================================
 
     import unittest
-    import time
-    import os
 
     class TestOnExit(unittest.TestCase):
 
         def setUp(self):
+            global _installed, _warned
             # reset signal handlers
             signal.signal(signal.SIGTERM, signal.SIG_DFL)
-            self.flag = None
-
-        def tearDown(self):
-            # make sure we exited the ctx manager
-            self.assertTrue(self.flag is not None)
-
-        def test_base(self):
-            with handle_exit():
-                pass
-            self.flag = True
+            _installed = _warned = False
 
         def test_callback(self):
             callback = []
-            with handle_exit(lambda: callback.append(None)):
-                pass
-            self.flag = True
+            with cleanup(lambda: callback.append(None)):
+                self.assertEqual(registered(), 1)
             self.assertEqual(callback, [None])
+            self.assertEqual(registered(), 0)
 
-        def test_kinterrupt(self):
-            with handle_exit():
-                raise KeyboardInterrupt
-            self.flag = True
+        def test_nested_context(self):
+            callback = []
+            with cleanup(lambda: callback.append(1)):
+                with cleanup(lambda: callback.append(2)):
+                    pass
+            self.assertEqual(callback, [2, 1])
 
         def test_sigterm(self):
-            with handle_exit():
-                os.kill(os.getpid(), signal.SIGTERM)
-            self.flag = True
-
-        def test_sigterm_complex(self):
-
-            def handler():
-                print("handler")
-
-            with handle_exit(handler):
-                time.sleep(2)
-                os.kill(os.getpid(), signal.SIGTERM)
-
-            self.flag = True
-
-        def test_sigint(self):
-            with handle_exit():
-                os.kill(os.getpid(), signal.SIGINT)
-            self.flag = True
+            callback = []
+            try:
+                with cleanup(lambda: callback.append(None)):
+                    os.kill(os.getpid(), signal.SIGTERM)
+            except SystemExit as e:
+                self.assertEqual(e.code, 128 + signal.SIGTERM)
+            else:
+                self.fail("SystemExit not raised")
+            self.assertEqual(callback, [None])
 
         def test_sigterm_old(self):
             # make sure the old handler gets executed
             queue = []
             signal.signal(signal.SIGTERM, lambda s, f: queue.append('old'))
-            with handle_exit(lambda: queue.append('new'), append=True):
-                os.kill(os.getpid(), signal.SIGTERM)
-            self.flag = True
-            self.assertEqual(queue, ['old', 'new'])
-
-        def test_sigint_old(self):
-            # make sure the old handler gets executed
-            queue = []
-            signal.signal(signal.SIGINT, lambda s, f: queue.append('old'))
-            with handle_exit(lambda: queue.append('new'), append=True):
-                os.kill(os.getpid(), signal.SIGINT)
-            self.flag = True
+            try:
+                with cleanup(lambda: queue.append('new')):
+                    os.kill(os.getpid(), signal.SIGTERM)
+            except SystemExit:
+                pass
             self.assertEqual(queue, ['old', 'new'])
 
         def test_no_append(self):
-            # make sure we can't use the context manager if there's
-            # already a handler registered for SIGTERM
-            signal.signal(signal.SIGTERM, lambda s, f: sys.exit(0))
-            try:
-                with handle_exit(lambda: self.flag.append(None)):
-                    pass
-            except RuntimeError:
-                pass
-            else:
-                self.fail("exception not raised")
-            finally:
-                self.flag = True
+            signal.signal(signal.SIGTERM, lambda s, f: None)
+            self.assertRaises(RuntimeError, install, False)
 
-        def test_nested_context(self):
-            self.flag = True
-            try:
-                with handle_exit():
-                    with handle_exit():
-                        pass
-            except RuntimeError:
-                pass
-            else:
-                self.fail("exception not raised")
+        def test_thread(self):
+            # threads register without installing signal handlers (and warn)
+            callback = []
+            t = threading.Thread(
+                target=register, args=(lambda: callback.append(None), ))
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                t.start()
+                t.join()
+            self.assertEqual(len(w), 1)
+            self.assertEqual(registered(), 1)
+            release_all()
+            self.assertEqual(callback, [None])
 
     unittest.main()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lock backend for single-node deployments, based on fcntl byte-range locks
+(no redis server required).
+
+Every HDF5 file has a lock file in a lock directory (cf. FcntlBackend).
+Locks are open file description (OFD) locks, i.e., they are owned by an
+open file rather than by a process. Hence, threads of the same process
+exclude each other as well, and the kernel releases the locks of a process
+as soon as it terminates (even if it is killed with SIGKILL). Note that OFD
+locks require Linux >= 3.15 and Python >= 3.9.
+
+Layout of a lock file:
+
+* byte 0 (gate): every writer holds a shared lock while it is waiting or
+  writing. Readers only enter if no writer holds the gate (writer
+  preference, cf. writer registrations and lock r of the redis backend).
+* byte 1 (resource): readers hold a shared lock, writers an exclusive lock.
+* bytes 8-15: write generation (little-endian integer), incremented by every
+  writer, cf. locking.current_generation().
+* bytes 16-31: epoch of the write generation, a random id written by the
+  first process that finds it missing. A lock file that has been deleted
+  (e.g., by a cleanup of the temp directory) starts over with a new epoch,
+  such that its generations never match those of the old file.
+
+fcntl cannot wait for a lock with a timeout. Therefore, waiting processes
+poll, starting with short intervals (uncontended locks cost a few
+microseconds).
+"""
+
+from __future__ import absolute_import
+
+import binascii
+import contextlib
+import errno
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from .locking import (LockBackend, LockException, ACQ_TIMEOUT,
+                      DEFAULT_TIMEOUT, _record_wait)
+
+
+_GATE = 0
+_RESOURCE = 1
+_GENERATION = struct.Struct('<q')
+_GENERATION_OFFSET = 8
+_EPOCH_SIZE = 16
+_EPOCH_OFFSET = 16
+
+# struct flock (Linux): l_type, l_whence, l_start, l_len, l_pid
+_FLOCK = struct.Struct('hhqqi4x')
+
+# polling intervals in seconds
+_MIN_DELAY = 0.00005
+_MAX_DELAY = 0.001
+
+
+class FcntlBackend(LockBackend):
+    """
+    Readers/writer protocol based on fcntl locks, cf. module docstring.
+    Unlike redis locks, fcntl locks do not time out, they are held until
+    they are released or until the holding process terminates.
+
+    Example:
+        from h5pyswmr import locking
+        from h5pyswmr.fcntlbackend import FcntlBackend
+        locking.lock_backend = FcntlBackend()
+    """
+
+    def __init__(self, lock_dir=None):
+        """
+        Args:
+            lock_dir: directory of the lock files (created if it does not
+                exist). Processes accessing the same files must use the same
+                directory. Defaults to h5pyswmr-locks in the temp directory.
+
+        Raises:
+            RuntimeError if OFD locks are not supported
+        """
+        if not hasattr(fcntl, 'F_OFD_SETLK'):
+            raise RuntimeError("fcntl backend requires open file description "
+                               "locks (Linux >= 3.15, Python >= 3.9)")
+        if lock_dir is None:
+            lock_dir = os.path.join(tempfile.gettempdir(), 'h5pyswmr-locks')
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            if not os.path.isdir(lock_dir):
+                raise
+        self.lock_dir = lock_dir
+        # lock files opened by the current process (a forked child must
+        # close them, otherwise the parent's locks outlive the parent)
+        self._fds = set()
+        self._fds_lock = threading.Lock()
+        _backends.add(self)
+
+    def lock_file(self, name):
+        """
+        Returns the path of the lock file of ``name``. Note that lock names
+        are used as they are, whereas file names are made absolute by the
+        caller (cf. _open_file()).
+        """
+        digest = hashlib.sha1(name.encode('utf-8'))
+        return os.path.join(self.lock_dir, digest.hexdigest() + '.lock')
+
+    def acquire_read(self, filename, acq_timeout=ACQ_TIMEOUT):
+        fd = self._open_file(filename)
+        try:
+            def enter():
+                # a writer may be active or waiting, in which case the gate
+                # is locked
+                return (not _is_locked(fd, _GATE)
+                        and _try_lock(fd, _RESOURCE, fcntl.F_RDLCK))
+
+            if not _poll(enter, 'r__{}'.format(filename), acq_timeout):
+                raise LockException("could not acquire lock r__{0} or "
+                                    "w__{0}".format(filename))
+            return fd, _generation_token(fd)
+        except BaseException:
+            self._close(fd)
+            raise
+
+    def release_read(self, filename, token):
+        self._close(token)
+
+    def acquire_write(self, filename, acq_timeout=ACQ_TIMEOUT):
+        fd = self._open_file(filename)
+        try:
+            # register as a writer (this blocks new readers)
+            _try_lock(fd, _GATE, fcntl.F_RDLCK)
+            # wait until readers (or another writer) have left
+            if not _poll(lambda: _try_lock(fd, _RESOURCE, fcntl.F_WRLCK),
+                         'w__{}'.format(filename), acq_timeout):
+                raise LockException("could not acquire lock w__{0}"
+                                    .format(filename))
+            return fd
+        except BaseException:
+            self._close(fd)
+            raise
+
+    def release_write(self, filename, token):
+        try:
+            os.pwrite(token, _GENERATION.pack(_read_generation(token) + 1),
+                      _GENERATION_OFFSET)
+        finally:
+            # closing the lock file releases both locks
+            self._close(token)
+
+    @contextlib.contextmanager
+    def mutex(self, lockname, acq_timeout=DEFAULT_TIMEOUT):
+        fd = self._open(lockname)
+        try:
+            if not _poll(lambda: _try_lock(fd, _RESOURCE, fcntl.F_WRLCK),
+                         lockname, acq_timeout):
+                raise LockException("could not acquire lock {0}"
+                                    .format(lockname))
+            yield
+        finally:
+            self._close(fd)
+
+    def generation(self, filename):
+        fd = self._open_file(filename)
+        try:
+            return _generation_token(fd)
+        finally:
+            self._close(fd)
+
+    def _open_file(self, filename):
+        # different (relative) names of the same file share a lock file
+        return self._open(os.path.abspath(filename))
+
+    def _open(self, name):
+        # every acquisition opens the lock file, i.e., creates a new open
+        # file description
+        fd = os.open(self.lock_file(name), os.O_RDWR | os.O_CREAT, 0o666)
+        with self._fds_lock:
+            self._fds.add(fd)
+        return fd
+
+    def _close(self, fd):
+        with self._fds_lock:
+            self._fds.discard(fd)
+        os.close(fd)
+
+    def _close_inherited(self):
+        # Closing the child's copies does not release the locks of the
+        # parent. Note that the lock of _fds may have been held by another
+        # thread while forking.
+        self._fds_lock = threading.Lock()
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = set()
+
+
+# live backends, cf. _close_inherited()
+_backends = weakref.WeakSet()
+
+
+def _after_fork():
+    for backend in list(_backends):
+        backend._close_inherited()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _try_lock(fd, offset, lock_type):
+    """
+    Tries to lock byte ``offset`` (without blocking). Returns True on
+    success.
+    """
+    try:
+        fcntl.fcntl(fd, fcntl.F_OFD_SETLK,
+                    _FLOCK.pack(lock_type, os.SEEK_SET, offset, 1, 0))
+    except OSError as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+def _is_locked(fd, offset):
+    """
+    Returns True if byte ``offset`` is locked by another open file.
+    """
+    result = fcntl.fcntl(fd, fcntl.F_OFD_GETLK,
+                         _FLOCK.pack(fcntl.F_WRLCK, os.SEEK_SET, offset, 1, 0))
+    return _FLOCK.unpack(result)[0] != fcntl.F_UNLCK
+
+
+def _read_generation(fd):
+    data = os.pread(fd, _GENERATION.size, _GENERATION_OFFSET)
+    if len(data) < _GENERATION.size:
+        return 0  # new lock file
+    return _GENERATION.unpack(data)[0]
+
+
+def _generation_token(fd):
+    """
+    Returns the generation token '<epoch>:<counter>' of a lock file, cf.
+    locking.LockBackend.generation(). Processes racing to start the epoch
+    of a new lock file may return different tokens, which only costs a
+    cache miss.
+    """
+    epoch = os.pread(fd, _EPOCH_SIZE, _EPOCH_OFFSET)
+    if len(epoch) < _EPOCH_SIZE or not any(bytearray(epoch)):
+        epoch = uuid.uuid4().bytes
+        os.pwrite(fd, epoch, _EPOCH_OFFSET)
+    return '{0}:{1}'.format(binascii.hexlify(epoch).decode('ascii'),
+                            _read_generation(fd))
+
+
+def _poll(attempt, lockname, acq_timeout):
+    """
+    Calls ``attempt`` until it returns True or until ``acq_timeout`` seconds
+    have elapsed. Returns False on timeout. Waits are recorded in the wait
+    statistics of ``lockname`` (cf. locking.get_wait_stats()).
+    """
+    if attempt():
+        _record_wait(lockname, 0.)
+        return True
+    start = time.time()
+    end = start + acq_timeout
+    delay = _MIN_DELAY
+    retries = 1
+    while True:
+        time.sleep(delay)
+        delay = min(delay * 2, _MAX_DELAY)
+        if attempt():
+            _record_wait(lockname, time.time() - start, retries=retries)
+            return True
+        retries += 1
+        if time.time() >= end:
+            _record_wait(lockname, time.time() - start, timed_out=True,
+                         retries=retries)
+            return False
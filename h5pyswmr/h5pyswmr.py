@@ -9,19 +9,40 @@ problem,
 cf. http://en.wikipedia.org/wiki/Readers%E2%80%93writers_problem
 #The_second_readers-writers_problem
 
-!!! IMPORTANT !!!
-Note that the locks used are not recursive/reentrant. Therefore, a synchronized
-method (decorated by @reader or @writer) must *not* call other synchronized
-methods, otherwise we get a deadlock!
+Locks are reentrant, i.e., a synchronized method (decorated by @reader or
+@writer) may call other synchronized methods of the same file. Note, however,
+that a method decorated by @reader must *not* call a method decorated by
+@writer (a LockException is raised).
 """
 
 from __future__ import absolute_import
 
 import os
+import contextlib
+import itertools
+import math
+import mmap
+import numbers
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 import h5py
+import numpy as np
 
-from h5pyswmr.locking import reader, writer
+from h5pyswmr import chunkcache, handles
+from h5pyswmr.appender import Appender, SHAPE_ATTR, valid_shape
+from h5pyswmr.locking import (reader, writer, swmr_writer, dataset_reader,
+                               session, enable_swmr, enable_object_locks,
+                               current_generation, session_mode,
+                               object_session)
+from h5pyswmr.handles import open_file
+from h5pyswmr.metadata import cached_metadata
+from h5pyswmr.readahead import ReadAhead
+from h5pyswmr.writebuffer import WriteBuffer
+
+
+# shared memory segments of parallel_read()
+_SHM_DIR = '/dev/shm'
 
 
 class Node(object):
@@ -40,26 +61,29 @@ class Node(object):
         self._path = path
         self.attrs = AttributeManager(self.file, self._path)
 
-    @reader
     def __getitem__(self, key):
         """
         Raises:
             KeyError if object does not exist.
         """
+        cls, path = self._node_info(self._absolute_path(key))
+        return cls(file=self.file, path=path)
+
+    @cached_metadata
+    @reader
+    def _node_info(self, path):
+        """
+        Returns the class (Group or Dataset) and the name of node ``path``.
+        """
         # sometimes the underlying hdf5 C library writes errors to stdout,
         # e.g., if a path is not found in a file.
         # cf. http://stackoverflow.com/questions/15117128/
         # h5py-in-memory-file-and-multiprocessing-error
         h5py._errors.silence_errors()
 
-        if key.startswith('/'):  # absolute path
-            path = key
-        else:                    # relative path
-            path = os.path.join(self.path, key)
-
-        with h5py.File(self.file, 'r') as f:
-            node = f[path]
-            return self._wrap_class(node)
+        with open_file(self.file, 'r') as f:
+            node = self._wrap_class(f[path])
+            return type(node), node.path
 
     @property
     def path(self):
@@ -68,6 +92,16 @@ class Node(object):
         """
         return self._path
 
+    def _absolute_path(self, key):
+        """
+        Returns the absolute path of ``key`` (relative to this node unless
+        ``key`` is an absolute path).
+        """
+        if key.startswith('/'):  # absolute path
+            return key
+        else:                    # relative path
+            return os.path.join(self.path, key)
+
     def _wrap_class(self, node):
         """
         Wraps h5py objects into h5pyswmr objects.
@@ -102,7 +136,7 @@ class Group(Node):
 
     @writer
     def create_group(self, name):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             created_group = group.create_group(name)
             path = created_group.name
@@ -111,7 +145,7 @@ class Group(Node):
 
     @writer
     def require_group(self, name):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             created_group = group.require_group(name)
             path = created_group.name
@@ -120,63 +154,169 @@ class Group(Node):
 
     @writer
     def create_dataset(self, **kwargs):
-        overwrite = kwargs.get('overwrite', False)
-        name = kwargs['name']
-        # remove additional arguments because they are not supported by h5py
-        try:
-            del kwargs['overwrite']
-        except Exception:
-            pass
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
-            if overwrite and name in group:
-                del group[name]
-            dst = group.create_dataset(**kwargs)
+            dst = _create_dataset(group, kwargs)
             path = dst.name
 
         return Dataset(self.file, path=path)
 
     @writer
     def require_dataset(self, **kwargs):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             dst = group.require_dataset(**kwargs)
             path = dst.name
         return Dataset(self.file, path=path)
 
+    @writer
+    def write_many(self, writes=(), datasets=(), groups=(), attrs=()):
+        """
+        Performs several writing operations under a single write lock,
+        opening (and flushing) the file only once. Operations are performed
+        in the following order: groups are created, then datasets are
+        created, then data is written, then attributes are set.
+
+        Example:
+            f.write_many(writes=[('/a', np.s_[0:10], data1),
+                                 ('/b', Ellipsis, data2)],
+                         attrs=[('/a', 'units', 'm/s')])
+
+        Args:
+            writes: iterable of (path, selection, value) tuples, cf.
+                Dataset.__setitem__()
+            datasets: iterable of dicts with keyword arguments of
+                create_dataset()
+            groups: iterable of names of groups to be created (if they do not
+                exist yet, cf. require_group())
+            attrs: iterable of (path, key, value) tuples, cf.
+                AttributeManager.__setitem__()
+
+        Paths and names are relative to this group (or absolute).
+        """
+        with open_file(self.file, 'r+') as f:
+            group = f[self.path]
+            for name in groups:
+                group.require_group(name)
+            for kwargs in datasets:
+                _create_dataset(group, dict(kwargs))
+            dsets = {}
+            for path, selection, value in writes:
+                if path not in dsets:
+                    dsets[path] = group[path]
+                dsets[path][selection] = value
+            for path, key, value in attrs:
+                group[path].attrs[key] = value
+
+    def write_buffer(self, max_bytes=None):
+        """
+        Returns a WriteBuffer collecting (and coalescing) writing operations
+        on this group, which are performed under a single write lock when
+        the buffer is flushed.
+
+        Example:
+            with f.write_buffer() as buf:
+                for i in range(100):
+                    buf.write('/a', np.s_[i:i+1, :], rows[i:i+1])
+
+        Args:
+            max_bytes: cf. WriteBuffer
+        """
+        return WriteBuffer(self, max_bytes=max_bytes)
+
+    @cached_metadata
     @reader
     def keys(self):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             # w/o list() it does not work with py3 (returns a view on a closed
             # hdf5 file)
             return list(f[self.path].keys())
 
-    # TODO does not yet work because @reader methods are not reentrant!
-    # @reader
-    # def visit(self, func):
-    #     """
-    #     Wrapper around h5py.Group.vist()
-
-    #     Args:
-    #         func: a unary function
-    #     """
-    #     with h5py.File(self.file, 'r') as f:
-    #         return f[self.path].visit(func)
-
-    # @reader
-    # def visititems(self, func):
-    #     """
-    #     Wrapper around h5py.Group.visititems()
-
-    #     Args:
-    #         func: a 2-ary function
-    #     """
-    #     with h5py.File(self.file, 'r') as f:
-    #         grp = f[self.path]
-    #         def proxy(name):
-    #             obj = self._wrap_class(grp[name])
-    #             return func(name, obj)
-    #         return self.visit(proxy)
+    @reader
+    def visit(self, func):
+        """
+        Wrapper around h5py.Group.visit(). The whole tree is traversed
+        while holding a single read lock.
+
+        Args:
+            func: a unary function, called with the name of every object
+                (relative to this group). Traversal stops if ``func``
+                returns a value other than None.
+        """
+        with open_file(self.file, 'r') as f:
+            return f[self.path].visit(func)
+
+    @reader
+    def visititems(self, func):
+        """
+        Wrapper around h5py.Group.visititems(). The whole tree is traversed
+        while holding a single read lock.
+
+        Args:
+            func: a 2-ary function, called with the name of every object
+                (relative to this group) and the object (Group or Dataset).
+                Note that ``func`` must not write to the file. With object
+                locks (cf. locking.enable_object_locks()), datasets are
+                read locked while ``func`` is called.
+        """
+        with open_file(self.file, 'r') as f:
+            def proxy(name, node):
+                if isinstance(node, h5py.Dataset):
+                    with object_session(self.file, node.name, 'r'):
+                        return func(name, self._wrap_class(node))
+                return func(name, self._wrap_class(node))
+            return f[self.path].visititems(proxy)
+
+    @reader
+    def read_many(self, selections, out=None):
+        """
+        Reads several datasets (or parts of datasets) under a single read
+        lock, opening the file only once. Reads are performed in the order
+        of dataset paths and selection offsets (for better locality), but
+        results are returned in the order of ``selections``.
+
+        Example:
+            a, b = f.read_many([('/a', np.s_[0:10, :]), ('b', Ellipsis)])
+
+        Args:
+            selections: iterable of (path, selection) pairs. Paths are
+                relative to this group (or absolute), selections are
+                anything supported by Dataset.__getitem__ (use Ellipsis to
+                read a whole dataset).
+            out: optional list (of the same length as ``selections``) of
+                output arrays or None. Data is read directly into the given
+                arrays (cf. h5py.Dataset.read_direct()), whose shapes must
+                match the selections.
+
+        Returns:
+            list of arrays (the arrays passed as ``out`` where given)
+        """
+        selections = list(selections)
+        if out is not None and len(out) != len(selections):
+            raise ValueError("out must have the same length as selections")
+        order = sorted(range(len(selections)),
+                       key=lambda i: (self._absolute_path(selections[i][0]),
+                                      _selection_offset(selections[i][1])))
+        result = [None] * len(selections)
+        with open_file(self.file, 'r') as f:
+            # with object locks, every dataset is read locked while it is
+            # read (one after another in the order of their paths)
+            for path, indices in itertools.groupby(
+                    order, key=lambda i: self._absolute_path(
+                        selections[i][0])):
+                with object_session(self.file, path, 'r'):
+                    dset = _refresh(f, f[path])
+                    for i in indices:
+                        selection = selections[i][1]
+                        if out is not None and out[i] is not None:
+                            source_sel = (None if selection is Ellipsis
+                                          else selection)
+                            _read_direct(dset, out[i], source_sel, None)
+                            result[i] = out[i]
+                        else:
+                            result[i] = _read(dset, selection)
+
+        return result
 
     @reader
     def items(self):
@@ -188,21 +328,22 @@ class Group(Node):
         "set-like object" (Py3) is returned.
         """
         result = []
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             for name, obj in f[self.path].items():
                 result.append((name, self._wrap_class(obj)))
 
         return result
 
+    @cached_metadata
     @reader
     def __contains__(self, key):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             group = f[self.path]
             return key in group
 
     @writer
     def __delitem__(self, key):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             del group[key]
 
@@ -216,17 +357,49 @@ class File(Group):
         """
         try to open/create an h5py.File object
         note that this must be synchronized!
+
+        In addition to the arguments of h5py.File, keyword argument
+        ``backend`` may be given:
+        'redis' (default): all readers/writers are synchronized by the
+            readers/writer protocol (implemented by locking.lock_backend,
+            which is based on redis by default).
+        'swmr': HDF5's native SWMR mode is used, i.e., writing to (and
+            resizing) existing datasets does not block readers. Structural
+            changes, e.g., creating datasets, still block readers. Note that
+            all processes must use the same backend. New files are created
+            with libver='latest', cf. locking.enable_swmr().
+
+        With backend 'swmr', keyword argument ``granularity`` may be given:
+        'file' (default): SWMR writers do not block readers at all.
+        'dataset': SWMR writers lock the dataset they modify, i.e., readers
+            of that dataset wait for the write to complete, while readers of
+            other datasets are not blocked, cf. locking.enable_object_locks().
         """
         # this is crucial for the @writer annotation
         self.file = args[0]
 
-        # TODO this creates an exclusive lock every time the file is read!!
+        backend = kwargs.pop('backend', 'redis')
+        granularity = kwargs.pop('granularity', 'file')
+        if backend == 'swmr':
+            enable_swmr(self.file)
+        elif backend != 'redis':
+            raise ValueError("unknown backend {0!r}".format(backend))
+        if granularity == 'dataset':
+            enable_object_locks(self.file)
+        elif granularity != 'file':
+            raise ValueError("unknown granularity {0!r}".format(granularity))
 
-        @writer
         def init(self):
-            with h5py.File(*args, **kwargs) as f:
+            with open_file(*args, **kwargs) as f:
                 Group.__init__(self, f.filename, '/')
-        init(self)
+        # opening a file read-only does not modify it (i.e., it does not
+        # invalidate cached metadata or chunks of other processes)
+        mode = args[1] if len(args) > 1 else kwargs.get('mode', 'r')
+        (reader if mode == 'r' else writer)(init)(self)
+        if backend == 'swmr':
+            enable_swmr(self.file)
+            if granularity == 'dataset':
+                enable_object_locks(self.file)
 
     def __enter__(self):
         """
@@ -237,6 +410,46 @@ class File(Group):
     def __exit__(self, type, value, tb):
         pass
 
+    @contextlib.contextmanager
+    def read_session(self):
+        """
+        Context manager that acquires the read lock once and keeps the file
+        open for the whole with block. Reading operations performed by the
+        current thread within the block neither acquire the lock nor open the
+        file again:
+
+        with File('test.h5', 'r').read_session() as f:
+            data = f['/mygroup/mydataset'][:]
+            units = f['/mygroup/mydataset'].attrs['units']
+
+        Note that other processes cannot write to the file during a
+        session. Writing operations within a read session raise a
+        LockException.
+        """
+        with session(self.file, 'r'):
+            with handles.session(self.file, 'r'):
+                yield self
+
+    @contextlib.contextmanager
+    def write_session(self):
+        """
+        Context manager that acquires the write lock once and keeps the
+        file open (read/write) for the whole with block. Reading and writing
+        operations performed by the current thread within the block neither
+        acquire the lock nor open the file again:
+
+        with File('test.h5', 'a').write_session() as f:
+            for i in range(100):
+                dst = f.create_dataset(name='/dst{}'.format(i), data=data[i])
+                dst.attrs['index'] = i
+
+        Note that other processes can neither read nor write the file
+        during a session.
+        """
+        with session(self.file, 'w'):
+            with handles.session(self.file, 'r+'):
+                yield self
+
     def __repr__(self):
         return "<HDF5 File ({0})>".format(self.file)
 
@@ -248,40 +461,548 @@ class Dataset(Node):
 
     def __init__(self, file, path):
         Node.__init__(self, file, path)
+        self._readahead = None
 
-    @reader
     def __getitem__(self, slice):
         """
         implement multidimensional slicing for datasets
         """
-        with h5py.File(self.file, 'r') as f:
-            return f[self.path][slice]
+        if self._readahead is not None:
+            return self._readahead.read(slice)
+        return self._get(slice)
 
-    @writer
+    def read_ahead(self, depth=2, max_bytes=64 * 2**20):
+        """
+        Enables read-ahead for sequential reads of this Dataset object:
+        while the caller processes a block, e.g., ``dst[100:200]``, the next
+        ``depth`` blocks (``dst[200:300]``, ...) are read in a background
+        thread, cf. h5pyswmr/readahead.py.
+
+        Example:
+            dst = f['/timeseries'].read_ahead(depth=2)
+            for i in range(0, len(dst), 1000):
+                process(dst[i:i + 1000])
+
+        Args:
+            depth: number of blocks read in advance (0 disables read-ahead)
+            max_bytes: maximum size of prefetched blocks in bytes
+
+        Returns:
+            self
+        """
+        if self._readahead is not None:
+            self._readahead.close()
+            self._readahead = None
+        if depth > 0:
+            self._readahead = ReadAhead(self, depth=depth,
+                                        max_bytes=max_bytes)
+        return self
+
+    def _get(self, slice):
+        if chunkcache.ENABLED:
+            result = chunkcache.read(self, slice)
+            if result is not None:
+                return result
+        return self._getitem(slice)
+
+    @dataset_reader
+    def _getitem(self, slice):
+        with open_file(self.file, 'r') as f:
+            return _read(_refresh(f, f[self.path]), slice)
+
+    @dataset_reader
+    def _read_generation(self, slice):
+        """
+        Returns (write generation, data), cf. ReadAhead.
+        """
+        with open_file(self.file, 'r') as f:
+            return (current_generation(self.file),
+                    _read(_refresh(f, f[self.path]), slice))
+
+    def read(self, selection=Ellipsis, out=None):
+        """
+        Reads ``selection`` (cf. __getitem__()), optionally into a
+        caller-provided array.
+
+        Args:
+            selection: anything supported by __getitem__()
+            out: optional output array, cf. read_direct()
+
+        Returns:
+            the data read (``out`` if given)
+        """
+        if out is None:
+            return self[selection]
+        source_sel = None if selection is Ellipsis else selection
+        self.read_direct(out, source_sel=source_sel)
+        return out
+
+    def read_direct(self, dest, source_sel=None, dest_sel=None):
+        """
+        Reads data directly into array ``dest`` without allocating an
+        intermediate array, cf. h5py.Dataset.read_direct(). ``dest`` may be
+        backed by shared memory, e.g.:
+
+            shm = multiprocessing.shared_memory.SharedMemory(
+                create=True, size=dst.dtype.itemsize * 8000 * 1500)
+            out = np.ndarray((8000, 1500), dtype=dst.dtype, buffer=shm.buf)
+            dst.read_direct(out)
+
+        Args:
+            dest: C-contiguous, writable numpy array
+            source_sel: selection in the dataset (default: everything)
+            dest_sel: selection in ``dest`` (default: everything)
+        """
+        if chunkcache.ENABLED:
+            result = chunkcache.read(
+                self, Ellipsis if source_sel is None else source_sel)
+            if result is not None:
+                dest[Ellipsis if dest_sel is None else dest_sel] = result
+                return
+        self._read_direct(dest, source_sel, dest_sel)
+
+    @dataset_reader
+    def _read_direct(self, dest, source_sel, dest_sel):
+        with open_file(self.file, 'r') as f:
+            _read_direct(_refresh(f, f[self.path]), dest, source_sel,
+                         dest_sel)
+
+    def parallel_read(self, selection=Ellipsis, workers=None, executor=None):
+        """
+        Reads ``selection`` with several processes, e.g., to decompress large
+        selections of gzip/lzf compressed datasets on several cores. The
+        selection is split along its first axis (at chunk boundaries) into
+        ``workers`` parts, which are read by worker processes (each holding
+        its own read lock) directly into a shared memory segment. The result
+        is backed by that segment, i.e., it is not copied.
+
+        The parts are read again if the file has been modified while they
+        were read (FileModifiedError is raised after three attempts).
+        Selections other than integers and slices (with step 1), datasets
+        of variable length types, and reads within a session of the current
+        thread (cf. File.read_session()) are performed by the current
+        process. Requires Linux (/dev/shm).
+
+        Args:
+            selection: cf. __getitem__()
+            workers: number of worker processes (default: number of CPUs)
+            executor: optional concurrent.futures.ProcessPoolExecutor (by
+                default, a pool of ``workers`` processes is started for
+                the call). Note that worker processes must use the same lock
+                backend (and redis server) as the current process.
+
+        Returns:
+            numpy array
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        shape, dtype = self.shape, self.dtype
+        box = chunkcache.hyperslab(selection, shape) if shape else None
+        if (box is None or dtype.hasobject
+                or session_mode(self.file) is not None
+                or not os.path.isdir(_SHM_DIR)):
+            # note that workers would wait for our lock (or for a writer
+            # waiting for our lock)
+            return self[selection]
+        parts = _split(box, self.chunks, workers)
+        out_shape = tuple(stop - start for start, stop, _ in box)
+        nbytes = int(np.prod(out_shape)) * dtype.itemsize
+        if len(parts) < 2 or nbytes == 0:
+            return self[selection]
+
+        shm_path = os.path.join(_SHM_DIR, 'h5pyswmr_read_{0}'.format(
+            uuid.uuid4().hex))
+        fd = os.open(shm_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        pool = executor
+        try:
+            os.ftruncate(fd, nbytes)
+            buf = mmap.mmap(fd, nbytes)
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=workers)
+            for attempt in range(3):
+                futures = [pool.submit(_read_part, self.file, self.path,
+                                       shm_path, out_shape, dtype.str,
+                                       source_sel, dest_sel)
+                           for source_sel, dest_sel in parts]
+                if len(set(future.result() for future in futures)) == 1:
+                    break
+            else:
+                raise FileModifiedError("{0} has been modified while "
+                                        "reading {1}".format(self.file,
+                                                             self.path))
+        finally:
+            os.close(fd)
+            os.unlink(shm_path)
+            if executor is None and pool is not None:
+                pool.shutdown()
+        out = np.frombuffer(buf, dtype=dtype).reshape(out_shape)
+        return out[tuple(0 if drop else slice(None) for _, _, drop in box)]
+
+    @swmr_writer
     def __setitem__(self, slice, value):
         """
         Broadcasting for datasets. Example: mydataset[0,:] = np.arange(100)
         """
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             f[self.path][slice] = value
 
-    @writer
+    @swmr_writer
     def resize(self, size, axis=None):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             f[self.path].resize(size, axis)
 
+    @swmr_writer
+    def append(self, rows, axis=0, growth=None):
+        """
+        Appends ``rows`` along ``axis``, i.e., resizes the dataset and writes
+        the rows under a single write lock (opening the file only once).
+
+        Example:
+            dst.append(np.array([t, temperature, humidity]))
+
+        Args:
+            rows: a single row (one dimension less than the dataset) or an
+                array of rows
+            axis: axis along which the dataset is extended
+            growth: if not None, a full dataset is resized to (at least)
+                ``growth`` times its size, cf. h5pyswmr/appender.py. The
+                shape of the valid part is stored in attribute
+                appender.SHAPE_ATTR. Not supported in SWMR mode.
+
+        Returns:
+            number of valid rows after appending
+        """
+        with open_file(self.file, 'r+') as f:
+            dset = f[self.path]
+            rows = np.asarray(rows, dtype=dset.dtype)
+            if rows.ndim < dset.ndim:
+                rows = np.expand_dims(rows, axis)
+            size = dset.shape[axis]
+            grown = SHAPE_ATTR in dset.attrs
+            start = valid_shape(dset)[axis]
+            stop = start + rows.shape[axis]
+            if stop > size:
+                if growth is not None:
+                    if f.swmr_mode:
+                        raise ValueError("growth is not supported in SWMR "
+                                         "mode")
+                    size = max(stop, int(math.ceil(size * growth)))
+                else:
+                    size = stop
+                dset.resize(size, axis)
+            dset[(slice(None), ) * axis + (slice(start, stop), )] = rows
+            if growth is not None or grown:
+                shape = list(dset.shape)
+                shape[axis] = stop
+                dset.attrs[SHAPE_ATTR] = shape
+            return stop
+
+    def appender(self, axis=0, max_rows=None, max_bytes=None, max_delay=None,
+                 growth=None):
+        """
+        Returns an Appender buffering rows appended to this dataset, which
+        are appended in batches (each under a single write lock).
+
+        Example:
+            with dst.appender(max_rows=60, max_delay=600) as app:
+                for row in rows:
+                    app.append(row)
+
+        Args:
+            cf. Appender
+        """
+        return Appender(self, axis=axis, max_rows=max_rows,
+                        max_bytes=max_bytes, max_delay=max_delay,
+                        growth=growth)
+
+    @writer
+    def _shrink(self):
+        """
+        Shrinks a dataset that has grown geometrically (cf. append()) to its
+        valid part.
+        """
+        with open_file(self.file, 'r+') as f:
+            dset = f[self.path]
+            if SHAPE_ATTR in dset.attrs:
+                dset.resize(valid_shape(dset))
+                del dset.attrs[SHAPE_ATTR]
+
     @property
-    @reader
+    @cached_metadata
+    @dataset_reader
     def shape(self):
-        with h5py.File(self.file, 'r') as f:
-            return f[self.path].shape
+        with open_file(self.file, 'r') as f:
+            return valid_shape(_refresh(f, f[self.path]))
 
     @property
+    @cached_metadata
     @reader
     def dtype(self):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             return f[self.path].dtype
 
+    @property
+    @cached_metadata
+    @reader
+    def chunks(self):
+        with open_file(self.file, 'r') as f:
+            return f[self.path].chunks
+
+    @property
+    @cached_metadata
+    @reader
+    def compression(self):
+        with open_file(self.file, 'r') as f:
+            return f[self.path].compression
+
+    def __len__(self):
+        """
+        Length of the first axis, cf. h5py.Dataset.__len__()
+        """
+        shape = self.shape
+        if len(shape) == 0:
+            raise TypeError("attempt to take len() of scalar dataset")
+        return shape[0]
+
+    def iter_blocks(self, rows, axis=0, on_change=None):
+        """
+        Generator reading the dataset block by block along ``axis``, e.g.,
+        to process large datasets with constant memory. Every block is read
+        under its own read lock, i.e., writers are not blocked while blocks
+        are processed.
+
+        Example:
+            for selection, block in dst.iter_blocks(1000):
+                total += block.sum()
+
+        Args:
+            rows: number of indices along ``axis`` per block (the last block
+                may be smaller)
+            axis: axis along which the dataset is split
+            on_change: what to do if the file has been modified by a writer
+                since the first block has been read: None (ignore),
+                'raise' (raise FileModifiedError) or 'restart' (yield all
+                blocks again, starting with the first one). Note that
+                writers in SWMR mode are not detected.
+
+        Yields:
+            (selection, block) pairs, where selection is a tuple of slices
+        """
+        if on_change not in (None, 'raise', 'restart'):
+            raise ValueError("invalid on_change {0!r}".format(on_change))
+        if rows < 1:
+            raise ValueError("rows must be positive")
+        start = 0
+        first_generation = None
+        while True:
+            generation, selection, block = self._read_block(axis, start, rows)
+            if first_generation is None:
+                first_generation = generation
+            elif generation != first_generation and on_change is not None:
+                if on_change == 'raise':
+                    raise FileModifiedError("{0} has been modified while "
+                                            "iterating over {1}"
+                                            .format(self.file, self.path))
+                start = 0
+                first_generation = None
+                continue
+            if block is None:
+                return
+            yield selection, block
+            start += rows
+
+    def iter_chunks(self, axis=0, rows=None, on_change=None):
+        """
+        Like iter_blocks(), but blocks are aligned to the chunks of the
+        dataset, i.e., every chunk is read (and decompressed) only once.
+
+        Args:
+            axis: cf. iter_blocks()
+            rows: minimum number of indices along ``axis`` per block, rounded
+                up to a multiple of the chunk size (default: chunk size).
+                Required for contiguous datasets.
+            on_change: cf. iter_blocks()
+        """
+        chunks = self.chunks
+        if chunks is None:
+            if rows is None:
+                raise ValueError("dataset is not chunked, rows is required")
+        else:
+            n = -(-(rows or 1) // chunks[axis])
+            rows = n * chunks[axis]
+        return self.iter_blocks(rows, axis=axis, on_change=on_change)
+
+    @dataset_reader
+    def _read_block(self, axis, start, rows):
+        """
+        Returns (write generation, selection, block), where selection and
+        block are None if ``start`` is beyond the end of the dataset.
+        """
+        generation = current_generation(self.file)
+        with open_file(self.file, 'r') as f:
+            dset = _refresh(f, f[self.path])
+            size = valid_shape(dset)[axis]
+            if start >= size:
+                return generation, None, None
+            selection = ((slice(None), ) * axis
+                         + (slice(start, min(start + rows, size)), ))
+            return generation, selection, dset[selection]
+
+
+class FileModifiedError(Exception):
+    """
+    Raised if a file has been modified while it is read in several steps,
+    cf. Dataset.iter_blocks().
+    """
+    pass
+
+
+def _split(box, chunks, n):
+    """
+    Splits a hyperslab (cf. chunkcache.hyperslab()) along its first axis of
+    length > 1 into at most ``n`` parts, whose boundaries are chunk
+    boundaries (if ``chunks`` is not None).
+
+    Returns:
+        list of (source selection, destination selection) pairs
+    """
+    for axis, (start, stop, _) in enumerate(box):
+        if stop - start > 1:
+            break
+    else:
+        return []
+    step = 1 if chunks is None else chunks[axis]
+    cuts = [start]
+    for i in range(1, n):
+        # chunk boundary closest to an even split
+        cut = int(round(float(start + (stop - start) * i // n) / step)) * step
+        if cuts[-1] < cut < stop:
+            cuts.append(cut)
+    cuts.append(stop)
+    source = [slice(lo, hi) for lo, hi, _ in box]
+    dest = [slice(None)] * len(box)
+    parts = []
+    for lo, hi in zip(cuts[:-1], cuts[1:]):
+        source[axis] = slice(lo, hi)
+        dest[axis] = slice(lo - start, hi - start)
+        parts.append((tuple(source), tuple(dest)))
+    return parts
+
+
+def _read_part(filename, path, shm_path, shape, dtype, source_sel, dest_sel):
+    """
+    Reads part of a selection into a shared memory segment, cf.
+    Dataset.parallel_read() (runs in a worker process).
+
+    Returns:
+        write generation of the file
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    fd = os.open(shm_path, os.O_RDWR)
+    try:
+        buf = mmap.mmap(fd, nbytes)
+    finally:
+        os.close(fd)
+    try:
+        out = np.frombuffer(buf, dtype=dtype).reshape(shape)
+        with session(filename, 'r'):
+            Dataset(filename, path).read_direct(out, source_sel, dest_sel)
+            generation = current_generation(filename)
+        del out
+    finally:
+        buf.close()
+    return generation
+
+
+def _refresh(f, dset):
+    """
+    Refreshes the metadata of h5py.Dataset ``dset`` (of h5py.File ``f``) if
+    ``f`` is read in SWMR mode, where data may have been appended since the
+    file was opened.
+
+    Returns:
+        ``dset``
+    """
+    if f.swmr_mode and f.mode == 'r':
+        dset.refresh()
+    return dset
+
+
+def _read(dset, selection):
+    """
+    Reads ``selection`` of h5py.Dataset ``dset``, which refers to the valid
+    part of the dataset (cf. appender.valid_shape()).
+    """
+    shape = valid_shape(dset)
+    if shape == dset.shape:
+        return dset[selection]
+    valid = _valid_selection(selection, shape)
+    if valid is None:
+        # e.g., fancy indexing: select from the valid part
+        return dset[tuple(slice(0, n) for n in shape)][selection]
+    return dset[valid]
+
+
+def _read_direct(dset, dest, source_sel, dest_sel):
+    """
+    h5py.Dataset.read_direct(), where ``source_sel`` refers to the valid part
+    of the dataset, cf. _read().
+    """
+    shape = valid_shape(dset)
+    if shape != dset.shape:
+        selection = Ellipsis if source_sel is None else source_sel
+        source_sel = _valid_selection(selection, shape)
+        if source_sel is None:
+            dest[Ellipsis if dest_sel is None else dest_sel] = _read(
+                dset, selection)
+            return
+    dset.read_direct(dest, source_sel, dest_sel)
+
+
+def _valid_selection(selection, shape):
+    """
+    Converts a hyperslab selection (cf. chunkcache.hyperslab()) of a dataset
+    whose valid part has shape ``shape`` into explicit indices and slices,
+    or returns None if the selection is not supported.
+    """
+    box = chunkcache.hyperslab(selection, shape)
+    if box is None:
+        return None
+    return tuple(start if drop else slice(start, stop)
+                 for start, stop, drop in box)
+
+
+def _create_dataset(group, kwargs):
+    """
+    Creates a dataset in h5py.Group ``group``. Unlike h5py, keyword argument
+    ``overwrite=True`` causes an existing dataset to be replaced.
+    """
+    # remove additional arguments because they are not supported by h5py
+    overwrite = kwargs.pop('overwrite', False)
+    if overwrite and kwargs['name'] in group:
+        del group[kwargs['name']]
+    return group.create_dataset(**kwargs)
+
+
+def _selection_offset(selection):
+    """
+    Returns the offset of a selection (tuple of start indices of slices and
+    integer indices), which is used to sort selections. Other kinds of
+    selections have offset 0.
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection, )
+    offset = []
+    for index in selection:
+        if isinstance(index, slice):
+            offset.append(index.start or 0)
+        elif isinstance(index, numbers.Integral):
+            offset.append(index)
+        else:
+            offset.append(0)
+    return tuple(offset)
+
 
 class AttributeManager(object):
     """
@@ -297,51 +1018,48 @@ class AttributeManager(object):
         self.file = h5file
         self.path = path
 
+    @cached_metadata
     @reader
+    def _contents(self):
+        """
+        Returns all attributes (dict)
+        """
+        with open_file(self.file, 'r') as f:
+            node = f[self.path]
+            return dict(node.attrs.items())
+
     def __iter__(self):
         # In order to be compatible with h5py, we return a generator.
         # However, to preserve thread-safety, we must make sure that the hdf5
         # file is closed while the generator is being traversed.
-        with h5py.File(self.file, 'r') as f:
-            node = f[self.path]
-            keys = [key for key in node.attrs]
+        keys = list(self._contents())
 
         return (key for key in keys)
 
-    @reader
     def keys(self):
         """
         Returns attribute keys (list)
         """
-        with h5py.File(self.file, 'r') as f:
-            node = f[self.path]
-            return list(node.attrs.keys())
+        return list(self._contents())
 
-    @reader
     def __contains__(self, key):
-        with h5py.File(self.file, 'r') as f:
-            node = f[self.path]
-            return key in node.attrs
+        return key in self._contents()
 
-    @reader
     def __getitem__(self, key):
-        with h5py.File(self.file, 'r') as f:
-            node = f[self.path]
-            return node.attrs[key]
+        return _copy_value(self._contents()[key])
 
     @writer
     def __setitem__(self, key, value):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             node = f[self.path]
             node.attrs[key] = value
 
     @writer
     def __delitem__(self, key):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             node = f[self.path]
             del node.attrs[key]
 
-    @reader
     def get(self, key, defaultvalue):
         """
         Return attribute value or return a default value if key is missing.
@@ -349,6 +1067,17 @@ class AttributeManager(object):
             key: attribute key
             defaultvalue: default value to be returned if key is missing
         """
-        with h5py.File(self.file, 'r') as f:
-            node = f[self.path]
-            return node.attrs.get(key, defaultvalue)
+        contents = self._contents()
+        if key in contents:
+            return _copy_value(contents[key])
+        return defaultvalue
+
+
+def _copy_value(value):
+    """
+    Returns a copy of ``value`` if it is a (mutable) array, e.g., a cached
+    attribute value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
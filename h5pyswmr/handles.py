@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-process cache of open (read-only) h5py.File objects.
+
+Opening an HDF5 file, i.e., reading its superblock and parsing metadata, is
+expensive. Therefore, files opened by readers are kept open and are re-used
+by subsequent readers of the same process, as long as the file has not been
+modified in the meantime. Modifications are detected by comparing write
+generations: every writer increments the generation of the file it has
+written to (cf. locking.writer), and readers learn the current generation
+when they enter (cf. locking.current_generation()). Generations are tokens
+qualified by an epoch (cf. locking.LockBackend.generation()): a counter that
+starts over (e.g., after util/redis_delkeys.py) never matches the generation
+of a cached file. Nothing else would detect stale files: HDF5 file locking
+is disabled (see below).
+
+Files in SWMR mode (cf. locking.enable_swmr()) are opened with the
+corresponding flags, i.e., readers open them with ``swmr=True`` and SWMR
+writers switch to ``swmr_mode``.
+
+HDF5 cannot open a file read/write while it is open read-only in the same
+process (and vice versa). In SWMR mode, readers and SWMR writers of the same
+process may run concurrently, therefore threads wait until other threads
+have finished using the file with different flags (cf. _use()).
+
+Note that HDF5 file locking (HDF5 >= 1.10) is disabled for files opened by
+h5pySWMR, otherwise writers could not open files kept open by readers of
+other processes. HDF5 file locking is not needed anyway because access
+is synchronized by h5pySWMR. Disabling file locking requires h5py >= 3.5
+and HDF5 >= 1.12.1 (or 1.10.7); with older versions, files are not cached.
+"""
+
+from __future__ import absolute_import
+
+import contextlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import h5py
+
+from . import instrumentation, locking
+from .locking import (current_generation, swmr_enabled, swmr_writing,
+                      LockException)
+
+
+# maximum number of files kept open by a process (0 disables caching)
+MAX_OPEN_FILES = 32
+
+
+def _locking_kwarg_supported():
+    """
+    h5py >= 3.5 allows disabling HDF5 file locking for individual files,
+    which requires HDF5 >= 1.12.1 (or >= 1.10.7 on the 1.10 branch).
+    """
+    if tuple(h5py.version.version_tuple[:2]) < (3, 5):
+        return False
+    hdf5 = tuple(h5py.version.hdf5_version_tuple[:3])
+    if hdf5[:2] == (1, 10):
+        return hdf5 >= (1, 10, 7)
+    return hdf5 >= (1, 12, 1)
+
+
+_LOCKING_KWARG = _locking_kwarg_supported()
+
+
+class _Handle(object):
+    """
+    Cached h5py.File object
+    """
+
+    def __init__(self, h5file, generation):
+        self.file = h5file
+        self.generation = generation
+        self.users = 0        # number of threads currently using the file
+        self.stale = False    # if True, file is closed when no longer used
+
+
+_cache = OrderedDict()  # file name => _Handle, least recently used first
+_cache_lock = threading.RLock()
+_pid = os.getpid()
+
+# file name => [number of read-only users, number of read/write users]
+_users = {}
+_users_changed = threading.Condition(_cache_lock)
+
+# files kept open by sessions of the current thread, cf. session()
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def open_file(name, mode=None, **kwargs):
+    """
+    Context manager returning an h5py.File object. Files opened read-only
+    (``mode='r'``) from within a @reader method are taken from the cache.
+    All other files are opened (and closed) as usual, after cached handles
+    of the same file have been closed.
+
+    Within a session (cf. session()), the file of the session is returned.
+
+    Args:
+        name: file name
+        mode: mode, cf. h5py.File
+        kwargs: passed on to h5py.File
+    """
+    session_file = _session_files().get(name)
+    if session_file is not None:
+        yield session_file
+        return
+
+    with _use(name, mode):
+        generation = current_generation(name) if mode == 'r' else None
+        if (generation is None or kwargs or MAX_OPEN_FILES <= 0
+                or not _LOCKING_KWARG):
+            if mode != 'r':
+                # HDF5 does not allow to open a file that is already open
+                # with different flags
+                evict(name)
+            with _open(name, mode, **kwargs) as f:
+                yield f
+            return
+
+        handle = _checkout(name, generation)
+        try:
+            yield handle.file
+        finally:
+            _checkin(handle)
+
+
+@contextlib.contextmanager
+def session(name, mode):
+    """
+    Context manager keeping file ``name`` open for the whole with block.
+    Calls of open_file() from within the block (by the current thread)
+    return the same h5py.File object. Note that the caller must hold the
+    corresponding lock, cf. locking.session().
+
+    Args:
+        name: file name
+        mode: 'r' (read-only) or 'r+' (read/write)
+    """
+    files = _session_files()
+    if name in files:
+        # nested session
+        yield files[name]
+        return
+    with open_file(name, mode) as f:
+        files[name] = f
+        try:
+            yield f
+        finally:
+            del files[name]
+
+
+@contextlib.contextmanager
+def _use(name, mode):
+    """
+    Registers the current thread as a user of file ``name`` for the with
+    block. Waits (at most locking.ACQ_TIMEOUT seconds) until other threads
+    have finished using the file with different flags, cf. module docstring.
+    """
+    kind = 0 if mode == 'r' else 1
+    with _users_changed:
+        _check_pid()
+        end = time.time() + locking.ACQ_TIMEOUT
+        while True:
+            users = _users.setdefault(name, [0, 0])
+            if users[1 - kind] == 0:
+                break
+            remaining = end - time.time()
+            if remaining <= 0:
+                raise LockException("file {0} is in use by another thread"
+                                    .format(name))
+            _users_changed.wait(remaining)
+        users[kind] += 1
+    try:
+        yield
+    finally:
+        with _users_changed:
+            users[kind] -= 1
+            if users == [0, 0]:
+                del _users[name]
+            _users_changed.notify_all()
+
+
+def _session_files():
+    # a forked child process must not use the files of its parent
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.files = {}
+    return _local.files
+
+
+def evict(name):
+    """
+    Removes a file from the cache. It is closed as soon as it is no longer
+    used.
+    """
+    with _cache_lock:
+        _check_pid()
+        handle = _cache.pop(name, None)
+        if handle is not None:
+            _discard(handle)
+
+
+def clear():
+    """
+    Closes all cached files (as soon as they are no longer used).
+    """
+    with _cache_lock:
+        _check_pid()
+        while _cache:
+            _discard(_cache.popitem()[1])
+
+
+def _open(name, mode, **kwargs):
+    if _LOCKING_KWARG:
+        kwargs.setdefault('locking', False)
+    if swmr_enabled(name):
+        # cf. locking.enable_swmr()
+        if mode == 'r':
+            kwargs.setdefault('swmr', True)
+        else:
+            kwargs.setdefault('libver', 'latest')
+    start = time.perf_counter() if instrumentation.hooks else None
+    f = h5py.File(name, mode, **kwargs)
+    if mode != 'r' and swmr_writing(name):
+        f.swmr_mode = True
+    if start is not None:
+        instrumentation.emit('open', name, mode, time.perf_counter() - start)
+    return f
+
+
+def _checkout(name, generation):
+    with _cache_lock:
+        _check_pid()
+        handle = _cache.pop(name, None)
+        if handle is not None and handle.generation != generation:
+            # file has been modified since it was opened
+            _discard(handle)
+            handle = None
+        if handle is None:
+            handle = _Handle(_open(name, 'r'), generation)
+        _cache[name] = handle  # (re-)insert as most recently used
+        handle.users += 1
+        while len(_cache) > MAX_OPEN_FILES:
+            _discard(_cache.popitem(last=False)[1])
+        return handle
+
+
+def _checkin(handle):
+    with _cache_lock:
+        handle.users -= 1
+        if handle.stale and handle.users <= 0:
+            handle.file.close()
+
+
+def _discard(handle):
+    handle.stale = True
+    if handle.users <= 0:
+        handle.file.close()
+
+
+def _check_pid():
+    """
+    Files must not be shared with forked child processes: the child closes
+    the files it has inherited.
+    """
+    global _pid
+    if _pid != os.getpid():
+        for handle in _cache.values():
+            try:
+                handle.file.close()
+            except Exception:
+                pass
+        _cache.clear()
+        _users.clear()
+        _pid = os.getpid()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation of lock operations and file accesses.
+
+Instrumented code reports events to hooks (cf. add_hook()). A hook is any
+callable taking an Event, e.g., a Metrics object (histograms and counters
+with a Prometheus text exporter), a LoggingHook or a custom callback. As
+long as no hook is registered, instrumented code merely tests whether the
+list ``hooks`` is empty, i.e., instrumentation costs (almost) nothing.
+
+Example:
+    from h5pyswmr import instrumentation
+
+    metrics = instrumentation.Metrics()
+    instrumentation.add_hook(metrics)
+    ...
+    print(metrics.prometheus())
+
+Event kinds (Event.kind), where Event.value is a duration in seconds unless
+stated otherwise:
+
+* 'acquire': acquisition of a read or write lock on a file (Event.lock is
+  'read' or 'write'), including all waiting and round-trips
+* 'hold': time a read or write lock was held (critical section)
+* 'wait': time spent waiting for a particular lock (Event.lock is the lock
+  name without the file name, e.g., 'r', 'w' or 'swmrwriter'), 0 if the
+  lock was available (cf. locking.get_wait_stats())
+* 'retries': number of failed attempts to acquire a lock (value is a count,
+  reported only if greater than 0)
+* 'timeout': a lock could not be acquired in time (value is the time spent
+  waiting)
+* 'round_trip': execution of a script by the redis server (Event.lock is the
+  script name, e.g., 'reader_enter')
+* 'open': opening an HDF5 file (Event.lock is the file mode)
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import collections
+import logging
+import threading
+import time
+import warnings
+
+
+# registered hooks, cf. add_hook()
+hooks = []
+
+Event = collections.namedtuple('Event', ['kind', 'filename', 'lock',
+                                         'value'])
+
+# kinds of events whose value is a count rather than a duration
+COUNTERS = ('retries', 'timeout')
+
+# upper bounds (seconds) of histogram buckets, cf. Metrics
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+
+def add_hook(hook):
+    """
+    Registers ``hook``, a callable taking an Event, which is called for
+    every event of the current process (by the thread causing the event).
+    """
+    # hooks is replaced (rather than modified) such that emit() may iterate
+    # over it without holding a lock
+    global hooks
+    hooks = hooks + [hook]
+
+
+def remove_hook(hook):
+    """
+    Removes a hook registered by add_hook().
+    """
+    global hooks
+    hooks = [h for h in hooks if h != hook]
+
+
+def emit(kind, filename, lock, value):
+    """
+    Passes an event on to all hooks. Exceptions raised by hooks are turned
+    into warnings, i.e., they do not interfere with locking.
+    """
+    event = Event(kind, filename, lock, value)
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            warnings.warn("h5pySWMR: instrumentation hook {0!r} failed: {1!r}"
+                          .format(hook, e), RuntimeWarning)
+
+
+def split_lockname(lockname):
+    """
+    Splits a lock name such as 'w__data.h5' into file name and lock
+    ('data.h5', 'w'). The file name is None for lock names without a file.
+    """
+    lock, sep, filename = lockname.partition('__')
+    if not sep:
+        return None, lockname
+    return filename, lock
+
+
+def timed_script(script, name):
+    """
+    Wraps a redis script (cf. redis.StrictRedis.register_script()) such that
+    its executions are reported as 'round_trip' events. The file name is
+    taken from the first key.
+    """
+    def call(keys=[], args=[], client=None):
+        if not hooks:
+            return script(keys=keys, args=args, client=client)
+        start = time.perf_counter()
+        try:
+            return script(keys=keys, args=args, client=client)
+        finally:
+            filename = split_lockname(keys[0])[0] if keys else None
+            emit('round_trip', filename, name, time.perf_counter() - start)
+
+    return call
+
+
+class LoggingHook(object):
+    """
+    Hook logging every event.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        """
+        Args:
+            logger: logging.Logger (logger 'h5pyswmr' by default)
+            level: log level of the events
+        """
+        self.logger = logger or logging.getLogger('h5pyswmr')
+        self.level = level
+
+    def __call__(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s file=%s lock=%s value=%r",
+                            event.kind, event.filename, event.lock,
+                            event.value)
+
+
+class Metrics(object):
+    """
+    Hook aggregating events per (kind, file, lock): durations are collected
+    in histograms (cf. BUCKETS), counts (cf. COUNTERS) are summed up.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (kind, file, lock) => [count per bucket..., sum]
+        self._histograms = {}
+        # (kind, file, lock) => total
+        self._counters = {}
+
+    def __call__(self, event):
+        key = (event.kind, event.filename, event.lock)
+        with self._lock:
+            if event.kind in COUNTERS:
+                if event.kind == 'timeout':
+                    self._counters[key] = self._counters.get(key, 0) + 1
+                else:
+                    self._counters[key] = (self._counters.get(key, 0)
+                                           + event.value)
+                return
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            hist[bisect.bisect_left(self.buckets, event.value)] += 1
+            hist[-1] += event.value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """
+        Returns a dict mapping (kind, file, lock) to dicts with the keys
+        'count', 'sum' and 'buckets' (list of (upper bound, cumulative count)
+        pairs, the last bound being inf) for durations, or to totals for
+        counters ('retries', 'timeout').
+        """
+        with self._lock:
+            histograms = dict((key, list(hist))
+                              for key, hist in self._histograms.items())
+            result = dict(self._counters)
+        for key, hist in histograms.items():
+            counts = hist[:-1]
+            cumulative = 0
+            buckets = []
+            for bound, n in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += n
+                buckets.append((bound, cumulative))
+            result[key] = {'count': cumulative, 'sum': hist[-1],
+                           'buckets': buckets}
+        return result
+
+    def prometheus(self, prefix='h5pyswmr'):
+        """
+        Returns the metrics in the Prometheus text exposition format, e.g.,
+        for node_exporter's textfile collector or an HTTP endpoint.
+        Durations are exported as histograms <prefix>_<kind>_seconds,
+        counters as <prefix>_<kind>_total, labelled by file and lock.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind in sorted(set(key[0] for key in snapshot)):
+            keys = sorted((key for key in snapshot if key[0] == kind),
+                          key=lambda key: (key[1] or '', key[2] or ''))
+            if kind in COUNTERS:
+                name = '{0}_{1}_total'.format(prefix, kind)
+                lines.append('# TYPE {0} counter'.format(name))
+                for key in keys:
+                    lines.append('{0}{{{1}}} {2}'.format(
+                        name, _labels(key), snapshot[key]))
+                continue
+            name = '{0}_{1}_seconds'.format(prefix, kind)
+            lines.append('# TYPE {0} histogram'.format(name))
+            for key in keys:
+                labels = _labels(key)
+                hist = snapshot[key]
+                for bound, count in hist['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                        name, labels, le, count))
+                lines.append('{0}_sum{{{1}}} {2!r}'.format(
+                    name, labels, hist['sum']))
+                lines.append('{0}_count{{{1}}} {2}'.format(
+                    name, labels, hist['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    _, filename, lock = key
+    return 'file="{0}",lock="{1}"'.format(_escape(filename or ''),
+                                          _escape(lock or ''))
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
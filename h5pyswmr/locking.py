@@ -9,6 +9,10 @@ To get a working solution for process-based concurrency, one has to deal
 with (unexpected) process termination, which makes our solution slightly
 more involved.
 
+Locks are implemented by a lock backend (cf. LockBackend, lock_backend).
+The default backend is based on a redis server; fcntlbackend.FcntlBackend
+is an alternative for single-node deployments.
+
 Lock/semaphore implementation based on redis server.
 Using redis allows locks to be shared among processes, even if processes are
 not forked from a common parent process.
@@ -27,30 +31,147 @@ to be automatically released. After that happened, another client may
 acquire the same lock (with a different identifier). The different
 identifier now prohibits the first client from releasing the lock, which
 is good because the second client may be performing critical operations.
-This reduces (but does not eliminate) potential damage. Clearly,
-programmers should make sure that clients do not exceed lock timeouts.
+This reduces (but does not eliminate) potential damage.
+Therefore, a background thread (the lease keeper) extends the timeouts of
+all locks held by the current process every LEASE_TIMEOUT / 3 seconds
+(cf. RENEW_LEASES). Locks can thus have a short timeout (LEASE_TIMEOUT),
+which releases the locks of crashed processes within seconds, while long
+operations keep their locks.
 """
 
+import errno
 import os
+import socket
 import time
 import contextlib
+import threading
 import uuid
-from functools import wraps
+import warnings
+import weakref
+from functools import partial, wraps
 
 import redis
 
-from .exithandler import handle_exit
+from . import exithandler, instrumentation
+from .exithandler import cleanup
+from .instrumentation import timed_script
+
+
+def configure(url=None, pool_size=None, socket_keepalive=None,
+              unix_socket_path=None, pool_timeout=20, **kwargs):
+    """
+    Configures the connection to the redis server (redis_conn). Should be
+    called before any file is accessed. Forked child processes build their
+    own connection pool (redis.ConnectionPool is fork-safe: a child process
+    discards the connections of its parent without shutting down their
+    sockets).
+
+    Example:
+        h5pyswmr.configure(unix_socket_path='/var/run/redis/redis.sock')
+
+    Args:
+        url: redis URL, e.g., 'redis://localhost:6379/0' or
+            'unix:///var/run/redis/redis.sock?db=0'. Defaults to localhost,
+            port 6379, database 0.
+        pool_size: maximum number of connections per process (unlimited by
+            default). If the pool is exhausted, a thread blocks until a
+            connection is returned to the pool (redis.BlockingConnectionPool).
+            Note that every thread waiting for a lock holds a connection
+            (its pub/sub subscription) while it waits, and so does the lease
+            keeper while it renews leases, i.e., ``pool_size`` should exceed
+            the number of threads that access files concurrently.
+        socket_keepalive: enables TCP keepalive (ignored for unix sockets)
+        unix_socket_path: path of the redis server's unix domain socket,
+            which is considerably faster than TCP on the same machine (takes
+            precedence over ``url``)
+        pool_timeout: seconds a thread waits for a connection of an
+            exhausted pool (only if ``pool_size`` is given; None waits
+            forever) before redis.ConnectionError is raised
+        kwargs: passed on to redis.ConnectionPool, e.g., password or
+            socket_timeout
+    """
+    global redis_conn
+    kwargs['decode_responses'] = True  # important for Python3
+    if pool_size is not None:
+        # redis.ConnectionPool raises an error if all of its connections are
+        # in use, whereas redis.BlockingConnectionPool waits for one
+        pool_class = redis.BlockingConnectionPool
+        kwargs['max_connections'] = pool_size
+        kwargs['timeout'] = pool_timeout
+    else:
+        pool_class = redis.ConnectionPool
+    if unix_socket_path is not None:
+        kwargs.setdefault('db', 0)
+        pool = pool_class(
+            connection_class=redis.UnixDomainSocketConnection,
+            path=unix_socket_path, **kwargs)
+    else:
+        if socket_keepalive is not None:
+            kwargs['socket_keepalive'] = socket_keepalive
+        if url is not None:
+            pool = pool_class.from_url(url, **kwargs)
+        else:
+            pool = pool_class(host='localhost', port=6379, db=0, **kwargs)
+    redis_conn = redis.StrictRedis(connection_pool=pool)
+
+
+def _host_identity():
+    """
+    Returns the identity of the current host as seen by os.kill(): host name,
+    boot id and the pid namespace of the process. Containers sharing a host
+    name (or pids that have been reused after a reboot) thus have different
+    identities. Only the host name is available on systems without /proc.
+    """
+    parts = [socket.gethostname()]
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            parts.append(f.read().strip())
+        parts.append(str(os.stat('/proc/self/ns/pid').st_ino))
+    except (IOError, OSError):
+        pass
+    return '/'.join(parts)
+
 
+_HOST_ID = _host_identity()
 
-# we make sure that redis connections do not time out
-redis_conn = redis.StrictRedis(host='localhost', port=6379, db=0,
-                               decode_responses=True)  # important for Python3
+# connection to the redis server, cf. configure()
+redis_conn = None
+configure()
 
 
+# chain a SIGTERM handler installed by the application, cf.
+# exithandler.install()
 APPEND_SIGHANDLER = True
 DEFAULT_TIMEOUT = 20  # seconds
 ACQ_TIMEOUT = 15
 
+# SIGTERM releases the locks of all threads, provided that the signal
+# handler is installed by the main thread (cf. exithandler)
+if threading.current_thread() is threading.main_thread():
+    try:
+        exithandler.install(APPEND_SIGHANDLER)
+    except (RuntimeError, ValueError):
+        pass
+
+# If RENEW_LEASES is True, locks time out after LEASE_TIMEOUT seconds but are
+# renewed by the lease keeper as long as they are held (cf. module
+# docstring). Otherwise, locks time out after DEFAULT_TIMEOUT seconds.
+RENEW_LEASES = True
+LEASE_TIMEOUT = 2  # seconds
+
+# interval (seconds) in which waiting writers remove the registrations of
+# dead readers, cf. reap_readers()
+REAP_INTERVAL = 1
+
+# How processes wait for a lock that is currently held:
+# 'pubsub': block until the lock holder publishes a release notification on
+#     the lock's channel (see notify_channel()). Locks may also be released
+#     without notification (e.g., if they time out), therefore waiters check
+#     the lock at least every WAIT_POLL_INTERVAL seconds.
+# 'poll': try to acquire the lock every millisecond.
+WAIT_MODE = 'pubsub'
+WAIT_POLL_INTERVAL = 0.1  # seconds
+
 
 # note that the process releasing the read/write lock may not be the
 # same as the one that acquired it, so the identifier may have
@@ -60,6 +181,362 @@ WRITELOCK_ID = 'id_reader'
 READLOCK_ID = 'id_writer'
 
 
+# Entry and exit sections of the readers/writer protocol are implemented as
+# Lua scripts. Redis executes a script atomically, i.e., no other command
+# is executed while a script is running. This has two consequences:
+# (1) mutex1, mutex2 and mutex3 of the original algorithm are no longer needed
+# because counters can be modified and tested atomically, and (2) every
+# entry/exit section costs a single round-trip to the redis server (instead
+# of a dozen setnx/expire/watch/get/multi/del commands).
+# Writers are still preferred: the first writer sets r, which blocks all
+# readers that have not yet entered.
+
+# Every writer increments the write generation of the file (generation__...),
+# which allows readers to find out whether a file has changed since they last
+# read it (cf. handles.py). The counter starts over if its key is deleted
+# (e.g., by util/redis_delkeys.py or a restart of the redis server), hence
+# it is qualified by an epoch (epoch__...), a random id that is replaced
+# whenever one of both keys is missing. Readers see the generation as a
+# token '<epoch>:<counter>', which never matches a token of an earlier
+# epoch (cf. _GENERATION).
+
+# Readers register in a sorted set (readers__...) mapping client ids (cf.
+# _client_id()) to deadlines (server time in milliseconds). The number of
+# readers is the number of registrations whose deadline has not passed.
+# Registrations are renewed by the lease keeper, i.e., the registration of a
+# reader that has crashed expires after the lock timeout (or is removed by
+# reap_readers() earlier). Expired registrations are removed by every script
+# accessing the set.
+# Likewise, writers (active or waiting) register in writers__... (cf.
+# reap_writers()). r is held as long as writers are registered: if the last
+# registered writer has crashed, readers release r.
+
+# current server time in milliseconds (scripts calling TIME must replicate
+# their effects rather than the script itself on redis < 5)
+_NOW = """
+pcall(redis.replicate_commands)
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+# generation_token(counter, epoch, new epoch) returns the generation token of
+# a file (cf. above) given the keys of its counter and epoch. If one of them
+# is missing, a new epoch (a random id passed in by the client) is started.
+_GENERATION = """
+local function generation_token(counter, epoch, new_epoch)
+    local value = redis.call('get', counter)
+    local id = redis.call('get', epoch)
+    if not value or not id then
+        value = value or '0'
+        id = new_epoch
+        redis.call('set', counter, value)
+        redis.call('set', epoch, id)
+    end
+    return id .. ':' .. value
+end
+"""
+
+# KEYS: r, w, readers, generation, writers, epoch
+# ARGV: lock timeout (milliseconds), WRITELOCK_ID, client id, new epoch
+# Returns the generation token if the reader has entered, nil if it must
+# wait.
+_READER_ENTER = _NOW + _GENERATION + """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('zremrangebyscore', KEYS[5], '-inf', now)
+    if redis.call('zcard', KEYS[5]) > 0 then
+        return false
+    end
+    -- r is left over by writers that have crashed
+    redis.call('del', KEYS[1])
+end
+local holder = redis.call('get', KEYS[2])
+if holder and holder ~= ARGV[2] then
+    -- w is held by a writer
+    return false
+end
+-- first reader sets w to block writers. Subsequent readers extend its
+-- timeout (or take it again if it has been lost).
+redis.call('set', KEYS[2], ARGV[2], 'px', ARGV[1])
+redis.call('zremrangebyscore', KEYS[3], '-inf', now)
+redis.call('zadd', KEYS[3], now + tonumber(ARGV[1]), ARGV[3])
+return generation_token(KEYS[4], KEYS[6], ARGV[4])
+"""
+
+# KEYS: w, readers
+# ARGV: WRITELOCK_ID, client id
+# Returns 0 if the last reader found that w was lost, 1 otherwise.
+# Note that notification channels must match notify_channel().
+_READER_EXIT = _NOW + """
+redis.call('zrem', KEYS[2], ARGV[2])
+redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+if redis.call('zcard', KEYS[2]) == 0 then
+    -- last reader releases w to open the gate for writers
+    if redis.call('get', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('del', KEYS[1])
+    redis.call('publish', 'notify__' .. KEYS[1], 'released')
+end
+return 1
+"""
+
+# Writer scripts. KEYS: r, w, writers, readers
+# ARGV: lock timeout (milliseconds), READLOCK_ID, identifier of w,
+# WRITELOCK_ID
+# Both return 1 if w was acquired, 0 otherwise.
+
+# acquires w if no reader is registered (w may still be held on behalf of
+# readers whose registrations have expired or have been reaped)
+_ACQUIRE_W = """
+redis.call('zremrangebyscore', KEYS[4], '-inf', now)
+if redis.call('zcard', KEYS[4]) > 0 then
+    return 0
+end
+if redis.call('get', KEYS[2]) == ARGV[4] then
+    redis.call('del', KEYS[2])
+end
+if redis.call('set', KEYS[2], ARGV[3], 'nx', 'px', ARGV[1]) then
+    return 1
+end
+return 0
+"""
+
+# Registers a writer (note that writers also contains waiting writers) and
+# tries to acquire w.
+_WRITER_ENTER = _NOW + """
+redis.call('zremrangebyscore', KEYS[3], '-inf', now)
+redis.call('zadd', KEYS[3], now + tonumber(ARGV[1]), ARGV[3])
+-- block new readers (the first writer sets r, subsequent writers extend its
+-- timeout)
+redis.call('set', KEYS[1], ARGV[2], 'px', ARGV[1])
+""" + _ACQUIRE_W
+
+# tries to acquire w (called by registered writers waiting for w)
+_WRITER_ACQUIRE = _NOW + _ACQUIRE_W
+
+# KEYS: r, w, writers, generation, epoch
+# ARGV: READLOCK_ID, identifier of w, '1' if w was acquired (empty string
+# otherwise), new epoch
+# Note that notification channels must match notify_channel().
+# Returns a bit mask: 1 if w was lost, 2 if r was lost.
+_WRITER_EXIT = _NOW + _GENERATION + """
+local lost = 0
+if ARGV[3] ~= '' then
+    generation_token(KEYS[4], KEYS[5], ARGV[4])
+    redis.call('incr', KEYS[4])
+    if redis.call('get', KEYS[2]) == ARGV[2] then
+        redis.call('del', KEYS[2])
+        redis.call('publish', 'notify__' .. KEYS[2], 'released')
+    else
+        lost = 1
+    end
+end
+redis.call('zrem', KEYS[3], ARGV[2])
+redis.call('zremrangebyscore', KEYS[3], '-inf', now)
+if redis.call('zcard', KEYS[3]) == 0 then
+    -- last writer releases r to open the gate for readers
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        redis.call('del', KEYS[1])
+        redis.call('publish', 'notify__' .. KEYS[1], 'released')
+    else
+        lost = lost + 2
+    end
+end
+return lost
+"""
+
+# KEYS: locks (or sets of registrations) to be renewed
+# ARGV: for every lock, its value (or client id) and its timeout
+# (milliseconds)
+# Extends the timeouts of locks (that still have the given values) and the
+# deadlines of registrations (that have not expired yet).
+_RENEW = _NOW + """
+for i, key in ipairs(KEYS) do
+    local value = ARGV[2 * i - 1]
+    local timeout = tonumber(ARGV[2 * i])
+    if redis.call('type', key)['ok'] == 'zset' then
+        local deadline = redis.call('zscore', key, value)
+        if deadline and tonumber(deadline) > now then
+            redis.call('zadd', key, now + timeout, value)
+        end
+    elseif redis.call('get', key) == value then
+        redis.call('pexpire', key, timeout)
+    end
+end
+return 0
+"""
+
+# Scripts of FairRedisBackend. Waiting readers and writers are queued in a
+# sorted set (queue__...) mapping members ('r:' + client id or
+# 'w:' + identifier of w) to tickets (ticket__... is incremented for every
+# new member). Waiters register with a deadline in waiters__... (renewed by
+# the lease keeper), i.e., a crashed waiter leaves the queue after the lock
+# timeout. phases__... maps every member to the write generation at the time
+# it was queued (cf. policy 'phase_fair').
+# Active readers register in readers__... (as above), the active writer holds
+# w. Release notifications are published on the channels of r (readers are
+# waiting for writers) and w (writers are waiting for readers and writers),
+# cf. notify_channel().
+
+# KEYS: queue, waiters, phases, readers, w, ticket, generation, epoch
+# ARGV: lock timeout (milliseconds), member, 'r' or 'w', policy, client id
+# (readers) or identifier of w (writers), new epoch
+# Queues the member (unless it is queued already) and enters if the policy
+# allows it. Returns the generation token if the member has entered, nil if
+# it must wait.
+_FAIR_ENTER = _NOW + _GENERATION + """
+local timeout = tonumber(ARGV[1])
+-- remove waiters (and readers) that have crashed
+for _, member in ipairs(redis.call('zrangebyscore', KEYS[2], '-inf', now)) do
+    redis.call('zrem', KEYS[1], member)
+    redis.call('hdel', KEYS[3], member)
+end
+redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+redis.call('zremrangebyscore', KEYS[4], '-inf', now)
+local token = generation_token(KEYS[7], KEYS[8], ARGV[6])
+local generation = tonumber(redis.call('get', KEYS[7]))
+local ticket = redis.call('zscore', KEYS[1], ARGV[2])
+if not ticket then
+    ticket = redis.call('incr', KEYS[6])
+    redis.call('zadd', KEYS[1], ticket, ARGV[2])
+    redis.call('hset', KEYS[3], ARGV[2], generation)
+end
+redis.call('zadd', KEYS[2], now + timeout, ARGV[2])
+if redis.call('exists', KEYS[5]) == 1 then
+    -- a writer is active
+    return false
+end
+if ARGV[3] == 'r' then
+    -- phase-fair: readers that have been waiting for a writer that has
+    -- completed in the meantime enter (before the next writer)
+    local phase = tonumber(redis.call('hget', KEYS[3], ARGV[2]))
+    if ARGV[4] ~= 'phase_fair' or phase >= generation then
+        -- otherwise, readers wait for the writers queued before them
+        local ahead = redis.call('zrangebyscore', KEYS[1], '-inf',
+                                 '(' .. ticket)
+        for _, member in ipairs(ahead) do
+            if string.sub(member, 1, 2) == 'w:' then
+                return false
+            end
+        end
+    end
+    redis.call('zadd', KEYS[4], now + timeout, ARGV[5])
+else
+    -- writers enter one after another in the order of their tickets, when
+    -- the readers queued before them have left
+    if redis.call('zcard', KEYS[4]) > 0 then
+        return false
+    end
+    if redis.call('zrange', KEYS[1], 0, 0)[1] ~= ARGV[2] then
+        return false
+    end
+    if ARGV[4] == 'phase_fair' then
+        local phases = redis.call('hgetall', KEYS[3])
+        for i = 1, #phases, 2 do
+            if string.sub(phases[i], 1, 2) == 'r:'
+                    and tonumber(phases[i + 1]) < generation then
+                return false
+            end
+        end
+    end
+    redis.call('set', KEYS[5], ARGV[5], 'px', timeout)
+end
+redis.call('zrem', KEYS[1], ARGV[2])
+redis.call('zrem', KEYS[2], ARGV[2])
+redis.call('hdel', KEYS[3], ARGV[2])
+return token
+"""
+
+# KEYS: queue, waiters, phases, r, w
+# ARGV: member
+# Removes a waiter that gave up from the queue.
+_FAIR_LEAVE = """
+redis.call('zrem', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+redis.call('hdel', KEYS[3], ARGV[1])
+redis.call('publish', 'notify__' .. KEYS[4], 'released')
+redis.call('publish', 'notify__' .. KEYS[5], 'released')
+return 0
+"""
+
+# KEYS: readers, w
+# ARGV: client id
+# Returns 0 if the registration of the reader had expired, 1 otherwise.
+_FAIR_READER_EXIT = _NOW + """
+local removed = redis.call('zrem', KEYS[1], ARGV[1])
+redis.call('zremrangebyscore', KEYS[1], '-inf', now)
+if redis.call('zcard', KEYS[1]) == 0 then
+    redis.call('publish', 'notify__' .. KEYS[2], 'released')
+end
+return removed
+"""
+
+# KEYS: r, w, generation, epoch
+# ARGV: identifier of w, new epoch
+# Returns 1 if w was lost, 0 otherwise.
+_FAIR_WRITER_EXIT = _GENERATION + """
+local lost = 0
+generation_token(KEYS[3], KEYS[4], ARGV[2])
+redis.call('incr', KEYS[3])
+if redis.call('get', KEYS[2]) == ARGV[1] then
+    redis.call('del', KEYS[2])
+else
+    lost = 1
+end
+redis.call('publish', 'notify__' .. KEYS[1], 'released')
+redis.call('publish', 'notify__' .. KEYS[2], 'released')
+return lost
+"""
+
+# script executions are reported as round-trips (cf. instrumentation)
+_reader_enter = timed_script(redis_conn.register_script(_READER_ENTER),
+                             'reader_enter')
+_reader_exit = timed_script(redis_conn.register_script(_READER_EXIT),
+                            'reader_exit')
+_writer_enter = timed_script(redis_conn.register_script(_WRITER_ENTER),
+                             'writer_enter')
+_writer_acquire = timed_script(redis_conn.register_script(_WRITER_ACQUIRE),
+                               'writer_acquire')
+_writer_exit = timed_script(redis_conn.register_script(_WRITER_EXIT),
+                            'writer_exit')
+_renew = timed_script(redis_conn.register_script(_RENEW), 'renew')
+_fair_enter = timed_script(redis_conn.register_script(_FAIR_ENTER),
+                           'fair_enter')
+_fair_leave = timed_script(redis_conn.register_script(_FAIR_LEAVE),
+                           'fair_leave')
+_fair_reader_exit = timed_script(
+    redis_conn.register_script(_FAIR_READER_EXIT), 'reader_exit')
+_fair_writer_exit = timed_script(
+    redis_conn.register_script(_FAIR_WRITER_EXIT), 'writer_exit')
+
+# state of the current thread: locks owned by the thread (cf. session())
+# and write generations of the files the thread is reading from
+# (cf. current_generation())
+_local = threading.local()
+
+
+def _thread_state():
+    """
+    Returns the state of the current thread. Note that a forked child process
+    inherits the thread-local state of the thread that forked, but not the
+    locks, so the state is reset.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.owned = {}        # file name => [mode, depth]
+        _local.generations = {}  # file name => write generation
+    return _local
+
+
+def current_generation(filename):
+    """
+    Returns the write generation of file ``filename`` as seen by the
+    current thread when it entered its reading section, or None if the
+    thread is not reading from ``filename``. Cf. LockBackend.generation().
+    """
+    return _thread_state().generations.get(filename)
+
+
 def reader(f):
     """
     Decorates methods reading an HDF5 file.
@@ -70,60 +547,8 @@ def reader(f):
         """
         Wraps reading functions.
         """
-        # names of locks
-        mutex3 = 'mutex3__{}'.format(self.file)
-        mutex1 = 'mutex1__{}'.format(self.file)
-        readcount = 'readcount__{}'.format(self.file)
-        r = 'r__{}'.format(self.file)
-        w = 'w__{}'.format(self.file)
-
-        with handle_exit(append=APPEND_SIGHANDLER):
-            # Note that try/finally must cover incrementing readcount as well
-            # as acquiring w. Otherwise readcount/w cannot be
-            # decremented/released if program execution ends, e.g., while
-            # performing reading operation (because of a SIGTERM signal, for
-            # example).
-            readcount_val = None
-            try:
-                with redis_lock(redis_conn, mutex3):
-                    with redis_lock(redis_conn, r):
-                        # mutex1's purpose is to make readcount++ together with
-                        # the readcount == 1 check atomic
-                        with redis_lock(redis_conn, mutex1):
-                            readcount_val = redis_conn.incr(readcount, amount=1)
-
-                            # testing if locks/counters are cleaned up in case
-                            # of abrupt process termination
-                            # print("killing myself in 5 seconds...")
-                            # time.sleep(5)
-                            # os.kill(os.getpid(), signal.SIGTERM)
-
-                            # first reader sets the w lock to block writers
-                            if readcount_val == 1:
-                                if not acquire_lock(redis_conn, w, WRITELOCK_ID):
-                                    raise LockException("could not acquire write lock "
-                                                        " {0}".format(w))
-                result = f(self, *args, **kwargs)  # critical section
-                return result
-            finally:
-                # if readcount was incremented above, we have to decrement it.
-                # Also, if we are the last reader, we have to release w to open
-                # the gate for writers.
-                if readcount_val is not None:
-                    # again, mutex1's purpose is to make readcount-- and the
-                    # subsequent check atomic.
-                    with redis_lock(redis_conn, mutex1):
-                        readcount_val = redis_conn.decr(readcount, amount=1)
-                        if readcount_val == 0:
-                            if not release_lock(redis_conn, w, WRITELOCK_ID):
-                                # Note that it's possible that, even though
-                                # readcount was > 0, w was not set. This can
-                                # happen if – during execution of the code
-                                # above – a process terminated after
-                                # readcount++ but before acquiring w.
-                                # TODO what should we do? print a notification?
-                                print("Warning: {0} was lost or was not "
-                                      "acquired in the first place".format(w))
+        with session(self.file, 'r'):
+            return f(self, *args, **kwargs)  # critical section
 
     return func_wrapper
 
@@ -138,51 +563,668 @@ def writer(f):
         """
         Wraps writing functions.
         """
-        # names of locks
-        mutex2 = 'mutex2__{}'.format(self.file)
-        # note that writecount may be > 1 as it also counts the waiting writers
-        writecount = 'writecount__{}'.format(self.file)
-        r = 'r__{}'.format(self.file)
-        w = 'w__{}'.format(self.file)
-
-        with handle_exit(append=APPEND_SIGHANDLER):
-            writecount_val = None
+        with session(self.file, 'w'):
+            # perform writing operation
+            return f(self, *args, **kwargs)
+
+    return func_wrapper
+
+
+def swmr_writer(f):
+    """
+    Decorates methods modifying existing datasets (without changing the
+    structure of an HDF5 file). If HDF5's native SWMR mode is enabled for the
+    file (cf. enable_swmr()), such writers are only serialized among
+    themselves (and with structural writers) but do not block readers.
+    Otherwise, this is the same as @writer.
+    """
+
+    @wraps(f)
+    def func_wrapper(self, *args, **kwargs):
+        """
+        Wraps SWMR writing functions.
+        """
+        if not swmr_enabled(self.file):
+            with session(self.file, 'w'):
+                return f(self, *args, **kwargs)
+
+        owned = _thread_state().owned
+        entry = owned.get(self.file)
+        if entry is not None:
+            if entry[0] == 'r':
+                raise LockException("cannot write to {0} while holding a "
+                                    "read lock".format(self.file))
+            # current thread holds the write lock or is a SWMR writer
+            entry[1] += 1
+            try:
+                with object_session(self.file, self.path, 'w'):
+                    return f(self, *args, **kwargs)
+            finally:
+                entry[1] -= 1
+
+        with lock_backend.mutex(_swmr_mutex(self.file)):
+            owned[self.file] = ['s', 1]
             try:
-                # mutex2's purpose is to make writecount++ together with
-                # the writecount == 1 check atomic
-                with redis_lock(redis_conn, mutex2):
-                    writecount_val = redis_conn.incr(writecount, amount=1)
-                    # first writer sets r to block readers
-                    if writecount_val == 1:
-                        if not acquire_lock(redis_conn, r, READLOCK_ID):
-                            raise LockException("could not acquire read lock {0}"
-                                                .format(r))
-
-                with redis_lock(redis_conn, w):
-                    # perform writing operation
-                    return_val = f(self, *args, **kwargs)
-                    return return_val
+                with object_session(self.file, self.path, 'w'):
+                    return f(self, *args, **kwargs)
             finally:
-                # if writecount was incremented above, we have to decrement it.
-                # Also, if we are the last writer, we have to release r to open
-                # the gate for readers.
-                if writecount_val is not None:
-                    with redis_lock(redis_conn, mutex2):
-                        writecount_val = redis_conn.decr(writecount, amount=1)
-                        if writecount_val == 0:
-                            if not release_lock(redis_conn, r, READLOCK_ID):
-                                # Note that it's possible that, even though
-                                # writecount was > 0, r was not set. This can
-                                # happen if – during execution of the code
-                                # above – a process terminated after
-                                # writecount++ but before acquiring w.
-                                # TODO what should we do? print a notification?
-                                print("Warning: {0} was lost or was not "
-                                      "acquired in the first place".format(r))
+                del owned[self.file]
 
     return func_wrapper
 
 
+def dataset_reader(f):
+    """
+    Decorates methods reading a dataset (whose path is ``self.path``). Same
+    as @reader, but if object locks are enabled for the file (cf.
+    enable_object_locks()), the dataset is read locked as well.
+    """
+
+    @wraps(f)
+    def func_wrapper(self, *args, **kwargs):
+        """
+        Wraps dataset reading functions.
+        """
+        with session(self.file, 'r'):
+            with object_session(self.file, self.path, 'r'):
+                return f(self, *args, **kwargs)
+
+    return func_wrapper
+
+
+# files accessed using HDF5's native SWMR mode, cf. enable_swmr()
+_swmr_files = set()
+
+
+def enable_swmr(filename):
+    """
+    Enables HDF5's native single-writer/multiple-reader (SWMR) mode for
+    file ``filename`` (in the current process). With SWMR mode, modifications
+    of existing datasets (methods decorated by @swmr_writer, e.g., writing to
+    or resizing a dataset) do not block readers. Structural changes (methods
+    decorated by @writer, e.g., creating groups or datasets) still do.
+    Note that all processes accessing the file must enable SWMR mode.
+    The file must have been created with libver='latest'.
+    """
+    _swmr_files.add(filename)
+
+
+def swmr_enabled(filename):
+    """
+    Returns True if SWMR mode is enabled for file ``filename``, cf.
+    enable_swmr().
+    """
+    return filename in _swmr_files
+
+
+def swmr_writing(filename):
+    """
+    Returns True if the current thread is a SWMR writer of file ``filename``
+    (i.e., in a method decorated by @swmr_writer with SWMR mode enabled).
+    """
+    return session_mode(filename) == 's'
+
+
+def _swmr_mutex(filename):
+    """
+    Returns the name of the lock serializing writers of files in SWMR mode.
+    """
+    return 'swmrwriter__{}'.format(filename)
+
+
+# files with object (dataset-level) locks, cf. enable_object_locks()
+_object_lock_files = set()
+
+
+def enable_object_locks(filename):
+    """
+    Enables hierarchical locking of file ``filename`` (in the current
+    process), which must be in SWMR mode (cf. enable_swmr()): in addition
+    to the locks of the file, every dataset has a readers/writer lock.
+    SWMR writers (cf. swmr_writer()) write lock the dataset they modify,
+    and readers of datasets (cf. dataset_reader(), object_session()) read
+    lock it. Hence, readers of a dataset do not see partial writes (or
+    resizes) of that dataset, while readers of other datasets are not
+    blocked. Structural writers still lock the whole file. Note that all
+    processes accessing the file must enable object locks.
+
+    Without SWMR mode, HDF5 does not allow reading a file while another
+    process writes to it, i.e., writers must lock the whole file.
+
+    Raises:
+        ValueError if SWMR mode is not enabled for the file
+    """
+    if not swmr_enabled(filename):
+        raise ValueError("object locks require SWMR mode ({0})"
+                         .format(filename))
+    _object_lock_files.add(filename)
+
+
+def object_locks_enabled(filename):
+    """
+    Returns True if object locks are enabled for file ``filename``, cf.
+    enable_object_locks().
+    """
+    return filename in _object_lock_files
+
+
+def object_lockname(filename, path):
+    """
+    Returns the resource name of the readers/writer lock of the object at
+    ``path`` in file ``filename`` (cf. enable_object_locks()).
+    """
+    return '{0}::{1}'.format(filename, path)
+
+
+@contextlib.contextmanager
+def object_session(filename, path, mode):
+    """
+    Holds the read (``mode='r'``) or write (``mode='w'``) lock of object
+    ``path`` if object locks are enabled for the file and the current thread
+    does not hold the write lock of the whole file. Threads holding several
+    object locks must acquire them in the order of their paths (to avoid
+    deadlocks).
+    """
+    if not object_locks_enabled(filename) or session_mode(filename) == 'w':
+        yield
+        return
+    with session(object_lockname(filename, path), mode):
+        yield
+
+
+@contextlib.contextmanager
+def _no_lock():
+    yield
+
+
+@contextlib.contextmanager
+def read_lock(filename):
+    """
+    Context manager executing the entry and exit section of a reader
+    (cf. lock_backend). The lock is registered with the cleanup registry,
+    i.e., it is released even if the process terminates (cf. exithandler).
+
+    Args:
+        filename: file name of the HDF5 file (or any other resource name)
+    """
+    backend = lock_backend
+    start = time.perf_counter() if instrumentation.hooks else None
+    token, generation = backend.acquire_read(filename)
+    if start is not None:
+        start = _report_acquire(filename, 'read', start)
+    with cleanup(partial(backend.release_read, filename, token),
+                 append=APPEND_SIGHANDLER):
+        _thread_state().generations[filename] = generation
+        try:
+            yield  # critical section
+        finally:
+            _thread_state().generations.pop(filename, None)
+            if start is not None:
+                _report_hold(filename, 'read', start)
+
+
+@contextlib.contextmanager
+def write_lock(filename):
+    """
+    Context manager executing the entry and exit section of a writer
+    (cf. lock_backend), cf. read_lock().
+
+    Args:
+        filename: file name of the HDF5 file (or any other resource name)
+    """
+    backend = lock_backend
+    start = time.perf_counter() if instrumentation.hooks else None
+    token = backend.acquire_write(filename)
+    if start is not None:
+        start = _report_acquire(filename, 'write', start)
+    with cleanup(partial(backend.release_write, filename, token),
+                 append=APPEND_SIGHANDLER):
+        try:
+            yield  # critical section
+        finally:
+            if start is not None:
+                _report_hold(filename, 'write', start)
+
+
+def _report_acquire(filename, lock, start):
+    """
+    Reports the acquisition of a lock (cf. instrumentation) and returns the
+    start of the critical section.
+    """
+    now = time.perf_counter()
+    instrumentation.emit('acquire', filename, lock, now - start)
+    return now
+
+
+def _report_hold(filename, lock, start):
+    instrumentation.emit('hold', filename, lock, time.perf_counter() - start)
+
+
+class LockBackend(object):
+    """
+    Interface of lock backends, i.e., implementations of the readers/writer
+    protocol (with writer preference, except for FairRedisBackend) used by
+    read_lock() and write_lock().
+    The backend in use is lock_backend. Note that all processes accessing
+    a file must use the same backend.
+
+    Backends must release the locks of processes that terminate without
+    releasing them (at the latest when a lock times out).
+    """
+
+    def acquire_read(self, filename, acq_timeout=ACQ_TIMEOUT):
+        """
+        Entry section of a reader.
+
+        Returns:
+            (token, generation) tuple, where token is passed on to
+            release_read() and generation is the write generation of the file
+            (cf. current_generation())
+
+        Raises:
+            LockException if the lock could not be acquired within
+            ``acq_timeout`` seconds
+        """
+        raise NotImplementedError
+
+    def release_read(self, filename, token):
+        """
+        Exit section of a reader.
+        """
+        raise NotImplementedError
+
+    def acquire_write(self, filename, acq_timeout=ACQ_TIMEOUT):
+        """
+        Entry section of a writer.
+
+        Returns:
+            a token, which is passed on to release_write()
+
+        Raises:
+            LockException if the lock could not be acquired within
+            ``acq_timeout`` seconds
+        """
+        raise NotImplementedError
+
+    def release_write(self, filename, token):
+        """
+        Exit section of a writer. Increments the write generation of the
+        file.
+
+        Raises:
+            LockException if the lock was lost
+        """
+        raise NotImplementedError
+
+    def mutex(self, lockname, acq_timeout=DEFAULT_TIMEOUT):
+        """
+        Returns a context manager for mutual exclusion of processes (and
+        threads) entering it with the same ``lockname``.
+        """
+        raise NotImplementedError
+
+    def generation(self, filename):
+        """
+        Returns the current write generation of the file without acquiring
+        a lock. Note that a writer may be active, i.e., the file may be
+        modified before the generation is incremented.
+
+        Generations are opaque values, which may only be compared for
+        equality with generations of the same file (cf.
+        current_generation()). None never equals the generation returned
+        by acquire_read().
+        """
+        raise NotImplementedError
+
+
+class RedisBackend(LockBackend):
+    """
+    Readers/writer protocol implemented by the Lua scripts above. Locks
+    are renewed while they are held (cf. RENEW_LEASES).
+    """
+
+    def acquire_read(self, filename, acq_timeout=ACQ_TIMEOUT):
+        # names of locks
+        readers = 'readers__{}'.format(filename)
+        r = 'r__{}'.format(filename)
+        w = 'w__{}'.format(filename)
+        generation = 'generation__{}'.format(filename)
+        writers = 'writers__{}'.format(filename)
+        epoch = 'epoch__{}'.format(filename)
+        client_id = _client_id()
+        reaped = [time.time()]
+
+        # scripts are called with the current connection object
+        # because redis_conn may have been replaced at run time
+        def enter():
+            # registrations of crashed writers (of this host) would block
+            # us until they expire
+            if time.time() - reaped[0] > REAP_INTERVAL:
+                reaped[0] = time.time()
+                reap_writers(filename)
+            return _reader_enter(keys=[r, w, readers, generation, writers,
+                                       epoch],
+                                 args=[_lock_timeout_ms(), WRITELOCK_ID,
+                                       client_id, _new_epoch()],
+                                 client=redis_conn)
+
+        # a writer may be active or waiting, in which case r or w
+        # is set
+        generation_val = wait_for(redis_conn, enter, [r, w], acq_timeout)
+        if generation_val is None:
+            raise LockException("could not acquire lock {0} "
+                                "or {1}".format(r, w))
+        leases = [add_lease(redis_conn, w, WRITELOCK_ID),
+                  add_lease(redis_conn, readers, client_id)]
+        return (client_id, leases), generation_val
+
+    def release_read(self, filename, token):
+        client_id, leases = token
+        for lease in leases:
+            remove_lease(lease)
+        readers = 'readers__{}'.format(filename)
+        w = 'w__{}'.format(filename)
+        # if we are the last reader, we have to release w to open
+        # the gate for writers.
+        if not _reader_exit(keys=[w, readers], args=[WRITELOCK_ID, client_id],
+                            client=redis_conn):
+            # Note that it's possible that, even though
+            # readers were registered, w was not set. This can
+            # happen if w timed out during a long read.
+            # TODO what should we do? print a notification?
+            print("Warning: {0} was lost or was not "
+                  "acquired in the first place".format(w))
+
+    def acquire_write(self, filename, acq_timeout=ACQ_TIMEOUT):
+        # names of locks
+        # note that writers also contains the waiting writers
+        writers = 'writers__{}'.format(filename)
+        r = 'r__{}'.format(filename)
+        w = 'w__{}'.format(filename)
+        readers = 'readers__{}'.format(filename)
+        # the identifier of w is also the writer's registration
+        identifier = _client_id()
+        keys = [r, w, writers, readers]
+        args = [_lock_timeout_ms(), READLOCK_ID, identifier, WRITELOCK_ID]
+        reaped = [time.time()]
+
+        def acquire():
+            # registrations of crashed readers (of this host) would block
+            # us until they expire
+            if time.time() - reaped[0] > REAP_INTERVAL:
+                reaped[0] = time.time()
+                reap_readers(filename)
+            # note that wait_for() expects None or False on failure
+            return bool(_writer_acquire(keys=keys, args=args,
+                                        client=redis_conn))
+
+        leases = []
+        try:
+            w_acquired = _writer_enter(keys=keys, args=args,
+                                       client=redis_conn)
+            # neither our registration nor r must time out while we are
+            # waiting for w
+            leases.append(add_lease(redis_conn, writers, identifier))
+            leases.append(add_lease(redis_conn, r, READLOCK_ID))
+            if w_acquired:
+                _record_wait(w, 0.)
+            # wait until readers (or another writer) have released w
+            elif not wait_for(redis_conn, acquire, [w], acq_timeout):
+                raise LockException("could not acquire lock {0}"
+                                    .format(w))
+            leases.append(add_lease(redis_conn, w, identifier))
+        except BaseException:
+            # if we have registered above, we have to unregister
+            for lease in leases:
+                remove_lease(lease)
+            if leases:
+                self._exit(filename, identifier, acquired=False)
+            raise
+        return identifier, leases
+
+    def release_write(self, filename, token):
+        identifier, leases = token
+        for lease in leases:
+            remove_lease(lease)
+        lost = self._exit(filename, identifier)
+        if lost & 2:
+            # Note that it's possible that, even though
+            # writers were registered, r was not set. This can
+            # happen if r timed out during a long write.
+            # TODO what should we do? print a notification?
+            print("Warning: {0} was lost or was not "
+                  "acquired in the first place".format('r__' + filename))
+        if lost & 1:
+            raise LockException("lock w__{0} was lost".format(filename))
+
+    def _exit(self, filename, identifier, acquired=True):
+        """
+        Removes the registration of writer ``identifier`` and releases w
+        (if ``acquired``). If we are the last writer, r is released to open
+        the gate for readers.
+        """
+        return _writer_exit(
+            keys=['r__{}'.format(filename), 'w__{}'.format(filename),
+                  'writers__{}'.format(filename),
+                  'generation__{}'.format(filename),
+                  'epoch__{}'.format(filename)],
+            args=[READLOCK_ID, identifier, '1' if acquired else '',
+                  _new_epoch()],
+            client=redis_conn)
+
+    def mutex(self, lockname, acq_timeout=DEFAULT_TIMEOUT):
+        return redis_lock(redis_conn, lockname, acq_timeout, _lock_timeout())
+
+    def generation(self, filename):
+        counter, epoch = redis_conn.mget('generation__{}'.format(filename),
+                                         'epoch__{}'.format(filename))
+        if counter is None or epoch is None:
+            # the next reader or writer starts a new epoch
+            return None
+        return '{0}:{1}'.format(epoch, counter)
+
+
+class FairRedisBackend(RedisBackend):
+    """
+    Readers/writer protocol without writer preference: readers and writers
+    wait in a queue (a redis sorted set of tickets, cf. _FAIR_ENTER), which
+    bounds the waiting times of both. A steady stream of writers no longer
+    starves readers, and waiters do not race for locks.
+
+    Policies:
+    'fifo': readers and writers enter in the order of their arrival, i.e.,
+        a reader waits for the writers that arrived before it (consecutive
+        readers share the lock).
+    'phase_fair': phases of readers and writers alternate. Readers arriving
+        while a writer is active or waiting wait for it, but when a writer
+        leaves, all readers waiting at that time enter before the next
+        writer. Hence, a reader waits for at most one writer.
+
+    Example:
+        from h5pyswmr import locking
+        locking.lock_backend = locking.FairRedisBackend('phase_fair')
+    """
+
+    POLICIES = ('fifo', 'phase_fair')
+
+    def __init__(self, policy='phase_fair'):
+        if policy not in self.POLICIES:
+            raise ValueError("invalid fairness policy {0!r}".format(policy))
+        self.policy = policy
+
+    def acquire_read(self, filename, acq_timeout=ACQ_TIMEOUT):
+        client_id = _client_id()
+        generation = self._enter(filename, 'r', client_id, acq_timeout)
+        lease = add_lease(redis_conn, 'readers__{}'.format(filename),
+                          client_id)
+        return (client_id, [lease]), generation
+
+    def release_read(self, filename, token):
+        client_id, leases = token
+        for lease in leases:
+            remove_lease(lease)
+        if not _fair_reader_exit(keys=['readers__{}'.format(filename),
+                                       'w__{}'.format(filename)],
+                                 args=[client_id], client=redis_conn):
+            print("Warning: registration {0} of reader of {1} has "
+                  "expired".format(client_id, filename))
+
+    def acquire_write(self, filename, acq_timeout=ACQ_TIMEOUT):
+        identifier = 'pid{0}_{1}'.format(os.getpid(), str(uuid.uuid4()))
+        self._enter(filename, 'w', identifier, acq_timeout)
+        lease = add_lease(redis_conn, 'w__{}'.format(filename), identifier)
+        return identifier, [lease]
+
+    def release_write(self, filename, token):
+        identifier, leases = token
+        for lease in leases:
+            remove_lease(lease)
+        if _fair_writer_exit(keys=['r__{}'.format(filename),
+                                   'w__{}'.format(filename),
+                                   'generation__{}'.format(filename),
+                                   'epoch__{}'.format(filename)],
+                             args=[identifier, _new_epoch()],
+                             client=redis_conn):
+            raise LockException("lock w__{0} was lost".format(filename))
+
+    def _enter(self, filename, kind, value, acq_timeout):
+        """
+        Queues a reader (``kind='r'``) or writer (``kind='w'``) and waits
+        until it has entered. Returns the write generation of the file.
+        """
+        keys = ['queue__{}'.format(filename), 'waiters__{}'.format(filename),
+                'phases__{}'.format(filename),
+                'readers__{}'.format(filename), 'w__{}'.format(filename),
+                'ticket__{}'.format(filename),
+                'generation__{}'.format(filename),
+                'epoch__{}'.format(filename)]
+        member = '{0}:{1}'.format(kind, value)
+        # waits are accounted for under lock r (readers) or w (writers)
+        lockname = '{0}__{1}'.format(kind, filename)
+        reaped = [time.time()]
+
+        def enter():
+            if kind == 'w' and time.time() - reaped[0] > REAP_INTERVAL:
+                reaped[0] = time.time()
+                reap_readers(filename)
+            return _fair_enter(keys=keys,
+                               args=[_lock_timeout_ms(), member, kind,
+                                     self.policy, value, _new_epoch()],
+                               client=redis_conn)
+
+        # the registration in the queue must not expire while we are waiting
+        lease = add_lease(redis_conn, keys[1], member)
+        try:
+            generation = wait_for(redis_conn, enter, [lockname], acq_timeout)
+            if generation is None:
+                raise LockException("could not acquire lock {0}"
+                                    .format(lockname))
+        except BaseException:
+            _fair_leave(keys=keys[:3] + ['r__{}'.format(filename), keys[4]],
+                        args=[member], client=redis_conn)
+            raise
+        finally:
+            remove_lease(lease)
+        return generation
+
+
+# backend implementing read_lock() and write_lock(). Replace it, e.g., by
+# fcntlbackend.FcntlBackend() on single-node deployments.
+lock_backend = RedisBackend()
+
+
+@contextlib.contextmanager
+def session(filename, mode):
+    """
+    Reentrant lock: context manager holding a read (``mode='r'``) or write
+    (``mode='w'``) lock for the whole with block. The lock is owned by the
+    current thread (of the current process). Nested sessions of the owner,
+    e.g., synchronized methods (@reader, @writer) called from within the
+    block, do not acquire the lock again. Instead, they increment a local
+    counter.
+    A read lock cannot be upgraded, i.e., a write session within a read
+    session raises a LockException (it would deadlock otherwise). The same
+    holds for a write session within a SWMR writer (cf. swmr_writer()).
+
+    Args:
+        filename: file name of the HDF5 file
+        mode: 'r' or 'w'
+    """
+    if mode not in ('r', 'w'):
+        raise ValueError("invalid session mode {0!r}".format(mode))
+    owned = _thread_state().owned
+    entry = owned.get(filename)
+    if entry is not None:
+        if entry[0] != 'w' and mode == 'w':
+            raise LockException("cannot write to {0} while holding a {1} "
+                                "lock".format(filename,
+                                              _MODE_NAMES[entry[0]]))
+        entry[1] += 1
+        try:
+            yield
+        finally:
+            entry[1] -= 1
+        return
+
+    if mode == 'r':
+        mutex = _no_lock()
+        lock = read_lock(filename)
+    else:
+        # in SWMR mode, structural writers must exclude SWMR writers as well
+        mutex = (lock_backend.mutex(_swmr_mutex(filename))
+                 if swmr_enabled(filename) else _no_lock())
+        lock = write_lock(filename)
+    with mutex:
+        with lock:
+            owned[filename] = [mode, 1]
+            try:
+                yield
+            finally:
+                del owned[filename]
+
+
+_MODE_NAMES = {'r': 'read', 'w': 'write', 's': 'SWMR write'}
+
+
+@contextlib.contextmanager
+def adopted_session(filename, mode, generation=None):
+    """
+    Context manager registering a lock on ``filename`` that has been
+    acquired elsewhere, e.g., by an asyncio task (cf. aio.py), as owned by
+    the current thread. Synchronized methods called within the block do not
+    acquire the lock again (cf. session()). The lock is not released at the
+    end of the block.
+
+    Args:
+        filename: file name of the HDF5 file
+        mode: 'r' or 'w'
+        generation: write generation of the file (readers only, cf.
+            current_generation())
+    """
+    state = _thread_state()
+    if filename in state.owned:
+        raise LockException("{0} is locked by the current thread already"
+                            .format(filename))
+    state.owned[filename] = [mode, 1]
+    if generation is not None:
+        state.generations[filename] = generation
+    try:
+        yield
+    finally:
+        del state.owned[filename]
+        state.generations.pop(filename, None)
+
+
+def session_mode(filename):
+    """
+    Returns the mode of the lock the current thread holds on ``filename``
+    ('r', 'w', or 's' for SWMR writers, cf. swmr_writer()), or None if it
+    does not hold a lock.
+    """
+    entry = _thread_state().owned.get(filename)
+    return entry[0] if entry is not None else None
+
+
 def acquire_lock(conn, lockname, identifier, acq_timeout=ACQ_TIMEOUT,
                  timeout=DEFAULT_TIMEOUT):
     """
@@ -203,19 +1245,81 @@ def acquire_lock(conn, lockname, identifier, acq_timeout=ACQ_TIMEOUT,
     Returns:
         ``identifier`` on success or False on failure
     """
-    end = time.time() + acq_timeout
-    while end > time.time():
-        if conn.setnx(lockname, identifier):
-            conn.expire(lockname, timeout)
-            return identifier
-        elif not conn.ttl(lockname):
-            conn.expire(lockname, timeout)
-        # could not acquire lock, go to sleep and try again later...
-        time.sleep(.001)
+    def acquire():
+        # SET NX PX sets the lock and its timeout atomically (one round-trip)
+        return conn.set(lockname, identifier, nx=True,
+                        px=int(timeout * 1000))
 
+    if wait_for(conn, acquire, [lockname], acq_timeout):
+        return identifier
     return False
 
 
+def wait_for(conn, attempt, locknames, acq_timeout=ACQ_TIMEOUT):
+    """
+    Repeatedly calls ``attempt`` until it returns a value other than None or
+    False, or until ``acq_timeout`` seconds have elapsed. Between attempts,
+    the calling process waits for any of the locks ``locknames`` to be
+    released (cf. WAIT_MODE). The time spent waiting is recorded in the wait
+    statistics (cf. get_wait_stats()) of the first lock name.
+
+    Args:
+        conn: redis connection object
+        attempt: function trying to acquire a lock
+        locknames: names of the locks the caller is waiting for
+        acq_timeout: timeout in seconds
+
+    Returns:
+        the return value of ``attempt`` on success, None on timeout
+    """
+    result = attempt()
+    if result is not None and result is not False:
+        _record_wait(locknames[0], 0.)
+        return result
+
+    start = time.time()
+    end = start + acq_timeout
+    retries = 1
+    pubsub = None
+    try:
+        if WAIT_MODE == 'pubsub':
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            # subscribe *before* the next attempt, otherwise we might miss
+            # a notification
+            pubsub.subscribe(*[notify_channel(name) for name in locknames])
+        while True:
+            result = attempt()
+            if result is not None and result is not False:
+                _record_wait(locknames[0], time.time() - start,
+                             retries=retries)
+                return result
+            retries += 1
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            if pubsub is not None:
+                pubsub.get_message(
+                    timeout=min(remaining, WAIT_POLL_INTERVAL))
+            else:
+                # could not acquire lock, go to sleep and try again later...
+                time.sleep(.001)
+    finally:
+        if pubsub is not None:
+            pubsub.close()
+
+    _record_wait(locknames[0], time.time() - start, timed_out=True,
+                 retries=retries)
+    return None
+
+
+def notify_channel(lockname):
+    """
+    Returns the name of the pub/sub channel on which the release of lock
+    ``lockname`` is announced.
+    """
+    return 'notify__{0}'.format(lockname)
+
+
 def release_lock(conn, lockname, identifier):
     """
     Signal/release a lock.
@@ -237,6 +1341,7 @@ def release_lock(conn, lockname, identifier):
             if pipe.get(lockname) == identifier:
                 pipe.multi()
                 pipe.delete(lockname)
+                pipe.publish(notify_channel(lockname), 'released')
                 pipe.execute()
                 return True
             else:
@@ -246,6 +1351,248 @@ def release_lock(conn, lockname, identifier):
             raise e
 
 
+def _client_id():
+    """
+    Returns a new client id, which identifies the registration of a reader
+    or writer (cf. reap_readers(), reap_writers()). It is composed of the
+    host identity (cf. _host_identity()), the process id and a uuid.
+    """
+    return '{0}:{1}:{2}'.format(_HOST_ID, os.getpid(), uuid.uuid4())
+
+
+def _new_epoch():
+    """
+    Returns a random id, which becomes the epoch of a write generation
+    counter if the counter has to start over (cf. _GENERATION).
+    """
+    return uuid.uuid4().hex
+
+
+def reap_readers(filename):
+    """
+    Removes the registrations of readers of file ``filename`` whose
+    processes have died (only processes running on the current host and in
+    the same pid namespace can be checked). Registrations of other readers
+    that have crashed expire after the lock timeout. Writers waiting for
+    readers call this function every REAP_INTERVAL seconds.
+
+    Returns:
+        number of removed registrations
+    """
+    return _reap('readers__{}'.format(filename))
+
+
+def reap_writers(filename):
+    """
+    Removes the registrations of (active or waiting) writers of file
+    ``filename`` whose processes have died, cf. reap_readers(). Readers
+    waiting for writers call this function every REAP_INTERVAL seconds.
+
+    Returns:
+        number of removed registrations
+    """
+    return _reap('writers__{}'.format(filename))
+
+
+def _reap(key):
+    """
+    Removes the registrations of dead processes from sorted set ``key``.
+    Only registrations with the identity of the current host (and pid
+    namespace) are checked, cf. _host_identity().
+    """
+    dead = []
+    for client_id in redis_conn.zrange(key, 0, -1):
+        try:
+            host_id, pid, _ = client_id.rsplit(':', 2)
+            pid = int(pid)
+        except ValueError:
+            continue
+        if host_id == _HOST_ID and not _pid_alive(pid):
+            dead.append(client_id)
+    if dead:
+        redis_conn.zrem(key, *dead)
+    return len(dead)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _lock_timeout():
+    """
+    Returns the timeout of locks in seconds, cf. RENEW_LEASES.
+    """
+    return LEASE_TIMEOUT if RENEW_LEASES else DEFAULT_TIMEOUT
+
+
+def _lock_timeout_ms():
+    return int(_lock_timeout() * 1000)
+
+
+# leases of the current process, cf. add_lease()
+_leases = {}            # lease => (connection, lock name, value, timeout)
+_leases_lock = threading.Lock()
+_leases_pid = None      # process the leases (and the lease keeper) belong to
+_keeper_lock = threading.Lock()
+
+
+def add_lease(conn, lockname, value, timeout=None):
+    """
+    Registers a lock held by the current process with the lease keeper, which
+    extends its timeout as long as the lease exists (if RENEW_LEASES is
+    True). The lock's timeout is only extended if it still has the given
+    value.
+
+    Args:
+        conn: redis connection object
+        lockname: name of the lock
+        value: value (identifier) of the lock
+        timeout: timeout of the lock in seconds (LEASE_TIMEOUT by default)
+
+    Returns:
+        lease, which must be passed on to remove_lease() before the lock is
+        released, or None if RENEW_LEASES is False
+    """
+    global _leases, _leases_lock, _leases_pid
+    if not RENEW_LEASES:
+        return None
+    if _leases_pid != os.getpid():
+        with _keeper_lock:
+            if _leases_pid != os.getpid():
+                # a forked child process does not hold the locks of its
+                # parent, and the lease keeper thread does not survive
+                # forking
+                _leases = {}
+                _leases_lock = threading.Lock()
+                _leases_pid = os.getpid()
+                keeper = threading.Thread(target=_keep_leases,
+                                          name='h5pyswmr-leases',
+                                          args=(_leases_pid, ))
+                keeper.daemon = True
+                keeper.start()
+    lease = _Lease()
+    with _leases_lock:
+        _leases[lease] = (conn, lockname, value,
+                          LEASE_TIMEOUT if timeout is None else timeout)
+    return lease
+
+
+class _Lease(object):
+    """
+    Handle of a lease, cf. add_lease()
+    """
+    pass
+
+
+def remove_lease(lease):
+    """
+    Removes a lease created by add_lease(), i.e., the lock's timeout is no
+    longer extended.
+    """
+    if lease is not None:
+        with _leases_lock:
+            _leases.pop(lease, None)
+
+
+def _keep_leases(pid):
+    """
+    Lease keeper: renews all leases of the current process every
+    LEASE_TIMEOUT / 3 seconds (a single round-trip per redis connection).
+    If a renewal fails, a warning is issued (once per lease) because the
+    lock may time out.
+    """
+    warned = weakref.WeakSet()
+    while _leases_pid == pid:
+        time.sleep(LEASE_TIMEOUT / 3.)
+        with _leases_lock:
+            leases = list(_leases.items())
+        by_conn = {}
+        for lease, (conn, lockname, value, timeout) in leases:
+            entry = by_conn.setdefault(id(conn), (conn, [], [], []))
+            entry[1].append(lockname)
+            entry[2].extend([value, int(timeout * 1000)])
+            entry[3].append(lease)
+        for conn, keys, args, conn_leases in by_conn.values():
+            try:
+                _renew(keys=keys, args=args, client=conn)
+            except Exception as e:
+                # try again in the next round (before the locks time out)
+                for lease, lockname in zip(conn_leases, keys):
+                    if lease not in warned:
+                        warned.add(lease)
+                        warnings.warn("h5pySWMR: could not renew lock {0} "
+                                      "({1!r}), the lock may time out"
+                                      .format(lockname, e), RuntimeWarning)
+
+
+# wait statistics of the current process, cf. get_wait_stats()
+_wait_stats = {}
+_wait_stats_lock = threading.Lock()
+
+
+def _record_wait(lockname, seconds, timed_out=False, retries=0):
+    """
+    Adds a wait to the wait statistics (cf. get_wait_stats()) and reports it
+    (cf. instrumentation).
+
+    Args:
+        lockname: name of the lock
+        seconds: time spent waiting
+        timed_out: True if the lock could not be acquired
+        retries: number of failed attempts to acquire the lock
+    """
+    if instrumentation.hooks:
+        filename, lock = instrumentation.split_lockname(lockname)
+        if timed_out:
+            instrumentation.emit('timeout', filename, lock, seconds)
+        else:
+            instrumentation.emit('wait', filename, lock, seconds)
+        if retries:
+            instrumentation.emit('retries', filename, lock, retries)
+    with _wait_stats_lock:
+        stats = _wait_stats.get(lockname)
+        if stats is None:
+            stats = _wait_stats[lockname] = {
+                'acquisitions': 0, 'waits': 0, 'timeouts': 0,
+                'total_wait': 0., 'max_wait': 0.}
+        if timed_out:
+            stats['timeouts'] += 1
+        else:
+            stats['acquisitions'] += 1
+        if seconds > 0:
+            stats['waits'] += 1
+            stats['total_wait'] += seconds
+            stats['max_wait'] = max(stats['max_wait'], seconds)
+
+
+def get_wait_stats():
+    """
+    Returns statistics on how long the current process waited for locks.
+
+    Returns:
+        a dict mapping lock names to dicts with the following keys:
+        'acquisitions' (number of successful acquisitions), 'waits' (number of
+        acquisitions that had to wait), 'timeouts' (number of failed
+        acquisitions), 'total_wait' and 'max_wait' (seconds). Note that
+        readers waiting to enter are accounted for under lock r.
+    """
+    with _wait_stats_lock:
+        return dict((name, dict(stats))
+                    for name, stats in _wait_stats.items())
+
+
+def reset_wait_stats():
+    """
+    Clears the wait statistics of the current process.
+    """
+    with _wait_stats_lock:
+        _wait_stats.clear()
+
+
 class LockException(Exception):
     """
     Raises when a lock could not be acquired or when a lock is lost.
@@ -268,8 +1615,8 @@ def redis_lock(conn, lockname, acq_timeout=DEFAULT_TIMEOUT,
         acq_timeout: timeout for acquiring the lock. If lock could not be
             acquired during *atime* seconds, False is returned.
         timeout: timeout of the lock in seconds. The lock is automatically
-            released after *ltime* seconds. Make sure your operation does
-            not take longer than the timeout!
+            released after *ltime* seconds. Unless RENEW_LEASES is True, make
+            sure your operation does not take longer than the timeout!
     """
 
     # generate (random) unique identifier, prefixed by current PID (allows
@@ -279,8 +1626,10 @@ def redis_lock(conn, lockname, acq_timeout=DEFAULT_TIMEOUT,
     if acquire_lock(conn, lockname, identifier, acq_timeout,
                     timeout) != identifier:
         raise LockException("could not acquire lock {0}".format(lockname))
+    lease = add_lease(conn, lockname, identifier, timeout)
     try:
         yield identifier
     finally:
+        remove_lease(lease)
         if not release_lock(conn, lockname, identifier):
             raise LockException("lock {0} was lost".format(lockname))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-process cache of metadata (node types, shapes, dtypes, group members,
+attributes, ...).
+
+Cached values are tagged with the write generation of their file (cf.
+locking.current_generation()). A cached value is returned as long as the
+file's generation has not changed, i.e., as long as no writer has modified
+the file. Looking up the current generation does not require a lock: within
+a read session it is known already, otherwise it costs a single lookup
+(cf. locking.LockBackend.generation()). Generations are qualified by an
+epoch, i.e., values cached before the generation counter started over are
+never returned.
+
+Metadata is not cached for files in SWMR mode (SWMR writers do not change
+the write generation) and for threads holding a write lock on the file.
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from . import locking
+from .locking import session, session_mode, current_generation, swmr_enabled
+
+
+# set to False to disable the cache
+ENABLED = True
+
+# maximum number of files whose metadata is cached
+MAX_FILES = 256
+
+
+_cache = OrderedDict()  # file name => (generation, {key: value}), LRU first
+_cache_lock = threading.Lock()
+
+
+def cached_metadata(f):
+    """
+    Decorates methods (of Node, AttributeManager, ...) that read metadata,
+    i.e., return a value depending on the file, the object's path and the
+    (hashable) arguments only. Note that the decorated method must be
+    synchronized itself (@reader).
+    """
+
+    @wraps(f)
+    def func_wrapper(self, *args):
+        """
+        Wraps metadata reading functions.
+        """
+        filename = self.file
+        if (not ENABLED or swmr_enabled(filename)
+                or session_mode(filename) in ('w', 's')):
+            return f(self, *args)
+
+        key = (type(self).__name__, f.__name__, self.path, args)
+        generation = current_generation(filename)
+        if generation is None:
+            generation = locking.lock_backend.generation(filename)
+        found, value = _lookup(filename, generation, key)
+        if found:
+            return _copy(value)
+
+        with session(filename, 'r'):
+            value = f(self, *args)
+            _store(filename, current_generation(filename), key, _copy(value))
+        return value
+
+    return func_wrapper
+
+
+def clear():
+    """
+    Removes all cached metadata.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def _copy(value):
+    # callers must not be able to modify cached containers
+    if isinstance(value, (list, dict, set)):
+        return type(value)(value)
+    return value
+
+
+def _lookup(filename, generation, key):
+    with _cache_lock:
+        entry = _cache.get(filename)
+        if entry is None or entry[0] != generation or key not in entry[1]:
+            return False, None
+        _cache.move_to_end(filename)
+        return True, entry[1][key]
+
+
+def _store(filename, generation, key, value):
+    with _cache_lock:
+        entry = _cache.pop(filename, None)
+        if entry is None or entry[0] != generation:
+            # file has been modified
+            entry = (generation, {})
+        entry[1][key] = value
+        _cache[filename] = entry
+        while len(_cache) > MAX_FILES:
+            _cache.popitem(last=False)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read-ahead for sequential block access (cf. Dataset.read_ahead()).
+
+If a dataset is read block by block, e.g., ``dst[0:100]``, ``dst[100:200]``,
+..., the next blocks are read in a background thread while the caller
+processes the current block, such that waiting for the lock, opening the
+file and reading overlap with the caller's computations.
+
+A read is sequential if its selection is a tuple of integers and slices
+(with step 1) whose first slice (the read axis) continues the previous
+selection, with the same length, while all other indices are the same.
+E.g., ``dst[3, 0:10, :]`` followed by ``dst[3, 10:20, :]``.
+
+Prefetched blocks are read under their own read lock and are used only if
+the file has not been modified in the meantime (cf.
+locking.current_generation()). Read-ahead is disabled while the current
+thread holds a write lock on the file and for files in SWMR mode.
+"""
+
+from __future__ import absolute_import
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import locking
+from .locking import current_generation, session_mode, swmr_enabled
+
+
+class ReadAhead(object):
+    """
+    Prefetches blocks of a Dataset, cf. module docstring.
+    """
+
+    def __init__(self, dset, depth=2, max_bytes=64 * 2**20):
+        """
+        Args:
+            dset: Dataset object
+            depth: number of blocks read in advance
+            max_bytes: maximum size of prefetched (unused) blocks in bytes
+        """
+        self.dset = dset
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._last = None
+        self._pending = OrderedDict()  # selection key => future
+        self._executor = None
+        self._pid = None
+
+    def read(self, selection):
+        """
+        Returns ``selection`` of the dataset, prefetched if possible, and
+        prefetches the next blocks if the read is sequential.
+        """
+        filename = self.dset.file
+        if swmr_enabled(filename) or session_mode(filename) in ('w', 's'):
+            self.close()
+            return self.dset._get(selection)
+
+        key = _key(selection)
+        future = self._pending.pop(key, None) if key is not None else None
+        result = None if future is None else self._result(future)
+        if result is None:
+            result = self.dset._get(selection)
+        self._schedule(selection)
+        return result
+
+    def close(self):
+        """
+        Discards prefetched blocks and stops the background thread.
+        """
+        self._discard()
+        self._last = None
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _discard(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def _result(self, future):
+        """
+        Returns the block read by ``future`` or None if it cannot be used.
+        """
+        filename = self.dset.file
+        if not future.done() and session_mode(filename) is not None:
+            # the prefetching thread may be waiting for a read lock behind a
+            # writer, which in turn waits for the current thread
+            future.cancel()
+            return None
+        try:
+            generation, block = future.result()
+        except Exception:
+            return None  # reading again raises the error in the caller
+        current = current_generation(filename)
+        if current is None:
+            current = locking.lock_backend.generation(filename)
+        if generation != current:
+            return None  # file has been modified
+        return block
+
+    def _schedule(self, selection):
+        seq = _sequential(selection)
+        last, self._last = self._last, seq
+        if (seq is None or last is None or seq[0] != last[0]
+                or seq[1] != last[2] or seq[2] - seq[1] != last[2] - last[1]):
+            self._discard()
+            return
+
+        _, start, stop, axis, selection = seq
+        shape = self.dset.shape
+        n = stop - start
+        block_bytes = (n * self.dset.dtype.itemsize
+                       * int(np.prod(shape)) // max(1, shape[axis]))
+        wanted = []
+        for k in range(self.depth):
+            begin = stop + k * n
+            if begin >= shape[axis]:
+                break
+            if (k + 1) * block_bytes > self.max_bytes:
+                break
+            sel = (selection[:axis] + (slice(begin, begin + n), )
+                   + selection[axis + 1:])
+            wanted.append((_key(sel), sel))
+
+        keys = set(key for key, _ in wanted)
+        for key in list(self._pending):
+            if key not in keys:
+                self._pending.pop(key).cancel()
+        for key, sel in wanted:
+            if key not in self._pending:
+                self._pending[key] = self._submit(sel)
+
+    def _submit(self, selection):
+        if self._executor is None or self._pid != os.getpid():
+            # a forked child does not inherit the executor's thread
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._pid = os.getpid()
+        return self._executor.submit(self.dset._read_generation, selection)
+
+
+def _key(selection):
+    """
+    Returns a hashable representation of a selection consisting of integers
+    and slices, or None.
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection, )
+    key = []
+    for index in selection:
+        if isinstance(index, slice):
+            step = None if index.step == 1 else index.step
+            key.append(('s', index.start, index.stop, step))
+        elif isinstance(index, (int, np.integer)):
+            key.append(('i', int(index)))
+        else:
+            return None
+    return tuple(key)
+
+
+def _sequential(selection):
+    """
+    Returns (pattern, start, stop, axis, selection tuple) if ``selection``
+    may be part of a sequential scan, otherwise None. The read axis is the
+    first slice of the selection, which must have step 1 and non-negative
+    start/stop. Selections of the same scan have the same pattern (the
+    selection without the read axis).
+    """
+    key = _key(selection)
+    if key is None:
+        return None
+    if not isinstance(selection, tuple):
+        selection = (selection, )
+    for axis, index in enumerate(selection):
+        if isinstance(index, slice):
+            start = 0 if index.start is None else index.start
+            if (index.step not in (None, 1) or index.stop is None
+                    or start < 0 or index.stop <= start):
+                return None
+            pattern = key[:axis] + (None, ) + key[axis + 1:]
+            return pattern, start, index.stop, axis, selection
+    return None
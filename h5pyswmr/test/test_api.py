@@ -4,10 +4,17 @@
 Unit test for .attrs wrapper.
 """
 
+import asyncio
 import unittest
 import sys
 import os
+import shutil
 import tempfile
+import multiprocessing
+import threading
+import time
+
+import numpy as np
 
 
 if __name__ == '__main__':
@@ -17,7 +24,8 @@ if __name__ == '__main__':
     PROJ_PATH = os.path.abspath(os.path.join(HERE, '../..'))
     sys.path.insert(0, PROJ_PATH)
 
-from h5pyswmr import File
+from h5pyswmr import (File, Dataset, FileModifiedError, chunkcache, handles,
+                      locking, metadata)
 
 
 class TestAPI(unittest.TestCase):
@@ -61,44 +69,67 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(['bla'], grp.attrs.keys())
             self.assertEqual(grp.attrs['bla'], 3)
 
-    # def test_visit(self):
-    #     """
-    #     Test visiting pattern
-    #     """
-    #     # create some groups and datasets
-    #     with File(self.filename, 'a') as f:
-    #         g1 = f.create_group('/a/b/g1')
-    #         f.create_group('/a/b/g2')
-    #         f.create_group('/a/b/g3')
-    #         f.create_dataset(name='a/b/g1/dst1', shape=(30, 30))
-    #         f.create_dataset(name='/a/b/g1/dst2', shape=(30, 30))
-    #         f.create_dataset(name='/a/b/g2/dst1', shape=(30, 30))
-
-    #     def foo(name):
-    #         print(name)
-
-    #     with File(self.filename, 'r') as f:
-    #         f.visit(foo)
-
-    # def test_visititems(self):
-    #     """
-    #     Test visititems() method
-    #     """
-    #     # create some groups and datasets
-    #     with File(self.filename, 'a') as f:
-    #         g1 = f.create_group('/a/b/g1')
-    #         f.create_group('/a/b/g2')
-    #         f.create_group('/a/b/g3')
-    #         f.create_dataset(name='a/b/g1/dst1', shape=(30, 30))
-    #         f.create_dataset(name='/a/b/g1/dst2', shape=(30, 30))
-    #         f.create_dataset(name='/a/b/g2/dst1', shape=(30, 30))
-
-    #     def foo(name, obj):
-    #         print(name)
-    #         print(obj)
-
-    #     with File(self.filename, 'r') as f:
-    #         f.visititems(foo)
+    def test_visit(self):
+        """
+        Test visiting pattern
+        """
+        # create some groups and datasets
+        with File(self.filename, 'a') as f:
+            g1 = f.create_group('/a/b/g1')
+            f.create_group('/a/b/g2')
+            f.create_group('/a/b/g3')
+            f.create_dataset(name='a/b/g1/dst1', shape=(30, 30))
+            f.create_dataset(name='/a/b/g1/dst2', shape=(30, 30))
+            f.create_dataset(name='/a/b/g2/dst1', shape=(30, 30))
+
+        names = []
+
+        def foo(name):
+            names.append(name)
+
+        with File(self.filename, 'r') as f:
+            f['/a'].visit(foo)
+        self.assertEqual(sorted(names),
+                         ['b', 'b/g1', 'b/g1/dst1', 'b/g1/dst2', 'b/g2',
+                          'b/g2/dst1', 'b/g3'])
+
+    def test_visititems(self):
+        """
+        Test visititems() method
+        """
+        # create some groups and datasets
+        with File(self.filename, 'a') as f:
+            g1 = f.create_group('/a/b/g1')
+            f.create_group('/a/b/g2')
+            f.create_group('/a/b/g3')
+            f.create_dataset(name='a/b/g1/dst1', shape=(30, 30))
+            f.create_dataset(name='/a/b/g1/dst2', shape=(30, 30))
+            f.create_dataset(name='/a/b/g2/dst1', shape=(30, 30))
+            g1.attrs['bla'] = 3
+
+        shapes = {}
+
+        def foo(name, obj):
+            # synchronized methods can be called (reentrant locks)
+            if isinstance(obj, Dataset):
+                shapes[name] = obj.shape
+            elif 'bla' in obj.attrs:
+                shapes[name] = obj.attrs['bla']
+
+        with File(self.filename, 'r') as f:
+            f.visititems(foo)
+        self.assertEqual(shapes, {'bla': (30, 30), 'a/b/g1': 3,
+                                  'a/b/g1/dst1': (30, 30),
+                                  'a/b/g1/dst2': (30, 30),
+                                  'a/b/g2/dst1': (30, 30)})
+
+        # writing while reading is not possible
+        def bar(name, obj):
+            obj.attrs['bla'] = 4
+
+        with File(self.filename, 'r') as f:
+            with self.assertRaises(locking.LockException):
+                f.visititems(bar)
 
     def test_items(self):
         """
@@ -129,6 +160,619 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(dset.shape, new_size)
             
 
+    def test_handle_cache(self):
+        """
+        Test that cached files are re-opened after they have been modified
+        by another process
+        """
+        def write(value):
+            with File(self.filename, 'a') as f:
+                f['/bla'][0, 0] = value
+
+        with File(self.filename, 'r') as f:
+            dst = f['/bla']
+            for value in (1, 2):
+                p = multiprocessing.Process(target=write, args=(value, ))
+                p.start()
+                p.join()
+                self.assertEqual(dst[0, 0], value)
+                if handles._LOCKING_KWARG:
+                    self.assertIn(self.filename, handles._cache)
+
+    def test_sessions(self):
+        """
+        Test read and write sessions
+        """
+        with File(self.filename, 'a') as f:
+            locking.reset_wait_stats()
+            with f.write_session() as s:
+                for i in range(5):
+                    dst = s.create_dataset(name='/s{0}'.format(i), shape=(3, ))
+                    dst.attrs['i'] = i
+            with f.read_session() as s:
+                for i in range(5):
+                    dst = s['/s{0}'.format(i)]
+                    self.assertEqual(dst.shape, (3, ))
+                    self.assertEqual(dst.attrs['i'], i)
+                with self.assertRaises(locking.LockException):
+                    dst.attrs['i'] = 0
+
+            stats = locking.get_wait_stats()
+            self.assertEqual(stats['r__{0}'.format(f.file)]['acquisitions'], 1)
+            self.assertEqual(stats['w__{0}'.format(f.file)]['acquisitions'], 1)
+
+    def test_read_many(self):
+        """
+        Test reading several datasets at once
+        """
+        a = np.arange(100, dtype=np.float64).reshape((10, 10))
+        with File(self.filename, 'a') as f:
+            f.create_dataset(name='/grp/a', data=a)
+            f.create_dataset(name='/grp/b', data=a * 2)
+
+            locking.reset_wait_stats()
+            out = np.empty((2, 10))
+            result = f['/grp'].read_many(
+                [('b', np.s_[5:7, :]), ('/grp/a', Ellipsis), ('a', 3),
+                 ('b', np.s_[1:3, :])],
+                out=[None, None, None, out])
+            np.testing.assert_array_equal(result[0], a[5:7, :] * 2)
+            np.testing.assert_array_equal(result[1], a)
+            np.testing.assert_array_equal(result[2], a[3])
+            self.assertIs(result[3], out)
+            np.testing.assert_array_equal(out, a[1:3, :] * 2)
+            # one lock for __getitem__, one for read_many()
+            stats = locking.get_wait_stats()['r__{0}'.format(f.file)]
+            self.assertEqual(stats['acquisitions'], 2)
+
+    def test_read_direct(self):
+        """
+        Test reading into caller-provided (shared memory) arrays
+        """
+        from multiprocessing import shared_memory
+        a = np.arange(100, dtype=np.float32).reshape((10, 10))
+        with File(self.filename, 'a') as f:
+            dst = f.create_dataset(name='/direct', data=a)
+            shm = shared_memory.SharedMemory(create=True, size=a.nbytes)
+            try:
+                out = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+                dst.read_direct(out)
+                np.testing.assert_array_equal(out, a)
+                out[:] = 0
+                dst.read_direct(out, np.s_[2:4, :], np.s_[5:7, :])
+                np.testing.assert_array_equal(out[5:7], a[2:4])
+                self.assertEqual(out[:5].sum(), 0)
+                del out
+            finally:
+                shm.close()
+                shm.unlink()
+
+            out = np.empty((3, ), dtype=np.float32)
+            self.assertIs(dst.read(np.s_[4, 1:4], out=out), out)
+            np.testing.assert_array_equal(out, a[4, 1:4])
+            np.testing.assert_array_equal(dst.read(), a)
+
+    def test_iter_blocks(self):
+        """
+        Test reading datasets block by block
+        """
+        a = np.arange(230, dtype=np.int64).reshape((23, 10))
+        with File(self.filename, 'a') as f:
+            dst = f.create_dataset(name='/blocks', data=a, chunks=(4, 5))
+            blocks = list(dst.iter_blocks(10))
+            self.assertEqual([sel for sel, _ in blocks],
+                             [(np.s_[0:10], ), (np.s_[10:20], ),
+                              (np.s_[20:23], )])
+            np.testing.assert_array_equal(
+                np.concatenate([block for _, block in blocks]), a)
+            blocks = list(dst.iter_chunks(axis=1))
+            self.assertEqual([block.shape for _, block in blocks],
+                             [(23, 5), (23, 5)])
+            self.assertEqual([sel for sel, _ in dst.iter_chunks(rows=6)],
+                             [(np.s_[0:8], ), (np.s_[8:16], ),
+                              (np.s_[16:23], )])
+
+            # no lock is held between blocks, writers are detected
+            for on_change in (None, 'raise', 'restart'):
+                dst[:] = a
+                it = dst.iter_blocks(10, on_change=on_change)
+                next(it)
+                dst[15, 0] = -1
+                if on_change == 'raise':
+                    self.assertRaises(FileModifiedError, list, it)
+                elif on_change == 'restart':
+                    sels = [sel for sel, _ in it]
+                    self.assertEqual(sels[0], (np.s_[0:10], ))
+                    self.assertEqual(len(sels), 3)
+                else:
+                    self.assertEqual(len(list(it)), 2)
+
+    def test_read_ahead(self):
+        """
+        Test prefetching of sequential reads
+        """
+        a = np.arange(1000, dtype=np.float64).reshape((100, 10))
+        with File(self.filename, 'a') as f:
+            f.create_dataset(name='/seq', data=a)
+            dst = f['/seq'].read_ahead(depth=2)
+            np.testing.assert_array_equal(dst[0:10], a[0:10])
+            self.assertEqual(len(dst._readahead._pending), 0)
+            np.testing.assert_array_equal(dst[10:20], a[10:20])
+            self.assertEqual(len(dst._readahead._pending), 2)
+            for i in range(20, 100, 10):
+                future = dst._readahead._pending.get(
+                    ((('s', i, i + 10, None), )))
+                self.assertIsNotNone(future)
+                future.result()
+                np.testing.assert_array_equal(dst[i:i + 10], a[i:i + 10])
+            self.assertEqual(len(dst._readahead._pending), 0)
+
+            # prefetched blocks are discarded if the file is modified
+            dst[0:10, 0], dst[10:20, 0]
+            self.assertEqual(len(dst._readahead._pending), 2)
+            f['/seq'][25, 0] = a[25, 0] = -1
+            np.testing.assert_array_equal(dst[20:30, 0], a[20:30, 0])
+
+            # non-sequential reads
+            np.testing.assert_array_equal(dst[[1, 5]], a[[1, 5]])
+            np.testing.assert_array_equal(dst[50:60, 0:5], a[50:60, 0:5])
+            self.assertEqual(len(dst._readahead._pending), 0)
+            dst.read_ahead(depth=0)
+            self.assertIsNone(dst._readahead)
+
+    def test_aio(self):
+        """
+        Test asyncio API
+        """
+        from h5pyswmr import aio
+        a = np.arange(100, dtype=np.float64).reshape((10, 10))
+
+        async def main():
+            async with aio.AsyncFile(self.filename, 'a') as f:
+                dst = await f.create_dataset(name='/aio/a', data=a,
+                                             maxshape=(None, 10))
+                await dst.attrs.set('units', 'm')
+                grp = await f.get('aio')
+                self.assertEqual(await grp.keys(), ['a'])
+                self.assertTrue(await f.contains('/aio/a'))
+                self.assertEqual(await dst.shape(), (10, 10))
+                self.assertEqual(await dst.attrs.get('units'), 'm')
+
+                # a writer waits for concurrent readers (without blocking
+                # the event loop)
+                async def read_slowly():
+                    async with f.read_session():
+                        data = await dst.read(np.s_[2:4])
+                        await asyncio.sleep(0.3)
+                        return data
+
+                start = time.time()
+                results = await asyncio.gather(
+                    read_slowly(), read_slowly(),
+                    dst.write(np.s_[0, :], -1))
+                self.assertLess(time.time() - start, 2)
+                np.testing.assert_array_equal(results[0], a[2:4])
+                np.testing.assert_array_equal(results[1], a[2:4])
+                self.assertEqual((await dst.read(0)).sum(), -10)
+
+                out = np.empty((10, ))
+                await dst.read(np.s_[5], out=out)
+                np.testing.assert_array_equal(out, a[5])
+                async with f.write_session():
+                    await dst.resize(12, axis=0)
+                    await dst.write(np.s_[10:12], 0)
+                self.assertEqual(await dst.shape(), (12, 10))
+                await f.delete('/aio')
+                self.assertFalse(await f.contains('/aio'))
+            await aio.close()
+
+        asyncio.run(main())
+        self.assertEqual(
+            locking.redis_conn.zcard('readers__{0}'.format(self.filename)),
+            0)
+
+    def test_aio_cancel(self):
+        """
+        Cancelled tasks do not release locks early and do not lose locks
+        acquired in the thread pool
+        """
+        from h5pyswmr import aio
+        from h5pyswmr.fcntlbackend import FcntlBackend
+        w = 'w__{0}'.format(self.filename)
+        held = []
+
+        def write_slowly():
+            time.sleep(0.3)
+            held.append(locking.redis_conn.exists(w))
+
+        async def cancel(coro):
+            task = asyncio.ensure_future(coro)
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        async def acquire():
+            async with aio.session(self.filename, 'w'):
+                pass
+
+        async def main():
+            await cancel(aio._run(self.filename, 'w', write_slowly))
+            # the lock has been held until write_slowly() has returned
+            self.assertEqual(held, [1])
+            self.assertFalse(locking.redis_conn.exists(w))
+
+            backend = locking.lock_backend = FcntlBackend(lock_dir)
+            token = backend.acquire_write(self.filename)
+            asyncio.get_running_loop().call_later(
+                0.3, backend.release_write, self.filename, token)
+            # the lock acquired after cancellation is released
+            await cancel(acquire())
+            self.assertEqual(len(backend._fds), 0)
+            await aio.close()
+
+        lock_dir = tempfile.mkdtemp()
+        try:
+            asyncio.run(main())
+        finally:
+            locking.lock_backend = locking.RedisBackend()
+            shutil.rmtree(lock_dir)
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), "requires /dev/shm")
+    def test_parallel_read(self):
+        """
+        Test reading with a process pool
+        """
+        a = np.random.random((50, 20))
+        with File(self.filename, 'a') as f:
+            dst = f.create_dataset(name='/par', data=a, chunks=(4, 20),
+                                   compression='gzip')
+            for selection in (Ellipsis, np.s_[3:47, 5:10], np.s_[:, 3],
+                              np.s_[7], np.s_[::2]):
+                np.testing.assert_array_equal(
+                    dst.parallel_read(selection, workers=3), a[selection])
+            with File(self.filename, 'r').read_session():
+                np.testing.assert_array_equal(dst.parallel_read(workers=3), a)
+        leftovers = [name for name in os.listdir('/dev/shm')
+                     if name.startswith('h5pyswmr_read_')]
+        self.assertEqual(leftovers, [])
+
+    def test_write_many(self):
+        """
+        Test writing several datasets at once (with a write buffer)
+        """
+        a = np.arange(100, dtype=np.float64).reshape((10, 10))
+        with File(self.filename, 'a') as f:
+            locking.reset_wait_stats()
+            with f.write_buffer() as buf:
+                buf.create_group('/grp')
+                buf.create_dataset(name='/grp/a', shape=(10, 10), dtype='f8')
+                for i in range(10):
+                    buf.write('/grp/a', np.s_[i:i + 1, :], a[i:i + 1, :])
+                buf.write('/grp/a', np.s_[2:4, :], np.zeros((2, 10)))
+                buf.set_attr('/grp/a', 'units', 'm')
+                # rows have been coalesced into a single write
+                self.assertEqual(len(buf), 4)
+            stats = locking.get_wait_stats()['w__{0}'.format(f.file)]
+            self.assertEqual(stats['acquisitions'], 1)
+
+            expected = a.copy()
+            expected[2:4, :] = 0
+            np.testing.assert_array_equal(f['/grp/a'][:], expected)
+            self.assertEqual(f['/grp/a'].attrs['units'], 'm')
+
+            f.write_many(writes=[('/grp/a', 0, np.ones(10)),
+                                 ('grp/a', np.s_[1, :], np.ones(10) * 2)])
+            np.testing.assert_array_equal(f['/grp/a'][0:2, :],
+                                          [np.ones(10), np.ones(10) * 2])
+
+            # relative and absolute paths refer to the same dataset
+            with f['/grp'].write_buffer() as buf:
+                buf.write('/grp/a', np.s_[0:2, :], np.ones((2, 10)))
+                buf.write('a', np.s_[0:2, :], np.ones((2, 10)) * 2)
+                buf.write('/grp/a', np.s_[0:4, :], np.ones((4, 10)) * 3)
+                self.assertEqual(len(buf), 1)
+            np.testing.assert_array_equal(f['/grp/a'][0:4, :], 3)
+
+    def test_metadata_cache(self):
+        """
+        Metadata is read without locks until the file is modified
+        """
+        r = 'r__{0}'.format(self.filename)
+        with File(self.filename, 'a') as f:
+            f['/bla'].attrs['units'] = 'm'
+            for i in range(10):
+                if i == 1:
+                    # metadata has been cached in the first iteration
+                    locking.reset_wait_stats()
+                dst = f['/bla']
+                self.assertEqual(dst.shape, (30, 30))
+                self.assertEqual(len(dst), 30)
+                self.assertEqual(dst.dtype, np.float32)
+                self.assertEqual(dst.attrs['units'], 'm')
+                self.assertIn('bla', f)
+                self.assertEqual(f.keys(), ['bla'])
+            self.assertNotIn(r, locking.get_wait_stats())
+
+            # modifications invalidate cached metadata
+            f.create_dataset(name='/blu', shape=(5, ), dtype='i4')
+            dst.attrs['units'] = 'km'
+            self.assertEqual(sorted(f.keys()), ['bla', 'blu'])
+            self.assertEqual(dst.attrs['units'], 'km')
+            self.assertEqual(f['blu'].shape, (5, ))
+            self.assertIsNone(f['blu'].compression)
+
+            # a generation counter that starts over (e.g., after
+            # util/redis_delkeys.py) does not revive cached metadata and
+            # open files, even if other processes write until it reaches
+            # its old value
+            self.assertEqual(f['bla'][0, 0], 0)
+            generation = locking.lock_backend.generation(self.filename)
+            locking.redis_conn.delete('generation__{0}'.format(self.filename))
+
+            def write():
+                with File(self.filename, 'a') as f:
+                    f['/bla'].attrs['units'] = 'mm'
+                    f['/bla'][0, 0] = 42
+
+            p = multiprocessing.Process(target=write)
+            p.start()
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+            # (shortcut for writing until the counter has caught up)
+            locking.redis_conn.set('generation__{0}'.format(self.filename),
+                                   generation.split(':')[1])
+            self.assertEqual(dst.attrs['units'], 'mm')
+            self.assertEqual(f['bla'][0, 0], 42)
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), "requires /dev/shm")
+    def test_chunk_cache(self):
+        """
+        Cached chunks are read without locks until the file is modified
+        """
+        r = 'r__{0}'.format(self.filename)
+        data = np.arange(30 * 20, dtype='i4').reshape(30, 20)
+        prefix = chunkcache.PREFIX
+        chunkcache.PREFIX = 'h5pyswmr_test_chunks_'
+        chunkcache.enable()
+        try:
+            with File(self.filename, 'a') as f:
+                dst = f.create_dataset(name='/chunked', data=data,
+                                       chunks=(7, 6), compression='gzip')
+                selections = [np.s_[:], np.s_[3:17, 5], np.s_[-1],
+                              np.s_[..., 2:19], np.s_[10:10]]
+                for i in range(3):
+                    if i == 1:
+                        locking.reset_wait_stats()
+                    for selection in selections:
+                        np.testing.assert_array_equal(dst[selection],
+                                                      data[selection])
+                out = np.zeros((14, ), dtype='i4')
+                dst.read(np.s_[3:17, 5], out=out)
+                np.testing.assert_array_equal(out, data[3:17, 5])
+                self.assertNotIn(r, locking.get_wait_stats())
+                # unsupported selections bypass the cache
+                np.testing.assert_array_equal(dst[::2], data[::2])
+
+                # modifications invalidate cached chunks
+                dst[3, 5] = -1
+                data[3, 5] = -1
+                np.testing.assert_array_equal(dst[:], data)
+                # metadata is kept for the latest generation only
+                keys = [key for key in chunkcache._info
+                        if key[0] == self.filename]
+                self.assertEqual(keys, [(self.filename, '/chunked')])
+
+                # generation counters that start over (e.g., after
+                # util/redis_delkeys.py) do not match old segments
+                self.assertEqual(dst[0, 0], data[0, 0])
+                generation = locking.lock_backend.generation(self.filename)
+                locking.redis_conn.delete(
+                    'generation__{0}'.format(self.filename))
+                data[0, 0] = 42
+                for _ in range(int(generation.split(':')[1])):
+                    dst[0, 0] = 42
+                self.assertNotEqual(
+                    locking.lock_backend.generation(self.filename),
+                    generation)
+                self.assertEqual(dst[0, 0], 42)
+
+                # size limit
+                chunkcache.MAX_BYTES = 1000
+                dst[0, 0] = data[0, 0] = -2
+                np.testing.assert_array_equal(dst[:], data)
+                self.assertLessEqual(
+                    sum(e.stat().st_size for e in chunkcache._segments()),
+                    1000)
+        finally:
+            chunkcache.clear()
+            chunkcache.disable()
+            chunkcache.PREFIX = prefix
+            chunkcache.MAX_BYTES = 256 * 2**20
+
+    def test_swmr(self):
+        """
+        Test native SWMR mode: writing to existing datasets does not block
+        readers
+        """
+        filename = os.path.join(tempfile.gettempdir(), 'test_swmr.h5')
+        with File(filename, 'w', backend='swmr') as f:
+            dst = f.create_dataset(name='/ts', shape=(0, 3),
+                                   maxshape=(None, 3), chunks=(10, 3),
+                                   dtype='f8')
+
+        def read():
+            with File(filename, 'r', backend='swmr').read_session() as f:
+                time.sleep(3)
+
+        p = multiprocessing.Process(target=read)
+        p.start()
+        readers = 'readers__{0}'.format(filename)
+        while locking.redis_conn.zcard(readers) != 1:
+            time.sleep(0.01)
+
+        start = time.time()
+        for i in range(5):
+            dst.resize(i + 1, axis=0)
+            dst[i, :] = i
+        self.assertEqual(dst.shape, (5, 3))
+        # writing did not wait for the reader
+        self.assertLess(time.time() - start, 2)
+        p.join()
+        np.testing.assert_array_equal(f['/ts'][:, 0], np.arange(5))
+
+        # a SWMR writer and a reader (in another thread) of the same process
+        entered = threading.Event()
+
+        def read_thread():
+            with File(filename, 'r', backend='swmr').read_session() as f:
+                f['/ts'][:]
+                entered.set()
+                time.sleep(0.5)
+
+        t = threading.Thread(target=read_thread)
+        t.start()
+        entered.wait()
+        dst[0, :] = 1
+        t.join()
+        np.testing.assert_array_equal(dst[0, :], np.ones(3))
+
+    def test_append(self):
+        """
+        Test Dataset.append() and Appender
+        """
+        with File(self.filename, 'a') as f:
+            dst = f.create_dataset(name='/ts', shape=(0, 3),
+                                   maxshape=(None, 3), chunks=(16, 3),
+                                   dtype='f8')
+            w = 'w__{0}'.format(f.file)
+            locking.reset_wait_stats()
+            self.assertEqual(dst.append([0, 0, 0]), 1)
+            self.assertEqual(dst.append(np.ones((2, 3))), 3)
+            self.assertEqual(locking.get_wait_stats()[w]['acquisitions'], 2)
+            self.assertEqual(dst.shape, (3, 3))
+
+            locking.reset_wait_stats()
+            with dst.appender(max_rows=4) as app:
+                for i in range(10):
+                    app.append(np.full(3, i + 2))
+                self.assertEqual(len(app), 2)
+            self.assertEqual(locking.get_wait_stats()[w]['acquisitions'], 3)
+            np.testing.assert_array_equal(dst[:, 0],
+                                          [0, 1, 1] + list(range(2, 12)))
+
+            # buffering rows does not access the dataset (not even its
+            # cached metadata)
+            metadata.ENABLED = False
+            try:
+                with dst.appender() as app:
+                    locking.reset_wait_stats()
+                    for i in range(10):
+                        app.append(np.zeros(3))
+                    self.assertEqual(locking.get_wait_stats(), {})
+                    app._clear()
+            finally:
+                metadata.ENABLED = True
+
+            # geometric growth: readers (of other processes) only see the
+            # valid rows while the dataset is larger
+            def read(queue):
+                dst = Dataset(self.filename, '/ts')
+                out = np.empty((14, 3))
+                dst.read_direct(out)
+                queue.put((len(dst), dst.shape, dst[-1, 0], dst[:].shape,
+                           out[-1, 0], sum(len(block) for _, block
+                                           in dst.iter_blocks(5)),
+                           f.read_many([('/ts', Ellipsis)])[0].shape))
+
+            with dst.appender(max_rows=1, growth=2) as app:
+                app.append(np.full(3, 12))
+                self.assertEqual(dst.attrs['h5pyswmr_shape'].tolist(),
+                                 [14, 3])
+                with locking.read_lock(f.file):
+                    with handles.open_file(f.file, 'r') as h5f:
+                        self.assertEqual(h5f['/ts'].shape, (26, 3))
+                queue = multiprocessing.Queue()
+                p = multiprocessing.Process(target=read, args=(queue, ))
+                p.start()
+                self.assertEqual(queue.get(timeout=10),
+                                 (14, (14, 3), 12, (14, 3), 12, 14, (14, 3)))
+                p.join()
+                app.append(np.full(3, 13))
+                self.assertEqual(len(dst), 15)
+            self.assertEqual(dst.shape, (15, 3))
+            self.assertNotIn('h5pyswmr_shape', dst.attrs)
+            np.testing.assert_array_equal(dst[-3:, 0], [11, 12, 13])
+
+    def test_object_locks(self):
+        """
+        With dataset granularity, a writer only blocks readers of the
+        dataset it modifies
+        """
+        filename = os.path.join(tempfile.gettempdir(), 'test_objlocks.h5')
+        with File(filename, 'w', backend='swmr', granularity='dataset') as f:
+            a = f.create_dataset(name='/a', shape=(10, ), dtype='f8')
+            b = f.create_dataset(name='/b', shape=(10, ), dtype='f8')
+        a[:] = 1
+        b[:] = 2
+
+        def write():
+            with locking.session(locking.object_lockname(filename, '/a'),
+                                 'w'):
+                time.sleep(1)
+
+        p = multiprocessing.Process(target=write)
+        p.start()
+        lockname = 'w__{0}'.format(locking.object_lockname(filename, '/a'))
+        while not locking.redis_conn.exists(lockname):
+            time.sleep(0.01)
+        start = time.time()
+        np.testing.assert_array_equal(b[:], np.full(10, 2.))
+        self.assertLess(time.time() - start, 0.5)
+        np.testing.assert_array_equal(a[:], np.ones(10))
+        self.assertGreater(time.time() - start, 0.5)
+        p.join()
+        a[:] = 3
+        np.testing.assert_array_equal(a[:], np.full(10, 3.))
+
+        # read_many() and visititems() read lock the datasets they read,
+        # i.e., they do not see partial writes of SWMR writers
+        def write_in_parts():
+            with locking.session(locking.object_lockname(filename, '/a'),
+                                 'w'):
+                a[0:5] = 4
+                time.sleep(1)
+                a[5:10] = 4
+
+        f = File(filename, 'r', backend='swmr', granularity='dataset')
+        p = multiprocessing.Process(target=write_in_parts)
+        p.start()
+        while not locking.redis_conn.exists(lockname):
+            time.sleep(0.01)
+        start = time.time()
+        np.testing.assert_array_equal(f.read_many([('/b', Ellipsis)])[0],
+                                      np.full(10, 2.))
+        self.assertLess(time.time() - start, 0.5)
+        data = f.read_many([('/b', Ellipsis), ('/a', Ellipsis)])
+        self.assertGreater(time.time() - start, 0.5)
+        np.testing.assert_array_equal(data[1], np.full(10, 4.))
+        p.join()
+        self.assertEqual(p.exitcode, 0)
+
+        p = multiprocessing.Process(target=write)
+        p.start()
+        while not locking.redis_conn.exists(lockname):
+            time.sleep(0.01)
+        start = time.time()
+        visited = []
+        f.visititems(lambda name, node: visited.append(name))
+        self.assertGreater(time.time() - start, 0.5)
+        self.assertEqual(visited, ['a', 'b'])
+        p.join()
+
+        with self.assertRaises(ValueError):
+            File(self.filename, 'r', granularity='dataset')
+
     def tearDown(self):
         # TODO remove self.filename
         pass
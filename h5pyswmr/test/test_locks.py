@@ -5,11 +5,17 @@ from __future__ import print_function
 import unittest
 import sys
 import os
-from multiprocessing import Process
+from multiprocessing import Process, Queue
+import shutil
+import tempfile
 import time
 import random
 import signal
+import threading
 import uuid
+import warnings
+
+import redis
 
 
 if __name__ == '__main__':
@@ -19,6 +25,8 @@ if __name__ == '__main__':
     PROJ_PATH = os.path.abspath(os.path.join(HERE, '../..'))
     sys.path.insert(0, PROJ_PATH)
 
+from h5pyswmr import exithandler, instrumentation, locking
+from h5pyswmr.fcntlbackend import FcntlBackend
 from h5pyswmr.locking import reader, writer, redis_conn
 
 
@@ -111,13 +119,462 @@ class TestLocks(unittest.TestCase):
         for key in redis_conn.keys():
             if res_name not in key:
                 continue
-            if (key == 'readcount__{0}'.format(res_name)
-                    or key == 'writecount__{0}'.format(res_name)):
-                assert(redis_conn[key] == u'0')
+            if key in ('generation__{0}'.format(res_name),
+                       'epoch__{0}'.format(res_name)):
+                # write generation is not a lock
+                pass
             else:
                 raise AssertionError("Lock '{0}' was not released!"
                                      .format(key))
 
+    def test_writer_preference(self):
+        """
+        A waiting writer blocks readers arriving after it
+        """
+        res_name = 'test_preference{0}'.format(uuid.uuid4())
+        log = 'log__{0}'.format(res_name)
+
+        class Resource(DummyResource):
+            @reader
+            def read(self, name):
+                time.sleep(1)
+                redis_conn.rpush(log, name)
+
+            @writer
+            def write(self, name):
+                time.sleep(0.5)
+                redis_conn.rpush(log, name)
+
+        resource = Resource(res_name)
+        jobs = [Process(target=resource.read, args=('reader1', )),
+                Process(target=resource.write, args=('writer', )),
+                Process(target=resource.read, args=('reader2', ))]
+        for p in jobs:
+            p.start()
+            time.sleep(0.2)
+        for p in jobs:
+            p.join()
+
+        self.assertEqual(redis_conn.lrange(log, 0, -1),
+                         ['reader1', 'writer', 'reader2'])
+        redis_conn.delete(log)
+
+    def test_fairness(self):
+        """
+        With a fairness policy, a reader waiting for a writer enters before
+        writers arriving after it
+        """
+        class Resource(DummyResource):
+            @reader
+            def read(self, name):
+                redis_conn.rpush(self.log, name)
+
+            @writer
+            def write(self, name):
+                time.sleep(0.5)
+                redis_conn.rpush(self.log, name)
+
+        for policy in locking.FairRedisBackend.POLICIES:
+            locking.lock_backend = locking.FairRedisBackend(policy)
+            try:
+                res_name = 'test_fairness{0}'.format(uuid.uuid4())
+                resource = Resource(res_name)
+                resource.log = 'log__{0}'.format(res_name)
+                jobs = [Process(target=resource.write, args=('writer1', )),
+                        Process(target=resource.read, args=('reader', )),
+                        Process(target=resource.write, args=('writer2', ))]
+                for p in jobs:
+                    p.start()
+                    time.sleep(0.2)
+                for p in jobs:
+                    p.join()
+                self.assertEqual(redis_conn.lrange(resource.log, 0, -1),
+                                 ['writer1', 'reader', 'writer2'])
+                redis_conn.delete(resource.log)
+                for key in ('queue', 'waiters', 'phases', 'readers', 'w'):
+                    self.assertFalse(redis_conn.exists(
+                        '{0}__{1}'.format(key, res_name)))
+            finally:
+                locking.lock_backend = locking.RedisBackend()
+
+        with self.assertRaises(ValueError):
+            locking.FairRedisBackend('random')
+
+    def test_wait(self):
+        """
+        Readers wait for writers (with and without pub/sub notifications)
+        and wait times are recorded
+        """
+        class Resource(DummyResource):
+            @writer
+            def write(self):
+                time.sleep(0.5)
+
+        for mode in ('pubsub', 'poll'):
+            locking.WAIT_MODE = mode
+            try:
+                res_name = 'test_wait{0}'.format(uuid.uuid4())
+                resource = Resource(res_name)
+                r = 'r__{0}'.format(res_name)
+                p = Process(target=resource.write)
+                p.start()
+                # wait until the writer has entered
+                while not redis_conn.exists(r):
+                    time.sleep(0.01)
+                locking.reset_wait_stats()
+                resource.read(1)
+                p.join()
+                stats = locking.get_wait_stats()[r]
+                self.assertEqual(stats['acquisitions'], 1)
+                self.assertEqual(stats['waits'], 1)
+                self.assertGreater(stats['total_wait'], 0)
+            finally:
+                locking.WAIT_MODE = 'pubsub'
+
+    def test_instrumentation(self):
+        """
+        Lock operations are reported to instrumentation hooks
+        """
+        res_name = 'test_instrumentation{0}'.format(uuid.uuid4())
+        metrics = instrumentation.Metrics()
+        events = []
+        instrumentation.add_hook(metrics)
+        instrumentation.add_hook(events.append)
+        try:
+            with locking.write_lock(res_name):
+                time.sleep(0.01)
+
+            def write():
+                with locking.write_lock(res_name):
+                    time.sleep(0.3)
+            p = Process(target=write)
+            p.start()
+            while not redis_conn.exists('r__{0}'.format(res_name)):
+                time.sleep(0.01)
+            with locking.read_lock(res_name):
+                pass
+            p.join()
+        finally:
+            instrumentation.remove_hook(metrics)
+            instrumentation.remove_hook(events.append)
+        self.assertEqual(instrumentation.hooks, [])
+
+        snapshot = metrics.snapshot()
+        hold = snapshot[('hold', res_name, 'write')]
+        self.assertEqual(hold['count'], 1)
+        self.assertGreaterEqual(hold['sum'], 0.01)
+        self.assertEqual(snapshot[('acquire', res_name, 'read')]['count'], 1)
+        self.assertGreater(snapshot[('wait', res_name, 'r')]['sum'], 0.1)
+        self.assertGreater(snapshot[('retries', res_name, 'r')], 0)
+        self.assertEqual(
+            snapshot[('round_trip', res_name, 'writer_enter')]['count'], 1)
+        kinds = [e.kind for e in events if e.lock in ('read', 'write')]
+        self.assertEqual(kinds, ['acquire', 'hold', 'acquire', 'hold'])
+
+        text = metrics.prometheus()
+        self.assertIn('# TYPE h5pyswmr_hold_seconds histogram', text)
+        self.assertIn('h5pyswmr_hold_seconds_count{{file="{0}",lock="write"}} 1'
+                      .format(res_name), text)
+        self.assertIn('h5pyswmr_hold_seconds_bucket{{file="{0}",lock="write",'
+                      'le="+Inf"}} 1'.format(res_name), text)
+        self.assertIn('# TYPE h5pyswmr_retries_total counter', text)
+
+    def test_fcntl_backend(self):
+        """
+        fcntl backend: writer preference, write generations and release of
+        locks held by killed processes
+        """
+        lock_dir = tempfile.mkdtemp()
+        locking.lock_backend = FcntlBackend(lock_dir)
+        try:
+            res_name = 'test_fcntl{0}'.format(uuid.uuid4())
+            log = Queue()
+
+            class Resource(DummyResource):
+                @reader
+                def read(self, name):
+                    time.sleep(1)
+                    log.put(name)
+
+                @writer
+                def write(self, name):
+                    time.sleep(0.5)
+                    log.put(name)
+
+            resource = Resource(res_name)
+            jobs = [Process(target=resource.read, args=('reader1', )),
+                    Process(target=resource.write, args=('writer', )),
+                    Process(target=resource.read, args=('reader2', ))]
+            for p in jobs:
+                p.start()
+                time.sleep(0.2)
+            for p in jobs:
+                p.join()
+            self.assertEqual([log.get() for _ in jobs],
+                             ['reader1', 'writer', 'reader2'])
+
+            with locking.read_lock(res_name):
+                generation = locking.current_generation(res_name)
+                self.assertTrue(generation.endswith(':1'))
+            self.assertEqual(locking.lock_backend.generation(res_name),
+                             generation)
+
+            # a process killed while writing does not block others
+            def write_forever():
+                with locking.write_lock(res_name):
+                    log.put('writing')
+                    time.sleep(60)
+            p = Process(target=write_forever)
+            p.start()
+            self.assertEqual(log.get(), 'writing')
+            with self.assertRaises(locking.LockException):
+                locking.lock_backend.acquire_read(res_name, acq_timeout=0.1)
+            os.kill(p.pid, signal.SIGKILL)
+            p.join()
+            with locking.read_lock(res_name):
+                self.assertEqual(locking.current_generation(res_name),
+                                 generation)
+
+            # a new lock file starts a new epoch: its generation counter
+            # starts over but does not match the old generation
+            os.unlink(locking.lock_backend.lock_file(
+                os.path.abspath(res_name)))
+            with locking.write_lock(res_name):
+                pass
+            with locking.read_lock(res_name):
+                self.assertNotEqual(locking.current_generation(res_name),
+                                    generation)
+
+            # lock names do not depend on the working directory
+            backend = locking.lock_backend
+            cwd = os.getcwd()
+            lock_file = backend.lock_file('swmrwriter__data.h5')
+            try:
+                os.chdir(lock_dir)
+                self.assertEqual(backend.lock_file('swmrwriter__data.h5'),
+                                 lock_file)
+            finally:
+                os.chdir(cwd)
+        finally:
+            locking.lock_backend = locking.RedisBackend()
+            shutil.rmtree(lock_dir)
+
+    def test_configure(self):
+        """
+        Connection pools are configurable and are not shared with forked
+        processes
+        """
+        class Resource(DummyResource):
+            @reader
+            def read(self):
+                pass
+
+            @writer
+            def write(self):
+                pass
+
+        def work(resource):
+            for _ in range(50):
+                resource.read()
+                resource.write()
+
+        try:
+            locking.configure(unix_socket_path='/tmp/redis.sock', pool_size=4)
+            pool = locking.redis_conn.connection_pool
+            self.assertEqual(pool.connection_kwargs['path'], '/tmp/redis.sock')
+            self.assertIsInstance(pool, redis.BlockingConnectionPool)
+            self.assertEqual(pool.max_connections, 4)
+
+            locking.configure(url='redis://localhost:6379/0', pool_size=8,
+                              socket_keepalive=True)
+            conn = locking.redis_conn
+            self.assertTrue(conn.ping())  # parent holds an idle connection
+            resource = Resource('test_configure{0}'.format(uuid.uuid4()))
+            jobs = [Process(target=work, args=(resource, ))
+                    for _ in range(4)]
+            for p in jobs:
+                p.start()
+            work(resource)
+            for p in jobs:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+            self.assertTrue(conn.ping())
+
+            # exhausted pools block (up to pool_timeout) instead of failing
+            locking.configure(pool_size=1, pool_timeout=5)
+            pool = locking.redis_conn.connection_pool
+            held = pool.get_connection('PING')
+            release = threading.Timer(0.2, pool.release, args=(held, ))
+            release.start()
+            self.assertTrue(locking.redis_conn.ping())
+            release.join()
+            locking.configure(pool_size=1, pool_timeout=0.1)
+            pool = locking.redis_conn.connection_pool
+            held = pool.get_connection('PING')
+            with self.assertRaises(redis.ConnectionError):
+                locking.redis_conn.ping()
+            pool.release(held)
+        finally:
+            locking.configure()
+
+    def test_leases(self):
+        """
+        Locks held longer than their timeout are renewed
+        """
+        res_name = 'test_leases{0}'.format(uuid.uuid4())
+        w = 'w__{0}'.format(res_name)
+        lease_timeout = locking.LEASE_TIMEOUT
+        locking.LEASE_TIMEOUT = 1
+        try:
+            with locking.write_lock(res_name):
+                self.assertLessEqual(redis_conn.pttl(w), 1000)
+                time.sleep(3)
+                self.assertTrue(redis_conn.exists(w))
+            with locking.read_lock(res_name):
+                time.sleep(3)
+                self.assertTrue(redis_conn.exists(w))
+            self.assertFalse(redis_conn.exists(w))
+
+            # failed renewals are reported
+            class Broken(object):
+                def evalsha(self, *args):
+                    raise ConnectionError("redis server is down")
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                lease = locking.add_lease(Broken(), w, 'x')
+                time.sleep(1)
+                locking.remove_lease(lease)
+            self.assertTrue(any('could not renew lock' in str(warning.message)
+                                for warning in caught))
+        finally:
+            locking.LEASE_TIMEOUT = lease_timeout
+
+    def test_dead_readers(self):
+        """
+        Registrations of killed readers do not block writers
+        """
+        res_name = 'test_dead_readers{0}'.format(uuid.uuid4())
+        readers = 'readers__{0}'.format(res_name)
+        resource = DummyResource(res_name)
+
+        def read_forever():
+            with locking.read_lock(res_name):
+                time.sleep(60)
+
+        p = Process(target=read_forever)
+        p.start()
+        while redis_conn.zcard(readers) != 1:
+            time.sleep(0.01)
+        os.kill(p.pid, signal.SIGKILL)
+        p.join()
+        start = time.time()
+        resource.write(1)
+        # the reaper has removed the registration of the dead reader (its
+        # lock would have expired only after LEASE_TIMEOUT seconds)
+        self.assertLess(time.time() - start,
+                        locking.REAP_INTERVAL + 1.5)
+        self.assertFalse(redis_conn.exists(readers))
+
+        # only registrations of the same host identity (boot and pid
+        # namespace) are reaped: the pid may belong to another container
+        redis_conn.zadd(readers, {
+            '{0}:{1}:x'.format(locking._HOST_ID, p.pid): 2**50,
+            '{0}/other:{1}:x'.format(locking._HOST_ID, p.pid): 2**50})
+        self.assertEqual(locking.reap_readers(res_name), 1)
+        self.assertEqual(redis_conn.zrange(readers, 0, -1),
+                         ['{0}/other:{1}:x'.format(locking._HOST_ID, p.pid)])
+        redis_conn.delete(readers)
+
+        # registrations expire if they are not renewed
+        redis_conn.zadd(readers, {'otherhost:1:x': 0})
+        with locking.read_lock(res_name):
+            self.assertEqual(redis_conn.zcard(readers), 1)
+        self.assertFalse(redis_conn.exists(readers))
+
+    def test_dead_writers(self):
+        """
+        Registrations of killed (waiting) writers do not block readers
+        """
+        res_name = 'test_dead_writers{0}'.format(uuid.uuid4())
+        writers = 'writers__{0}'.format(res_name)
+        r = 'r__{0}'.format(res_name)
+
+        def write():
+            with locking.write_lock(res_name):
+                pass
+
+        with locking.read_lock(res_name):
+            # the writer waits for us
+            p = Process(target=write)
+            p.start()
+            while redis_conn.zcard(writers) != 1:
+                time.sleep(0.01)
+            os.kill(p.pid, signal.SIGKILL)
+            p.join()
+        # r has been left over by the killed writer, readers reap its
+        # registration
+        self.assertTrue(redis_conn.exists(r))
+        start = time.time()
+        with locking.read_lock(res_name):
+            pass
+        self.assertLess(time.time() - start, locking.REAP_INTERVAL + 0.5)
+        self.assertFalse(redis_conn.exists(writers))
+
+        # uncontended writers release r
+        for _ in range(3):
+            with locking.write_lock(res_name):
+                pass
+            self.assertFalse(redis_conn.exists(r))
+            start = time.time()
+            with locking.read_lock(res_name):
+                pass
+            self.assertLess(time.time() - start, 0.5)
+
+    def test_sigterm_threads(self):
+        """
+        Locks of all threads are released if a process is terminated
+        """
+        res_name = 'test_sigterm_threads{0}'.format(uuid.uuid4())
+        # the SIGTERM handler is installed by the main thread (and inherited
+        # by forked child processes)
+        old_handler = signal.getsignal(signal.SIGTERM)
+        old_installed = exithandler._installed
+        exithandler._installed = False
+        exithandler.install()
+        try:
+            self._sigterm_threads(res_name)
+        finally:
+            signal.signal(signal.SIGTERM, old_handler)
+            exithandler._installed = old_installed
+
+    def _sigterm_threads(self, res_name):
+        readers = 'readers__{0}'.format(res_name)
+
+        def read_forever():
+            with locking.read_lock(res_name):
+                time.sleep(60)
+
+        def main():
+            for i in range(3):
+                t = threading.Thread(target=read_forever)
+                t.daemon = True
+                t.start()
+            # nested sessions in the main thread
+            with locking.session(res_name, 'r'):
+                with locking.read_lock(res_name):
+                    time.sleep(60)
+
+        p = Process(target=main)
+        p.start()
+        while redis_conn.zcard(readers) != 5:
+            time.sleep(0.01)
+        os.kill(p.pid, signal.SIGTERM)
+        p.join()
+        self.assertEqual(p.exitcode, 128 + signal.SIGTERM)
+        # released without waiting for the locks to expire
+        self.assertFalse(redis_conn.exists(readers))
+        self.assertFalse(redis_conn.exists('w__{0}'.format(res_name)))
+
     # def test_locks_manywriters(self):
     #     """
     #     Test locking with many writers and only one reader
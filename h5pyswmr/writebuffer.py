@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side buffer for writing operations.
+
+Writing is expensive: every writer blocks all readers and opens (and flushes)
+the file. A WriteBuffer collects writing operations and performs them under
+a single write lock (cf. Group.write_many()). Before that, writes to the same
+dataset are coalesced where possible:
+
+* a write replaces the previous write to the same dataset if it covers it,
+* a write is copied into the previous write to the same dataset if it is
+  contained in it,
+* adjacent writes (e.g., consecutive rows) are concatenated.
+
+Coalescing is restricted to hyperslabs given as tuples of slices (with step
+1 and non-negative start/stop, one slice per axis) whose values have exactly
+the shape of the hyperslab, e.g.,
+``buf.write('/a', np.s_[10:20, :], np.zeros((10, 5)))``.
+Other writes are performed as they are.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+
+
+class WriteBuffer(object):
+    """
+    Collects writing operations on a group (or file), cf. module docstring.
+    Note that buffered operations are performed in the following order when
+    the buffer is flushed: groups are created, then datasets are created,
+    then data is written, then attributes are set.
+
+    Example:
+        with WriteBuffer(f) as buf:
+            buf.create_dataset(name='/a', shape=(100, 5), dtype='f8')
+            for i in range(100):
+                buf.write('/a', np.s_[i:i+1, :], np.random.random((1, 5)))
+            buf.set_attr('/a', 'units', 'm/s')
+        # operations have been performed (with a single write lock)
+    """
+
+    def __init__(self, group, max_bytes=None):
+        """
+        Args:
+            group: Group or File object
+            max_bytes: if not None, the buffer is flushed as soon as buffered
+                data exceeds ``max_bytes`` bytes
+        """
+        self.group = group
+        self.max_bytes = max_bytes
+        self._clear()
+
+    def _clear(self):
+        self._groups = []
+        self._datasets = []
+        self._writes = []    # list of [path, selection, value, box]
+        self._last = {}      # path => last element of self._writes
+        self._attrs = []
+        self._nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.flush()
+
+    def __len__(self):
+        """
+        Returns the number of buffered operations.
+        """
+        return (len(self._groups) + len(self._datasets) + len(self._writes)
+                + len(self._attrs))
+
+    @property
+    def nbytes(self):
+        """
+        Size of buffered data in bytes
+        """
+        return self._nbytes
+
+    def create_group(self, name):
+        """
+        Buffers the creation of a group (if it does not exist yet).
+        """
+        self._groups.append(name)
+
+    def create_dataset(self, **kwargs):
+        """
+        Buffers the creation of a dataset, cf. Group.create_dataset().
+        """
+        self._datasets.append(kwargs)
+
+    def set_attr(self, path, key, value):
+        """
+        Buffers setting attribute ``key`` of object ``path``.
+        """
+        self._attrs.append((path, key, value))
+
+    def write(self, path, selection, value):
+        """
+        Buffers writing ``value`` to ``selection`` of dataset ``path``, cf.
+        Dataset.__setitem__(). Note that ``value`` is copied.
+        """
+        # relative and absolute paths of the same dataset must be coalesced
+        # with each other
+        path = self.group._absolute_path(path)
+        value = np.array(value)
+        box = _box(selection, value)
+        last = self._last.get(path)
+        if box is not None and last is not None and last[3] is not None:
+            merged = _merge(last[3], last[2], box, value)
+            if merged is not None:
+                self._nbytes += merged[1].nbytes - last[2].nbytes
+                last[1] = tuple(slice(start, stop)
+                                for start, stop in merged[0])
+                last[2] = merged[1]
+                last[3] = merged[0]
+                self._check_size()
+                return
+
+        write = [path, selection, value, box]
+        self._writes.append(write)
+        self._last[path] = write
+        self._nbytes += value.nbytes
+        self._check_size()
+
+    def flush(self):
+        """
+        Performs all buffered operations under a single write lock.
+        """
+        if len(self) == 0:
+            return
+        self.group.write_many(
+            writes=[(path, selection, value)
+                    for path, selection, value, _ in self._writes],
+            datasets=self._datasets, groups=self._groups, attrs=self._attrs)
+        self._clear()
+
+    def _check_size(self):
+        if self.max_bytes is not None and self._nbytes > self.max_bytes:
+            self.flush()
+
+
+def _box(selection, value):
+    """
+    Returns the hyperslab ``selection`` as a list of (start, stop) pairs if
+    ``value`` has the same shape, None otherwise. Note that stop is None
+    along axes that are selected as a whole (``:``).
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection, )
+    if len(selection) != value.ndim:
+        return None
+    box = []
+    for index, size in zip(selection, value.shape):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            return None
+        start = 0 if index.start is None else index.start
+        stop = index.stop
+        if stop is None:
+            if start != 0:
+                return None
+        elif start < 0 or stop - start != size:
+            return None
+        box.append((start, stop))
+    return box
+
+
+def _merge(box1, value1, box2, value2):
+    """
+    Coalesces a write (``box2``, ``value2``) with the previous write
+    (``box1``, ``value1``) to the same dataset.
+
+    Returns:
+        (box, value) of the coalesced write or None if the writes cannot be
+        coalesced
+    """
+    if len(box1) != len(box2):
+        return None
+    # axes selected as a whole must be the same in both writes
+    for axis, (ext1, ext2) in enumerate(zip(box1, box2)):
+        if ext1[1] is None or ext2[1] is None:
+            if ext1 != ext2 or value1.shape[axis] != value2.shape[axis]:
+                return None
+
+    def contains(outer, inner):
+        return all(o[1] is None or (o[0] <= i[0] and i[1] <= o[1])
+                   for o, i in zip(outer, inner))
+
+    # second write covers the first one
+    if contains(box2, box1):
+        return box2, value2
+    # second write is contained in the first one
+    if contains(box1, box2):
+        value = value1.copy()
+        value[tuple(slice(None) if stop2 is None
+                    else slice(start2 - start1, stop2 - start1)
+                    for (start1, _), (start2, stop2)
+                    in zip(box1, box2))] = value2
+        return box1, value
+    # writes are adjacent along one axis and have the same extent along
+    # all other axes
+    differing = [axis for axis in range(len(box1))
+                 if box1[axis] != box2[axis]]
+    if len(differing) == 1:
+        axis = differing[0]
+        (start1, stop1), (start2, stop2) = box1[axis], box2[axis]
+        box = list(box1)
+        if stop1 == start2:
+            box[axis] = (start1, stop2)
+            return box, np.concatenate((value1, value2), axis=axis)
+        elif stop2 == start1:
+            box[axis] = (start2, stop1)
+            return box, np.concatenate((value2, value1), axis=axis)
+    return None
@@ -6,7 +6,7 @@ import time
 import os
 import signal
 
-# This is executed only with handle_exit()
+# This is executed only with exithandler.install()
 # @atexit.register
 # def cleanup():
 #     # ==== XXX ====
@@ -27,13 +27,14 @@ if __name__ == '__main__':
     PROJ_PATH = os.path.abspath(os.path.join(HERE, '..'))
     sys.path.insert(0, PROJ_PATH)
 
-    from h5pyswmr.exithandler import handle_exit
+    from h5pyswmr import exithandler
 
-    with handle_exit():
+    exithandler.install()
+    with exithandler.cleanup(lambda: print("released")):
         try:
             main()
         except (KeyboardInterrupt, SystemExit):
             pass
         finally:
-            # this gets called thanks to handle_exit()
+            # this gets called thanks to exithandler.install()
             print("cleanup")
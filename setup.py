@@ -29,6 +29,6 @@ setup(
     install_requires=[
         "cython>= 0.23.0",
         "h5py >= 2.5.0",
-        "redis >= 2.10.3"
+        "redis >= 3.5.0"
     ]
 )